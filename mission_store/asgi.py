@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mission_store.settings')
+os.environ.setdefault('SHOP_ASYNC_VIEWS', '1')
+os.environ.setdefault('SHOP_AUDIT_LOG_BUFFER', '1')
 
 application = get_asgi_application()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -122,6 +123,48 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+
+# Cache compartilhado entre os workers (versao do catalogo, etc.)
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# As chaves por pedido (versao do status, consulta ao MP) ficam num cache
+# proprio: o corte aleatorio ao passar de MAX_ENTRIES so descarta chaves que
+# se refazem sozinhas, nunca a versao do catalogo ou o heartbeat do conciliador.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+        'OPTIONS': {'MAX_ENTRIES': 1000, 'CULL_FREQUENCY': 4},
+    },
+    'orders': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'orders',
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('SHOP_ORDER_CACHE_MAX_ENTRIES', '5000')), 'CULL_FREQUENCY': 3},
+    },
+}
+
+
+# Onde o carrinho da loja fica guardado:
+# - 'shop.cart.SignedCookieCartStore': cookie assinado, sem escrita no banco
+# - 'shop.cart.SessionCartStore': request.session (tabela django_session)
+# Carrinhos do outro backend sao migrados na proxima requisicao.
+
+SHOP_CART_BACKEND = 'shop.cart.SignedCookieCartStore'
+
+
+# Views de pagamento async (checkout_finalize, checkout_status, webhook) com o
+# cliente HTTP asyncio. O asgi.py liga por padrao; no WSGI ficam as versoes sync.
+
+SHOP_ASYNC_VIEWS = os.getenv('SHOP_ASYNC_VIEWS', '').strip().lower() in {'1', 'true', 'yes', 'on'}
+
+
+# Auditoria gravada em lote por uma thread (shop.audit_buffer) em vez de um
+# INSERT por requisicao. O wsgi.py e o asgi.py ligam por padrao; testes e
+# comandos gravam direto.
+
+SHOP_AUDIT_LOG_BUFFER = os.getenv('SHOP_AUDIT_LOG_BUFFER', '').strip().lower() in {'1', 'true', 'yes', 'on'}
+
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
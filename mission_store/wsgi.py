@@ -12,5 +12,6 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mission_store.settings')
+os.environ.setdefault('SHOP_AUDIT_LOG_BUFFER', '1')
 
 application = get_wsgi_application()
@@ -3,11 +3,14 @@ from django.contrib import admin
 from .models import (
     DonationEntry,
     Order,
+    PaymentAttempt,
+    PaymentWebhookEvent,
     Product,
     ProductVariant,
     ProfitDistributionConfig,
     ProfitDistributionEntry,
     ProfitDistributionPerson,
+    WhatsAppOutbox,
 )
 
 
@@ -24,12 +27,22 @@ class ProductAdmin(admin.ModelAdmin):
     inlines = [ProductVariantInline]
 
 
+class PaymentAttemptInline(admin.TabularInline):
+    model = PaymentAttempt
+    fk_name = 'order'
+    extra = 0
+    fields = ('provider', 'payment_id', 'status', 'status_detail', 'pix_code', 'created_at')
+    readonly_fields = fields
+    can_delete = False
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ('id', 'first_name', 'last_name', 'payment_method', 'total', 'created_at')
     list_filter = ('payment_method', 'created_at')
     search_fields = ('first_name', 'last_name', 'whatsapp')
-    readonly_fields = ('pix_code', 'items_json', 'created_at')
+    readonly_fields = ('current_payment', 'pix_code', 'items_json', 'created_at')
+    inlines = [PaymentAttemptInline]
 
 
 @admin.register(DonationEntry)
@@ -54,3 +67,19 @@ class ProfitDistributionEntryAdmin(admin.ModelAdmin):
     list_display = ('person', 'amount', 'created_at')
     list_filter = ('person', 'created_at')
     search_fields = ('person__name',)
+
+
+@admin.register(PaymentWebhookEvent)
+class PaymentWebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'payment_id', 'status', 'attempts', 'next_attempt_at', 'received_at', 'processed_at')
+    list_filter = ('status', 'received_at')
+    search_fields = ('payment_id', 'request_id')
+    readonly_fields = ('request_id', 'payment_id', 'payload', 'received_at', 'processed_at')
+
+
+@admin.register(WhatsAppOutbox)
+class WhatsAppOutboxAdmin(admin.ModelAdmin):
+    list_display = ('id', 'order', 'kind', 'phone', 'status', 'attempts', 'created_at', 'sent_at')
+    list_filter = ('status', 'kind', 'created_at')
+    search_fields = ('phone', 'order__id')
+    readonly_fields = ('order', 'kind', 'phone', 'message', 'created_at', 'sent_at')
@@ -0,0 +1,102 @@
+import math
+import threading
+
+
+class Admission:
+    def __init__(self, admitted, retry_after=0):
+        self.admitted = admitted
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    # Limita quantas operacoes ficam em andamento ao mesmo tempo neste processo.
+    # Quem chega com o limite cheio e recusado com um Retry-After estimado; nao
+    # ha fila nem posicao: o estado e so deste processo e a nova tentativa
+    # costuma cair em outro worker.
+    # O limite se ajusta a latencia observada: cai quando ela passa do alvo e
+    # sobe aos poucos enquanto fica abaixo (AIMD).
+    def __init__(
+        self,
+        name,
+        max_limit=8,
+        min_limit=1,
+        target_latency=2.0,
+        max_retry_after=30,
+    ):
+        self.name = name
+        self.max_limit = max(1, int(max_limit))
+        self.min_limit = max(1, min(int(min_limit), self.max_limit))
+        self.target_latency = target_latency
+        self.max_retry_after = max_retry_after
+        self._lock = threading.Lock()
+        self._limit = float(self.max_limit)
+        self._in_flight = 0
+        self._latency = None
+        self._hold_seconds = None
+        self._stats = {'admitted': 0, 'rejected': 0, 'latency_samples': 0, 'limit_decreases': 0}
+
+    @property
+    def limit(self):
+        return max(self.min_limit, int(self._limit))
+
+    def _retry_after(self):
+        # Estimativa: uma vaga abre depois do tempo medio de uma operacao.
+        hold = self._hold_seconds or self.target_latency
+        return max(1, min(self.max_retry_after, math.ceil(hold)))
+
+    def try_acquire(self):
+        with self._lock:
+            if self._in_flight < self.limit:
+                self._in_flight += 1
+                self._stats['admitted'] += 1
+                return Admission(True)
+            self._stats['rejected'] += 1
+            return Admission(False, self._retry_after())
+
+    def release(self, hold_seconds=None):
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+            if hold_seconds is not None:
+                self._hold_seconds = (
+                    hold_seconds if self._hold_seconds is None else self._hold_seconds * 0.8 + hold_seconds * 0.2
+                )
+
+    def observe_latency(self, seconds):
+        with self._lock:
+            self._latency = seconds if self._latency is None else self._latency * 0.8 + seconds * 0.2
+            self._stats['latency_samples'] += 1
+            if self._latency > self.target_latency:
+                if self._limit > self.min_limit:
+                    self._stats['limit_decreases'] += 1
+                self._limit = max(float(self.min_limit), self._limit * 0.75)
+            else:
+                self._limit = min(float(self.max_limit), self._limit + 1 / max(1.0, self._limit))
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self._stats)
+            data.update(
+                {
+                    'name': self.name,
+                    'limit': self.limit,
+                    'max_limit': self.max_limit,
+                    'min_limit': self.min_limit,
+                    'in_flight': self._in_flight,
+                    'latency_ms': int((self._latency or 0) * 1000),
+                    'target_latency_ms': int(self.target_latency * 1000),
+                }
+            )
+        return data
+
+
+_controllers_lock = threading.Lock()
+_controllers = {}
+
+
+def get_admission_controller(name, **options):
+    with _controllers_lock:
+        controller = _controllers.get(name)
+        if controller is None:
+            controller = AdmissionController(name, **options)
+            _controllers[name] = controller
+        return controller
@@ -0,0 +1,128 @@
+import atexit
+import logging
+import threading
+
+from django.db import close_old_connections, connection
+
+
+logger = logging.getLogger(__name__)
+
+
+class AuditLogBuffer:
+    # Junta as linhas de auditoria em memoria e grava em lote (bulk_create) a
+    # cada `batch_size` linhas ou `flush_interval` segundos, numa thread propria.
+    # Buffer cheio descarta a linha e conta o descarte: a requisicao nunca espera.
+    def __init__(self, name, max_rows=1000, batch_size=100, flush_interval=0.5):
+        self.name = name
+        self.max_rows = max(1, int(max_rows))
+        self.batch_size = max(1, min(int(batch_size), self.max_rows))
+        self.flush_interval = max(0.01, flush_interval)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._rows = []
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._stats = {'added': 0, 'written': 0, 'dropped': 0, 'failed': 0, 'flushes': 0}
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=f'audit-buffer-{self.name}', daemon=True)
+            self._thread.start()
+
+    def add(self, row):
+        with self._lock:
+            if self._stopping or len(self._rows) >= self.max_rows:
+                self._stats['dropped'] += 1
+                return False
+            self._rows.append(row)
+            self._stats['added'] += 1
+            if len(self._rows) >= self.batch_size:
+                self._wakeup.set()
+            self._ensure_thread()
+        return True
+
+    def _run(self):
+        try:
+            while True:
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                if self._stopping:
+                    return
+                close_old_connections()
+                self.flush()
+        finally:
+            connection.close()
+
+    def flush(self):
+        # Uma gravacao por vez: quem chega enquanto outra grava pega o que sobrou.
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+            model = type(rows[0])
+            written = 0
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                try:
+                    model.objects.bulk_create(batch)
+                    written += len(batch)
+                except Exception:
+                    logger.exception('Falha ao gravar %s linhas de auditoria', len(batch))
+                    with self._lock:
+                        self._stats['failed'] += len(batch)
+            with self._lock:
+                self._stats['written'] += written
+                self._stats['flushes'] += 1
+            return written
+
+    def close(self, timeout=5.0):
+        # Para a thread e grava o que restou na thread de quem chamou (ex.: atexit).
+        with self._lock:
+            self._stopping = True
+            thread = self._thread
+        self._wakeup.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+        return self.flush()
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self._stats)
+            data.update(
+                {
+                    'name': self.name,
+                    'buffered': len(self._rows),
+                    'max_rows': self.max_rows,
+                    'batch_size': self.batch_size,
+                    'flush_interval_ms': int(self.flush_interval * 1000),
+                }
+            )
+        return data
+
+
+_buffers_lock = threading.Lock()
+_buffers = {}
+
+
+def get_audit_log_buffer(name, **options):
+    with _buffers_lock:
+        buffer = _buffers.get(name)
+        if buffer is None:
+            buffer = AuditLogBuffer(name, **options)
+            _buffers[name] = buffer
+        return buffer
+
+
+def shutdown_audit_log_buffers():
+    with _buffers_lock:
+        buffers = list(_buffers.values())
+    for buffer in buffers:
+        try:
+            buffer.close()
+        except Exception:
+            logger.exception('Falha ao gravar auditoria pendente de %s', buffer.name)
+
+
+atexit.register(shutdown_audit_log_buffers)
@@ -0,0 +1,89 @@
+import asyncio
+import atexit
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections, connection
+
+
+logger = logging.getLogger(__name__)
+
+_executor_lock = threading.Lock()
+_executor = None
+# Referencias fortes: o event loop so guarda referencias fracas das tarefas.
+_async_tasks = set()
+
+
+def _background_workers():
+    try:
+        return max(1, int(os.getenv('SHOP_BACKGROUND_WORKERS', '4')))
+    except ValueError:
+        return 4
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=_background_workers(),
+                thread_name_prefix='shop-background',
+            )
+        return _executor
+
+
+def _run_task(func, args, kwargs):
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        logger.exception('Falha na tarefa em segundo plano %s', getattr(func, '__name__', func))
+        return None
+    finally:
+        # Cada thread do pool tem sua propria conexao; nao deixa aberta entre tarefas.
+        connection.close()
+
+
+def submit_background(func, *args, **kwargs):
+    # Executa fora da thread da requisicao (pool por processo). Chame dentro de
+    # transaction.on_commit quando a tarefa depende de linhas recem-gravadas.
+    return _get_executor().submit(_run_task, func, args, kwargs)
+
+
+def start_background_thread(func, *args, name=None, **kwargs):
+    # Thread propria para tarefas longas que passam o tempo esperando (ex.: o
+    # limite de taxa da W-API) e nao podem segurar uma vaga do pool acima.
+    thread = threading.Thread(target=_run_task, args=(func, args, kwargs), name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+async def _run_async_task(coro):
+    try:
+        return await coro
+    except Exception:
+        logger.exception('Falha na tarefa assincrona %s', getattr(coro, '__qualname__', coro))
+        return None
+
+
+def spawn_async(coro):
+    # Equivalente de submit_background para views async: a tarefa roda no event
+    # loop do servidor ASGI, sem ocupar thread enquanto espera rede.
+    task = asyncio.get_running_loop().create_task(_run_async_task(coro))
+    _async_tasks.add(task)
+    task.add_done_callback(_async_tasks.discard)
+    return task
+
+
+def shutdown_background(wait=True):
+    global _executor
+    with _executor_lock:
+        executor = _executor
+        _executor = None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+atexit.register(shutdown_background)
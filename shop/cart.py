@@ -0,0 +1,129 @@
+from django.conf import settings
+from django.core import signing
+from django.utils.module_loading import import_string
+
+
+CART_COOKIE_NAME = 'shop_cart'
+CART_COOKIE_SALT = 'shop.cart'
+# Navegadores aceitam ~4096 bytes por cookie (nome + valor + atributos).
+CART_COOKIE_MAX_BYTES = 3800
+SESSION_CART_KEY = 'cart'
+
+DEFAULT_CART_BACKEND = 'shop.cart.SignedCookieCartStore'
+
+
+class CartTooLargeError(ValueError):
+    pass
+
+
+def _normalize_cart(raw_cart):
+    if not isinstance(raw_cart, dict):
+        return {}
+    cart = {}
+    for item_key, qty in raw_cart.items():
+        try:
+            pid_text, vid_text = str(item_key).split(':', 1)
+            quantity = int(qty)
+            key = f'{int(pid_text)}:{int(vid_text)}'
+        except (ValueError, TypeError):
+            continue
+        if quantity > 0:
+            cart[key] = quantity
+    return cart
+
+
+def encode_cart(cart):
+    # "12:0:2|15:7:1" -> produto:variacao:quantidade, so caracteres validos em cookie.
+    return '|'.join(f'{item_key}:{qty}' for item_key, qty in _normalize_cart(cart).items())
+
+
+def decode_cart(value):
+    cart = {}
+    for chunk in (value or '').split('|'):
+        parts = chunk.split(':')
+        if len(parts) != 3:
+            continue
+        cart[f'{parts[0]}:{parts[1]}'] = parts[2]
+    return _normalize_cart(cart)
+
+
+def _has_session(request):
+    # So abre a sessao se o navegador ja tem uma; evita criar linha no banco.
+    return settings.SESSION_COOKIE_NAME in request.COOKIES
+
+
+def _read_signed_cart(request):
+    value = request.get_signed_cookie(
+        CART_COOKIE_NAME,
+        default=None,
+        salt=CART_COOKIE_SALT,
+        max_age=settings.SESSION_COOKIE_AGE,
+    )
+    if value is None:
+        return None
+    return decode_cart(value)
+
+
+# Carrinho em request.session; o cookie shop_cart so guarda a contagem.
+class SessionCartStore:
+    def load(self, request):
+        if not _has_session(request):
+            return _read_signed_cart(request) or {}
+        raw_cart = request.session.get(SESSION_CART_KEY)
+        if raw_cart is None:
+            # Carrinho que veio do backend de cookie assinado.
+            return _read_signed_cart(request) or {}
+        return _normalize_cart(raw_cart)
+
+    def save(self, request, response, cart):
+        cart = _normalize_cart(cart)
+        if cart or _has_session(request):
+            if request.session.get(SESSION_CART_KEY) != cart:
+                request.session[SESSION_CART_KEY] = cart
+        count = sum(cart.values())
+        if count > 0:
+            response.set_cookie(
+                CART_COOKIE_NAME,
+                str(count),
+                max_age=settings.SESSION_COOKIE_AGE,
+                samesite='Lax',
+            )
+        else:
+            response.delete_cookie(CART_COOKIE_NAME, samesite='Lax')
+        return response
+
+
+# Carrinho assinado no proprio cookie shop_cart: nenhuma escrita em django_session.
+class SignedCookieCartStore:
+    def load(self, request):
+        cart = _read_signed_cart(request)
+        if cart is not None:
+            return cart
+        if _has_session(request):
+            # Migracao: carrinhos antigos que ainda estao na sessao.
+            return _normalize_cart(request.session.get(SESSION_CART_KEY))
+        return {}
+
+    def save(self, request, response, cart):
+        encoded = encode_cart(cart)
+        if encoded:
+            # Mesmo formato de response.set_signed_cookie, medido antes de enviar.
+            signed_value = signing.get_cookie_signer(salt=CART_COOKIE_NAME + CART_COOKIE_SALT).sign(encoded)
+            if len(CART_COOKIE_NAME) + len(signed_value) > CART_COOKIE_MAX_BYTES:
+                raise CartTooLargeError('Carrinho com itens demais. Finalize este pedido antes de adicionar mais.')
+            response.set_cookie(
+                CART_COOKIE_NAME,
+                signed_value,
+                max_age=settings.SESSION_COOKIE_AGE,
+                samesite='Lax',
+            )
+        else:
+            response.delete_cookie(CART_COOKIE_NAME, samesite='Lax')
+        if _has_session(request) and SESSION_CART_KEY in request.session:
+            request.session.pop(SESSION_CART_KEY, None)
+        return response
+
+
+def get_cart_store():
+    backend_path = getattr(settings, 'SHOP_CART_BACKEND', DEFAULT_CART_BACKEND)
+    return import_string(backend_path)()
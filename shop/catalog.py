@@ -0,0 +1,133 @@
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Product, ProductVariant
+
+
+CATALOG_VERSION_CACHE_KEY = 'shop:catalog_version'
+
+_snapshot_lock = threading.Lock()
+_snapshot = None
+_snapshot_stats = {
+    'hits': 0,
+    'misses': 0,
+    'built_at': None,
+    'build_ms': 0,
+}
+
+
+def get_catalog_version():
+    version = cache.get(CATALOG_VERSION_CACHE_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_CACHE_KEY, time.time_ns(), timeout=None)
+        version = cache.get(CATALOG_VERSION_CACHE_KEY)
+    return version
+
+
+def _store_new_catalog_version():
+    cache.set(CATALOG_VERSION_CACHE_KEY, time.time_ns(), timeout=None)
+
+
+def bump_catalog_version():
+    # Invalida agora e de novo apos o commit: um snapshot montado no meio da
+    # transacao (com dados antigos) nunca fica associado a versao final.
+    _store_new_catalog_version()
+    transaction.on_commit(_store_new_catalog_version)
+
+
+def _price_index_entry(product, active_variants):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'price': product.price,
+        'image_source': product.image_source,
+        'variants': {
+            variant.id: {'id': variant.id, 'name': variant.name, 'price': variant.price}
+            for variant in active_variants
+        },
+    }
+
+
+def load_price_index(product_ids):
+    # Leitura direta do banco (precos autoritativos) no mesmo formato do indice
+    # em memoria; usada ao gravar pedidos.
+    products = Product.objects.filter(id__in=set(product_ids), active=True).prefetch_related('variants')
+    return {
+        product.id: _price_index_entry(
+            product,
+            [variant for variant in product.variants.all() if variant.active],
+        )
+        for product in products
+    }
+
+
+def _build_catalog_snapshot(version):
+    products = list(Product.objects.all().prefetch_related('variants').order_by('name'))
+    active_products = []
+    price_index = {}
+    for product in products:
+        product.active_variants = [variant for variant in product.variants.all() if variant.active]
+        product.display_price = product.price
+        if product.active:
+            active_products.append(product)
+            price_index[product.id] = _price_index_entry(product, product.active_variants)
+
+    return {
+        'version': version,
+        'products': products,
+        'active_products': active_products,
+        'price_index': price_index,
+    }
+
+
+def get_catalog_snapshot():
+    global _snapshot
+
+    version = get_catalog_version()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot['version'] == version:
+        with _snapshot_lock:
+            _snapshot_stats['hits'] += 1
+        return snapshot
+
+    with _snapshot_lock:
+        snapshot = _snapshot
+        if snapshot is not None and snapshot['version'] == version:
+            _snapshot_stats['hits'] += 1
+            return snapshot
+
+        started_at = time.perf_counter()
+        snapshot = _build_catalog_snapshot(version)
+        _snapshot = snapshot
+        _snapshot_stats['misses'] += 1
+        _snapshot_stats['built_at'] = time.time()
+        _snapshot_stats['build_ms'] = int((time.perf_counter() - started_at) * 1000)
+    return snapshot
+
+
+def get_price_index():
+    return get_catalog_snapshot()['price_index']
+
+
+def catalog_snapshot_stats():
+    with _snapshot_lock:
+        stats = dict(_snapshot_stats)
+        snapshot = _snapshot
+    total = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = round(stats['hits'] / total, 4) if total else 0.0
+    stats['version'] = snapshot['version'] if snapshot else None
+    stats['products'] = len(snapshot['products']) if snapshot else 0
+    return stats
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def _catalog_changed(sender, **kwargs):
+    bump_catalog_version()
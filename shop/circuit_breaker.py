@@ -0,0 +1,144 @@
+import threading
+import time
+
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+STATE_LABELS = {
+    STATE_CLOSED: 'Normal',
+    STATE_OPEN: 'Aberto (falha rapida)',
+    STATE_HALF_OPEN: 'Testando recuperacao',
+}
+
+
+class CircuitOpenError(ValueError):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name,
+        failure_threshold=5,
+        slow_call_seconds=8.0,
+        reset_timeout=30.0,
+        half_open_max_calls=1,
+        open_message='',
+    ):
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.slow_call_seconds = slow_call_seconds
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = max(1, int(half_open_max_calls))
+        self.open_message = open_message or f'{name} indisponivel no momento.'
+        self._lock = threading.Lock()
+        self._state = STATE_CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._half_open_calls = 0
+        self._stats = {
+            'calls': 0,
+            'failures': 0,
+            'slow_calls': 0,
+            'rejected': 0,
+            'opened_count': 0,
+            'last_failure': '',
+            'last_failure_at': None,
+        }
+
+    def _refresh_state(self, now):
+        if self._state == STATE_OPEN and now - self._opened_at >= self.reset_timeout:
+            self._state = STATE_HALF_OPEN
+            self._half_open_calls = 0
+
+    def _open(self, now):
+        self._state = STATE_OPEN
+        self._opened_at = now
+        self._half_open_calls = 0
+        self._stats['opened_count'] += 1
+
+    def is_available(self):
+        # Consulta sem reservar chamada de teste (ex.: recusar checkout antes de gravar pedido).
+        with self._lock:
+            self._refresh_state(time.monotonic())
+            if self._state == STATE_HALF_OPEN:
+                return self._half_open_calls < self.half_open_max_calls
+            return self._state == STATE_CLOSED
+
+    def before_call(self):
+        with self._lock:
+            self._refresh_state(time.monotonic())
+            if self._state == STATE_OPEN or (
+                self._state == STATE_HALF_OPEN and self._half_open_calls >= self.half_open_max_calls
+            ):
+                self._stats['rejected'] += 1
+                raise CircuitOpenError(self.open_message)
+            if self._state == STATE_HALF_OPEN:
+                self._half_open_calls += 1
+            self._stats['calls'] += 1
+
+    def record_success(self, elapsed_seconds=0.0):
+        if self.slow_call_seconds and elapsed_seconds > self.slow_call_seconds:
+            with self._lock:
+                self._stats['slow_calls'] += 1
+            self.record_failure(f'Chamada lenta ({elapsed_seconds:.1f}s)')
+            return
+        with self._lock:
+            self._consecutive_failures = 0
+            if self._state != STATE_CLOSED:
+                self._state = STATE_CLOSED
+                self._opened_at = None
+                self._half_open_calls = 0
+
+    def record_failure(self, reason=''):
+        now = time.monotonic()
+        with self._lock:
+            self._consecutive_failures += 1
+            self._stats['failures'] += 1
+            self._stats['last_failure'] = str(reason)[:200]
+            self._stats['last_failure_at'] = time.time()
+            if self._state == STATE_HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                self._open(now)
+
+    def reset(self):
+        with self._lock:
+            self._state = STATE_CLOSED
+            self._consecutive_failures = 0
+            self._opened_at = None
+            self._half_open_calls = 0
+
+    def snapshot(self):
+        with self._lock:
+            self._refresh_state(time.monotonic())
+            data = dict(self._stats)
+            data.update(
+                {
+                    'name': self.name,
+                    'state': self._state,
+                    'state_label': STATE_LABELS[self._state],
+                    'is_closed': self._state == STATE_CLOSED,
+                    'consecutive_failures': self._consecutive_failures,
+                    'failure_threshold': self.failure_threshold,
+                    'retry_in_seconds': (
+                        max(0, int(self.reset_timeout - (time.monotonic() - self._opened_at)))
+                        if self._state == STATE_OPEN
+                        else 0
+                    ),
+                }
+            )
+        return data
+
+
+_breakers_lock = threading.Lock()
+_breakers = {}
+
+
+def get_circuit_breaker(name, **options):
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, **options)
+            _breakers[name] = breaker
+        return breaker
@@ -0,0 +1,371 @@
+import asyncio
+import http.client
+import io
+import json
+import random
+import socket
+import ssl
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit
+
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+# Erros de conexao que indicam keep-alive fechado pelo servidor antes do envio.
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+
+class HttpClientError(ValueError):
+    pass
+
+
+class _StaleConnectionError(Exception):
+    pass
+
+
+class HttpResponse:
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def text(self):
+        return self.body.decode('utf-8', 'ignore')
+
+    def json(self):
+        return json.loads(self.body.decode('utf-8')) if self.body else {}
+
+
+class _BaseHttpClient:
+    def __init__(
+        self,
+        base_url,
+        connect_timeout=5.0,
+        read_timeout=20.0,
+        max_retries=2,
+        backoff_base=0.3,
+        backoff_max=3.0,
+        pool_size=4,
+    ):
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme or 'https'
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip('/')
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool_size = max(1, int(pool_size))
+        self._pool = []
+        self._pool_lock = threading.Lock()
+        self.stats = {'requests': 0, 'connections_opened': 0, 'connections_reused': 0, 'retries': 0}
+
+    def _backoff_seconds(self, attempt, retry_after=None):
+        if retry_after:
+            try:
+                return min(self.backoff_max, max(0.0, float(retry_after)))
+            except ValueError:
+                pass
+        # Full jitter: espalha as novas tentativas de varios workers.
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _prepare(self, method, path, json_body, headers, idempotency_key):
+        method = method.upper()
+        url = f'{self.base_path}{path}'
+        request_headers = {'Accept': 'application/json'}
+        request_headers.update(headers or {})
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body).encode('utf-8')
+            request_headers['Content-Type'] = 'application/json'
+        if idempotency_key:
+            request_headers['X-Idempotency-Key'] = idempotency_key
+        # POST so e repetido quando tem chave de idempotencia (nao duplica cobranca).
+        can_retry = method in IDEMPOTENT_METHODS or bool(idempotency_key)
+        with self._pool_lock:
+            self.stats['requests'] += 1
+        return method, url, body, request_headers, can_retry
+
+    def _count_retry(self):
+        with self._pool_lock:
+            self.stats['retries'] += 1
+
+
+class HttpClient(_BaseHttpClient):
+    def _new_connection(self):
+        connection_class = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        connection = connection_class(self.host, self.port, timeout=self.connect_timeout)
+        connection.connect()
+        connection.sock.settimeout(self.read_timeout)
+        with self._pool_lock:
+            self.stats['connections_opened'] += 1
+        return connection
+
+    def _acquire(self):
+        with self._pool_lock:
+            if self._pool:
+                self.stats['connections_reused'] += 1
+                return self._pool.pop(), True
+        return self._new_connection(), False
+
+    def _release(self, connection):
+        with self._pool_lock:
+            if len(self._pool) < self.pool_size:
+                self._pool.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self._pool_lock:
+            connections = self._pool
+            self._pool = []
+        for connection in connections:
+            connection.close()
+
+    def _send_once(self, method, url, body, headers):
+        connection, reused = self._acquire()
+        try:
+            connection.request(method, url, body=body, headers=headers)
+            response = connection.getresponse()
+            payload = response.read()
+        except STALE_CONNECTION_ERRORS as exc:
+            connection.close()
+            if reused:
+                raise _StaleConnectionError(str(exc)) from exc
+            raise
+        except Exception:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(connection)
+        return HttpResponse(response.status, response.headers, payload)
+
+    def request(self, method, path, json_body=None, headers=None, idempotency_key=None):
+        method, url, body, request_headers, can_retry = self._prepare(
+            method, path, json_body, headers, idempotency_key
+        )
+
+        attempt = 0
+        stale_retries = 0
+        while True:
+            try:
+                response = self._send_once(method, url, body, request_headers)
+            except _StaleConnectionError:
+                # Keep-alive que o servidor ja tinha fechado: o pedido nao chegou a
+                # ser processado, entao ate POST sem chave vai de novo em conexao nova.
+                if stale_retries <= self.pool_size:
+                    stale_retries += 1
+                    continue
+                raise HttpClientError(f'Falha de conexao com {self.host}: conexao encerrada.')
+            except (socket.timeout, TimeoutError, OSError, http.client.HTTPException) as exc:
+                if can_retry and attempt < self.max_retries:
+                    self._count_retry()
+                    time.sleep(self._backoff_seconds(attempt))
+                    attempt += 1
+                    continue
+                raise HttpClientError(f'Falha de conexao com {self.host}: {exc}') from exc
+
+            if response.status in RETRYABLE_STATUS and can_retry and attempt < self.max_retries:
+                self._count_retry()
+                time.sleep(self._backoff_seconds(attempt, response.headers.get('Retry-After')))
+                attempt += 1
+                continue
+            return response
+
+
+class _AsyncConnection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def close(self):
+        self.writer.close()
+
+
+async def _read_chunked_body(reader):
+    chunks = []
+    while True:
+        size_line = await reader.readline()
+        if not size_line:
+            raise http.client.IncompleteRead(b''.join(chunks))
+        size = int(size_line.split(b';', 1)[0].strip(), 16)
+        if size == 0:
+            # Trailers opcionais ate a linha em branco.
+            while (await reader.readline()) not in {b'\r\n', b'\n', b''}:
+                pass
+            return b''.join(chunks)
+        chunks.append(await reader.readexactly(size))
+        await reader.readexactly(2)
+
+
+class AsyncHttpClient(_BaseHttpClient):
+    # Mesmo contrato do HttpClient sobre asyncio streams: nenhuma thread presa
+    # enquanto o servidor responde. Conexoes pertencem a um event loop, entao use
+    # get_async_http_client (um cliente por loop).
+    async def _new_connection(self):
+        ssl_context = ssl.create_default_context() if self.scheme == 'https' else None
+        port = self.port or (443 if self.scheme == 'https' else 80)
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, port, ssl=ssl_context),
+            self.connect_timeout,
+        )
+        with self._pool_lock:
+            self.stats['connections_opened'] += 1
+        return _AsyncConnection(reader, writer)
+
+    async def _acquire(self):
+        with self._pool_lock:
+            while self._pool:
+                connection = self._pool.pop()
+                if connection.reader.at_eof() or connection.writer.is_closing():
+                    connection.close()
+                    continue
+                self.stats['connections_reused'] += 1
+                return connection, True
+        return await self._new_connection(), False
+
+    def _release(self, connection):
+        with self._pool_lock:
+            if len(self._pool) < self.pool_size:
+                self._pool.append(connection)
+                return
+        connection.close()
+
+    async def aclose(self):
+        with self._pool_lock:
+            connections = self._pool
+            self._pool = []
+        for connection in connections:
+            connection.close()
+
+    def _encode_request(self, method, url, body, headers):
+        lines = [f'{method} {url} HTTP/1.1', f'Host: {self.host}']
+        if self.port:
+            lines[1] = f'Host: {self.host}:{self.port}'
+        lines.extend(f'{name}: {value}' for name, value in headers.items())
+        if body is not None or method in {'POST', 'PUT', 'PATCH'}:
+            lines.append(f'Content-Length: {len(body or b"")}')
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b'')
+
+    async def _read_response(self, reader, method):
+        status_line = await reader.readline()
+        if not status_line:
+            raise http.client.RemoteDisconnected('Servidor fechou a conexao sem resposta.')
+        parts = status_line.decode('latin-1').split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+            raise http.client.BadStatusLine(status_line)
+        version, status = parts[0], int(parts[1])
+
+        header_lines = []
+        while True:
+            line = await reader.readline()
+            if line in {b'\r\n', b'\n', b''}:
+                break
+            header_lines.append(line)
+        headers = http.client.parse_headers(io.BytesIO(b''.join(header_lines) + b'\r\n'))
+
+        will_close = version == 'HTTP/1.0' or headers.get('Connection', '').lower() == 'close'
+        if method == 'HEAD' or status in {204, 304} or 100 <= status < 200:
+            body = b''
+        elif headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            body = await _read_chunked_body(reader)
+        elif headers.get('Content-Length') is not None:
+            body = await reader.readexactly(int(headers['Content-Length']))
+        else:
+            body = await reader.read()
+            will_close = True
+        return HttpResponse(status, headers, body), will_close
+
+    async def _send_once(self, method, url, body, headers):
+        connection, reused = await self._acquire()
+        try:
+            connection.writer.write(self._encode_request(method, url, body, headers))
+            await connection.writer.drain()
+            response, will_close = await asyncio.wait_for(
+                self._read_response(connection.reader, method),
+                self.read_timeout,
+            )
+        except STALE_CONNECTION_ERRORS + (asyncio.IncompleteReadError,) as exc:
+            connection.close()
+            if reused:
+                raise _StaleConnectionError(str(exc)) from exc
+            raise
+        except BaseException:
+            connection.close()
+            raise
+        if will_close:
+            connection.close()
+        else:
+            self._release(connection)
+        return response
+
+    async def request(self, method, path, json_body=None, headers=None, idempotency_key=None):
+        method, url, body, request_headers, can_retry = self._prepare(
+            method, path, json_body, headers, idempotency_key
+        )
+
+        attempt = 0
+        stale_retries = 0
+        while True:
+            try:
+                response = await self._send_once(method, url, body, request_headers)
+            except _StaleConnectionError:
+                if stale_retries <= self.pool_size:
+                    stale_retries += 1
+                    continue
+                raise HttpClientError(f'Falha de conexao com {self.host}: conexao encerrada.')
+            except (TimeoutError, OSError, EOFError, http.client.HTTPException) as exc:
+                if can_retry and attempt < self.max_retries:
+                    self._count_retry()
+                    await asyncio.sleep(self._backoff_seconds(attempt))
+                    attempt += 1
+                    continue
+                raise HttpClientError(f'Falha de conexao com {self.host}: {exc}') from exc
+
+            if response.status in RETRYABLE_STATUS and can_retry and attempt < self.max_retries:
+                self._count_retry()
+                await asyncio.sleep(self._backoff_seconds(attempt, response.headers.get('Retry-After')))
+                attempt += 1
+                continue
+            return response
+
+
+_clients_lock = threading.Lock()
+_clients = {}
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_http_client(base_url, **options):
+    key = (base_url, tuple(sorted(options.items())))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = HttpClient(base_url, **options)
+            _clients[key] = client
+        return client
+
+
+def close_http_clients():
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+
+
+def get_async_http_client(base_url, **options):
+    loop = asyncio.get_running_loop()
+    key = (base_url, tuple(sorted(options.items())))
+    with _clients_lock:
+        loop_clients = _async_clients.setdefault(loop, {})
+        client = loop_clients.get(key)
+        if client is None:
+            client = AsyncHttpClient(base_url, **options)
+            loop_clients[key] = client
+        return client
@@ -0,0 +1,89 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from shop.middleware import audit_log_buffer
+from shop.models import AuditLog, Order
+
+
+def _summary(label, latencies, elapsed, rows, extra=''):
+    latencies = sorted(latencies)
+    p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+    return (
+        f'{label:<9} {len(latencies):>6} req  {elapsed:>7.2f}s  {len(latencies) / elapsed:>8.1f} req/s  '
+        f'p50 {statistics.median(latencies) * 1000:>6.1f}ms  p95 {p95 * 1000:>6.1f}ms  auditoria {rows}{extra}'
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara a auditoria gravada direto (um INSERT por requisicao) com o buffer '
+        'gravado em lote por uma thread, com consultas simultaneas ao checkout_status.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Requisicoes por modo.')
+        parser.add_argument('--threads', type=int, default=8, help='Threads do worker WSGI simulado.')
+
+    def handle(self, *args, **options):
+        # Pedido ja pago: o checkout_status responde sem consultar o MP.
+        order = Order.objects.create(
+            first_name='Bench',
+            last_name='Auditoria',
+            whatsapp='0',
+            payment_method=Order.PAYMENT_PIX,
+            total=Decimal('1.00'),
+            is_paid=True,
+            mp_status='approved',
+        )
+        self.url = reverse('checkout_status', args=[order.id])
+        urls = [self.url] * options['requests']
+        try:
+            with override_settings(SHOP_AUDIT_LOG_BUFFER=False):
+                latencies, elapsed = self._run(urls, options['threads'])
+            self.stdout.write(_summary('Direto', latencies, elapsed, self._rows()))
+            AuditLog.objects.filter(path=self.url).delete()
+
+            buffer = audit_log_buffer()
+            before = buffer.snapshot()
+            with override_settings(SHOP_AUDIT_LOG_BUFFER=True):
+                latencies, elapsed = self._run(urls, options['threads'])
+            buffer.flush()
+            after = buffer.snapshot()
+            self.stdout.write(
+                _summary(
+                    'Em lote',
+                    latencies,
+                    elapsed,
+                    self._rows(),
+                    f"  lotes {after['flushes'] - before['flushes']}  descartadas {after['dropped'] - before['dropped']}",
+                )
+            )
+        finally:
+            AuditLog.objects.filter(path=self.url).delete()
+            order.delete()
+
+    def _rows(self):
+        return AuditLog.objects.filter(path=self.url).count()
+
+    def _run(self, urls, threads):
+        local = threading.local()
+
+        def fetch(url):
+            client = getattr(local, 'client', None)
+            if client is None:
+                client = local.client = Client()
+            request_started = time.perf_counter()
+            client.get(url)
+            return time.perf_counter() - request_started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            latencies = list(executor.map(fetch, urls))
+        return latencies, time.perf_counter() - started
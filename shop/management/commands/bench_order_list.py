@@ -0,0 +1,106 @@
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from shop.models import Order, PaymentAttempt
+from shop.views import ORDER_LIST_FIELDS
+
+
+# BR Code do MP tem ~150 caracteres; o payload e o mesmo para todos os pedidos.
+PIX_CODE = (
+    '00020126580014br.gov.bcb.pix0136123e4567-e12b-12d1-a456-4266554400005204000053039865406'
+    '10.005802BR5913Missao Andrews6008Campinas62290525mpqrinter1234567890123456304ABCD'
+)
+ITEMS = [
+    {'id': 1, 'name': 'Pastel de Queijo', 'price': '10.00', 'quantity': 2, 'delivered_quantity': 0},
+    {'id': 2, 'name': 'Caldo de Cana', 'price': '6.00', 'quantity': 1, 'delivered_quantity': 0},
+]
+
+
+def _row_bytes(queryset):
+    sql, params = queryset.query.sql_with_params()
+    total = rows = 0
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        for row in cursor.fetchall():
+            rows += 1
+            total += sum(len(str(value)) for value in row if value is not None)
+    return total / rows if rows else 0
+
+
+def _measure(queryset):
+    row_bytes = _row_bytes(queryset)
+    tracemalloc.start()
+    started = time.perf_counter()
+    orders = list(queryset)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del orders
+    return row_bytes, peak, elapsed
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede bytes por linha, memoria e tempo das listas de pedidos: linha completa '
+        '(pedido + tentativa de pagamento, como antes) x so as colunas exibidas.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=50000, help='Pedidos gerados para a medicao.')
+
+    def handle(self, *args, **options):
+        # Tudo dentro de uma transacao desfeita no final: nao sobra pedido no banco.
+        with transaction.atomic():
+            self._create_orders(options['orders'])
+            results = [
+                ('Linha completa', Order.objects.select_related('current_payment').order_by('-created_at')),
+                (
+                    'Painel (pedidos)',
+                    Order.objects.only(*ORDER_LIST_FIELDS, 'items_json', 'delivered_at').order_by('-created_at'),
+                ),
+                ('Relatorio/PDF', Order.objects.only(*ORDER_LIST_FIELDS).order_by('-created_at')),
+            ]
+            baseline = None
+            for label, queryset in results:
+                row_bytes, peak, elapsed = _measure(queryset)
+                baseline = baseline or (row_bytes, peak)
+                self.stdout.write(
+                    f'{label:<18} {row_bytes:>7.0f} B/linha ({row_bytes / baseline[0]:>4.0%})  '
+                    f'pico {peak / 1024 / 1024:>7.1f} MB ({peak / baseline[1]:>4.0%})  {elapsed:>6.2f}s'
+                )
+            transaction.set_rollback(True)
+
+    def _create_orders(self, count):
+        batch_size = 2000
+        for start in range(0, count, batch_size):
+            orders = Order.objects.bulk_create(
+                Order(
+                    first_name='Cliente',
+                    last_name=str(index),
+                    whatsapp='16999999999',
+                    payment_method=Order.PAYMENT_PIX,
+                    total=Decimal('26.00'),
+                    items_json=ITEMS,
+                    mp_status='pending',
+                    mp_status_detail='pending_waiting_transfer',
+                )
+                for index in range(start, min(start + batch_size, count))
+            )
+            attempts = PaymentAttempt.objects.bulk_create(
+                PaymentAttempt(
+                    order=order,
+                    payment_id=str(10**9 + order.id),
+                    external_reference=f'ORDER_{order.id}',
+                    status='pending',
+                    status_detail='pending_waiting_transfer',
+                    pix_code=PIX_CODE,
+                )
+                for order in orders
+            )
+            for order, attempt in zip(orders, attempts):
+                order.current_payment = attempt
+            Order.objects.bulk_update(orders, ['current_payment'])
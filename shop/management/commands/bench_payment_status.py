@@ -0,0 +1,163 @@
+import asyncio
+import importlib
+import json
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client, override_settings
+from django.urls import clear_url_caches, reverse
+from django.utils import timezone
+
+from shop import urls as shop_urls
+from shop.models import AuditLog, Order, PaymentAttempt
+from shop.views import _mp_status_cache
+
+
+class _StubMercadoPagoHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        with self.server.lock:
+            self.server.calls += 1
+        payment_id = self.path.rstrip('/').rsplit('/', 1)[-1]
+        data = json.dumps({'id': payment_id, 'status': 'pending', 'status_detail': 'pending_waiting_transfer'})
+        body = data.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+class _StubMercadoPagoServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def _reload_urls():
+    importlib.reload(shop_urls)
+    importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+    clear_url_caches()
+
+
+def _summary(label, latencies, elapsed, mp_calls):
+    latencies = sorted(latencies)
+    p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+    return (
+        f'{label:<6} {len(latencies):>6} req  {elapsed:>7.2f}s  {len(latencies) / elapsed:>8.1f} req/s  '
+        f'p50 {statistics.median(latencies) * 1000:>7.1f}ms  p95 {p95 * 1000:>7.1f}ms  MP {mp_calls}'
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara checkout_status sync (WSGI, pool de threads) e async (ASGI, um event loop) '
+        'com o Mercado Pago simulado por um servidor local lento.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Consultas por modo.')
+        parser.add_argument('--concurrency', type=int, default=100, help='Consultas simultaneas.')
+        parser.add_argument('--wsgi-threads', type=int, default=8, help='Threads do worker WSGI simulado.')
+        parser.add_argument('--mp-delay', type=float, default=0.2, help='Latencia do MP simulado (segundos).')
+
+    def handle(self, *args, **options):
+        server = _StubMercadoPagoServer(('127.0.0.1', 0), _StubMercadoPagoHandler)
+        server.delay = options['mp_delay']
+        server.calls = 0
+        server.lock = threading.Lock()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        env = {
+            'MP_API_BASE_URL': f'http://127.0.0.1:{server.server_address[1]}',
+            'MP_ACCESS_TOKEN_PROD': 'bench-token',
+            # Sem cache de status: cada consulta vai ao MP simulado.
+            'MP_STATUS_CACHE_SECONDS': '0',
+            'HTTP_MAX_RETRIES': '0',
+        }
+        previous_env = {name: os.environ.get(name) for name in env}
+        os.environ.update(env)
+
+        started_at = timezone.now()
+        orders = []
+        for index in range(options['requests']):
+            order = Order.objects.create(
+                first_name='Bench',
+                last_name=str(index),
+                whatsapp='0',
+                payment_method=Order.PAYMENT_PIX,
+                total=Decimal('1.00'),
+                mp_status='pending',
+            )
+            order.current_payment = PaymentAttempt.objects.create(
+                order=order,
+                payment_id=f'bench-{index}',
+                status='pending',
+                pix_code='bench',
+            )
+            order.save(update_fields=['current_payment'])
+            orders.append(order)
+        urls = [reverse('checkout_status', args=[order.id]) for order in orders]
+        try:
+            _mp_status_cache().clear()
+            server.calls = 0
+            latencies, elapsed = self._run_wsgi(urls, options['wsgi_threads'])
+            self.stdout.write(_summary('WSGI', latencies, elapsed, server.calls))
+
+            server.calls = 0
+            with override_settings(SHOP_ASYNC_VIEWS=True):
+                _reload_urls()
+                latencies, elapsed = asyncio.run(self._run_asgi(urls, options['concurrency']))
+            _reload_urls()
+            self.stdout.write(_summary('ASGI', latencies, elapsed, server.calls))
+        finally:
+            AuditLog.objects.filter(created_at__gte=started_at, path__in=urls).delete()
+            Order.objects.filter(id__in=[order.id for order in orders]).delete()
+            for name, value in previous_env.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+            server.shutdown()
+            server.server_close()
+
+    def _run_wsgi(self, urls, threads):
+        local = threading.local()
+
+        def fetch(url):
+            client = getattr(local, 'client', None)
+            if client is None:
+                client = local.client = Client()
+            request_started = time.perf_counter()
+            client.get(url)
+            return time.perf_counter() - request_started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            latencies = list(executor.map(fetch, urls))
+        return latencies, time.perf_counter() - started
+
+    async def _run_asgi(self, urls, concurrency):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(url):
+            async with semaphore:
+                request_started = time.perf_counter()
+                await client.get(url)
+                return time.perf_counter() - request_started
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(fetch(url) for url in urls))
+        return latencies, time.perf_counter() - started
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.views import WEBHOOK_DRAIN_BATCH, _drain_webhook_inbox
+
+
+class Command(BaseCommand):
+    help = (
+        'Processa a inbox de webhooks do Mercado Pago em ordem de chegada. '
+        'Com o worker rodando, use MP_WEBHOOK_INLINE_DRAIN=0 no servidor web.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=2.0, help='Segundos de espera com a inbox vazia.')
+        parser.add_argument('--batch-size', type=int, default=WEBHOOK_DRAIN_BATCH, help='Eventos por passada.')
+        parser.add_argument('--once', action='store_true', help='Esvazia a inbox uma vez e sai.')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        interval = max(0.1, options['interval'])
+        while True:
+            stats = _drain_webhook_inbox(batch_size)
+            if stats['events']:
+                self.stdout.write(
+                    f"{stats['events']} eventos, {stats['payments']} pagamentos, "
+                    f"{stats['coalesced']} agrupados, {stats['failed']} falhas."
+                )
+            # Passada cheia sem falhas: ainda pode haver fila, segue sem esperar.
+            if stats['events'] >= batch_size and not stats['failed']:
+                continue
+            if options['once']:
+                return
+            time.sleep(interval)
@@ -0,0 +1,197 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from shop.models import Order
+from shop.views import (
+    _get_mp_payment,
+    _mark_payment_reconciler_alive,
+    _remember_mp_payment,
+    _search_mp_payments,
+    _sync_order_from_mp_payment,
+    _webhook_order_id,
+)
+
+
+PENDING_STATUSES = ('pending', 'in_process')
+# O MP registra date_created no fuso dele; a margem evita perder pagamentos na borda.
+SEARCH_MARGIN = timedelta(minutes=10)
+
+
+def _mp_date(value):
+    return value.astimezone(timezone.get_current_timezone()).isoformat(timespec='milliseconds')
+
+
+def _parse_date(value, option):
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'{option}: use o formato AAAA-MM-DD ou AAAA-MM-DDTHH:MM.')
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def _payment_rank(payment):
+    # Mais de um pagamento para o mesmo pedido: aprovado primeiro, depois o mais novo.
+    return (payment.get('status') == 'approved', payment.get('date_created') or '', str(payment.get('id') or ''))
+
+
+class Command(BaseCommand):
+    help = (
+        'Consulta o Mercado Pago em lote (payments/search) e atualiza os pedidos Pix pendentes. '
+        'Com --since/--until reprocessa todos os pagamentos do periodo.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=60.0, help='Segundos entre as rodadas.')
+        parser.add_argument('--once', action='store_true', help='Executa uma rodada e sai.')
+        parser.add_argument('--since', help='Inicio do periodo a reprocessar (date_created no MP).')
+        parser.add_argument('--until', help='Fim do periodo a reprocessar (padrao: agora).')
+        parser.add_argument('--max-age-hours', type=float, default=48.0, help='Ignora pendentes mais antigos.')
+        parser.add_argument('--page-size', type=int, default=100, help='Pagamentos por pagina da busca.')
+        parser.add_argument('--concurrency', type=int, default=4, help='Consultas simultaneas ao MP.')
+        parser.add_argument('--batch-size', type=int, default=100, help='Pedidos atualizados por lote.')
+
+    def handle(self, *args, **options):
+        self.page_size = max(1, options['page_size'])
+        self.concurrency = max(1, options['concurrency'])
+        self.batch_size = max(1, options['batch_size'])
+
+        if options['since']:
+            since = _parse_date(options['since'], '--since')
+            until = _parse_date(options['until'], '--until') if options['until'] else timezone.now()
+            if since >= until:
+                raise CommandError('--since precisa ser anterior a --until.')
+            self.stdout.write(self._summary('Replay', self.replay(since, until)))
+            return
+
+        interval = max(1.0, options['interval'])
+        max_age = timedelta(hours=max(0.0, options['max_age_hours']))
+        while True:
+            started = time.monotonic()
+            # Heartbeat antes da rodada: o checkout_status deixa de consultar o MP
+            # enquanto este comando estiver vivo.
+            if not options['once']:
+                _mark_payment_reconciler_alive(interval * 3)
+            try:
+                self.stdout.write(self._summary('Pendentes', self.reconcile_pending(max_age)))
+            except ValueError as exc:
+                self.stderr.write(f'Falha ao consultar o Mercado Pago: {exc}')
+            if options['once']:
+                return
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+    def reconcile_pending(self, max_age):
+        pending = Order.objects.filter(
+            is_paid=False,
+            mp_status__in=PENDING_STATUSES,
+            created_at__gte=timezone.now() - max_age,
+            current_payment__payment_id__gt='',
+        )
+        oldest = pending.aggregate(oldest=Min('created_at'))['oldest']
+        if oldest is None:
+            return {'orders': 0, 'payments': 0, 'pages': 0, 'fetched': 0, 'updated': 0, 'paid': 0, 'kept_paid': 0}
+
+        order_ids = list(pending.values_list('id', flat=True))
+        payments, pages = self.search(oldest - SEARCH_MARGIN, timezone.now() + SEARCH_MARGIN)
+        matched = self.match(payments, order_ids)
+
+        # Pagamentos fora da busca (ex.: indice do MP atrasado) vao um a um.
+        missing = dict(pending.exclude(id__in=list(matched)).values_list('id', 'current_payment__payment_id'))
+        fetched = 0
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                for order_id, payment in zip(missing, executor.map(self._fetch_payment, missing.values())):
+                    if payment is not None:
+                        matched[order_id] = payment
+                        fetched += 1
+
+        stats = self.apply(matched)
+        stats.update({'orders': len(order_ids), 'payments': len(payments), 'pages': pages, 'fetched': fetched})
+        return stats
+
+    def replay(self, since, until):
+        payments, pages = self.search(since, until)
+        matched = self.match(payments)
+        stats = self.apply(matched)
+        stats.update({'orders': len(matched), 'payments': len(payments), 'pages': pages, 'fetched': 0})
+        return stats
+
+    def search(self, begin, end):
+        params = {
+            'range': 'date_created',
+            'begin_date': _mp_date(begin),
+            'end_date': _mp_date(end),
+            'sort': 'date_created',
+            'criteria': 'asc',
+            'limit': self.page_size,
+        }
+        first_page = _search_mp_payments({**params, 'offset': 0})
+        payments = list(first_page.get('results') or [])
+        total = int((first_page.get('paging') or {}).get('total') or len(payments))
+        offsets = range(self.page_size, total, self.page_size)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for page in executor.map(lambda offset: _search_mp_payments({**params, 'offset': offset}), offsets):
+                payments.extend(page.get('results') or [])
+        return payments, 1 + len(offsets)
+
+    def match(self, payments, order_ids=None):
+        by_payment_id = {}
+        if order_ids is not None:
+            by_payment_id = dict(
+                Order.objects.filter(id__in=order_ids, current_payment__payment_id__gt='').values_list(
+                    'current_payment__payment_id', 'id'
+                )
+            )
+        pending_ids = set(by_payment_id.values())
+        matched = {}
+        for payment in payments:
+            order_id = _webhook_order_id(payment) or by_payment_id.get(str(payment.get('id') or ''))
+            if not order_id or (order_ids is not None and order_id not in pending_ids):
+                continue
+            current = matched.get(order_id)
+            if current is None or _payment_rank(payment) > _payment_rank(current):
+                matched[order_id] = payment
+        return matched
+
+    def apply(self, matched):
+        # A conciliacao so avanca pedidos: um pedido ja pago (inclusive baixa
+        # manual, dinheiro ou Pix local) nunca volta a nao pago por causa de uma
+        # cobranca antiga do MP expirada, cancelada ou pendente.
+        updated = paid = kept_paid = 0
+        order_ids = list(matched)
+        for start in range(0, len(order_ids), self.batch_size):
+            orders = Order.objects.select_related('current_payment').in_bulk(order_ids[start:start + self.batch_size])
+            for order_id, order in orders.items():
+                payment = matched[order_id]
+                if order.is_paid:
+                    kept_paid += 1
+                    continue
+                before = (order.mp_status, order.mp_status_detail, order.is_paid)
+                _sync_order_from_mp_payment(order, payment)
+                if payment.get('id'):
+                    _remember_mp_payment(payment['id'], payment)
+                if before != (order.mp_status, order.mp_status_detail, order.is_paid):
+                    updated += 1
+                if order.is_paid:
+                    paid += 1
+        return {'updated': updated, 'paid': paid, 'kept_paid': kept_paid}
+
+    def _fetch_payment(self, payment_id):
+        try:
+            return _get_mp_payment(payment_id)
+        except ValueError as exc:
+            self.stderr.write(f'Pagamento {payment_id}: {exc}')
+            return None
+
+    def _summary(self, label, stats):
+        return (
+            f"{label}: {stats['orders']} pedidos, {stats['payments']} pagamentos em {stats['pages']} paginas, "
+            f"{stats['fetched']} consultas avulsas, {stats['updated']} atualizados, {stats['paid']} pagos, "
+            f"{stats['kept_paid']} ja pagos mantidos."
+        )
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from shop.views import _drain_webhook_inbox, _replay_webhook_events
+
+
+class Command(BaseCommand):
+    help = 'Devolve para a fila os webhooks do Mercado Pago que falharam.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--id', type=int, action='append', dest='ids', help='Evento especifico (repetivel).')
+        parser.add_argument('--since', help='So eventos recebidos a partir de AAAA-MM-DD[THH:MM].')
+        parser.add_argument('--process', action='store_true', help='Processa os eventos agora.')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since']) or parse_datetime(f"{options['since']}T00:00")
+            if since is None:
+                raise CommandError('--since: use o formato AAAA-MM-DD ou AAAA-MM-DDTHH:MM.')
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+
+        requeued = _replay_webhook_events(options['ids'], since)
+        self.stdout.write(f'{requeued} eventos devolvidos para a fila.')
+        if options['process'] and requeued:
+            stats = _drain_webhook_inbox(requeued)
+            self.stdout.write(f"{stats['payments']} pagamentos processados, {stats['failed']} falhas.")
@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 
+from shop.catalog import bump_catalog_version
 from shop.models import Product
 
 
@@ -8,6 +9,7 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         Product.objects.update(active=False)
+        bump_catalog_version()
 
         products = [
             {
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.views import WHATSAPP_DRAIN_BATCH, _drain_whatsapp_outbox
+
+
+class Command(BaseCommand):
+    help = (
+        'Envia as mensagens da outbox do WhatsApp pela W-API, no ritmo de '
+        'WAPI_QUEUE_MIN/MAX_DELAY_SECONDS. Rode exatamente um: o limite de taxa fica na memoria do processo.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=2.0, help='Segundos de espera com a outbox vazia.')
+        parser.add_argument('--batch-size', type=int, default=WHATSAPP_DRAIN_BATCH, help='Mensagens por passada.')
+        parser.add_argument('--once', action='store_true', help='Esvazia a outbox uma vez e sai.')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        interval = max(0.1, options['interval'])
+        while True:
+            stats = _drain_whatsapp_outbox(batch_size)
+            if stats['messages']:
+                self.stdout.write(
+                    f"{stats['messages']} mensagens ({stats['deliveries']} entregas), {stats['sent']} enviadas, "
+                    f"{stats['failed']} falhas (nova tentativa agendada), {stats['dead']} sem novas tentativas."
+                )
+            if stats['messages'] >= batch_size:
+                continue
+            if options['once']:
+                return
+            time.sleep(interval)
@@ -1,6 +1,11 @@
 import json
+import os
 import time
 
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+
+from .audit_buffer import get_audit_log_buffer
 from .models import AuditLog
 
 
@@ -43,6 +48,33 @@ def _extract_payload(request):
     return ''
 
 
+def _request_user(request):
+    # Sem cookie de sessao o visitante e anonimo: nao carrega a sessao, senao a
+    # resposta ganha "Vary: Cookie" e deixa de ser cacheavel (ex.: pagina inicial).
+    if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+        return None
+    user = getattr(request, 'user', None)
+    if user and user.is_authenticated:
+        return user
+    return None
+
+
+def _env_number(name, default):
+    try:
+        return float(os.getenv(name, '').strip() or default)
+    except ValueError:
+        return default
+
+
+def audit_log_buffer():
+    return get_audit_log_buffer(
+        'audit',
+        max_rows=int(_env_number('AUDIT_BUFFER_MAX_ROWS', 1000)),
+        batch_size=int(_env_number('AUDIT_BUFFER_BATCH_SIZE', 100)),
+        flush_interval=_env_number('AUDIT_BUFFER_FLUSH_MS', 500) / 1000,
+    )
+
+
 def _client_ip(request):
     forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
     if forwarded:
@@ -51,16 +83,31 @@ def _client_ip(request):
 
 
 class AuditLogMiddleware:
+    # Assincrono sob ASGI: views async (SSE / long-poll) nao ficam presas numa thread.
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
         request._audit_started_at = time.time()
         request._audit_payload = _extract_payload(request)
         response = self.get_response(request)
         self._write_log(request, response.status_code)
         return response
 
+    async def __acall__(self, request):
+        request._audit_started_at = time.time()
+        request._audit_payload = _extract_payload(request)
+        response = await self.get_response(request)
+        await sync_to_async(self._write_log)(request, response.status_code)
+        return response
+
     def process_exception(self, request, exception):
         self._write_log(request, 500)
         return None
@@ -97,10 +144,10 @@ class AuditLogMiddleware:
         response_ms = int((time.time() - started_at) * 1000)
         query_params = request.META.get('QUERY_STRING', '')[:1000]
         payload = getattr(request, '_audit_payload', '')[:4000]
-        user = request.user if getattr(request, 'user', None) and request.user.is_authenticated else None
+        user = _request_user(request)
 
         try:
-            AuditLog.objects.create(
+            entry = AuditLog(
                 user=user,
                 method=(request.method or '')[:10],
                 path=path[:255],
@@ -112,6 +159,10 @@ class AuditLogMiddleware:
                 response_ms=response_ms,
                 is_error=int(status_code or 0) >= 400,
             )
+            if settings.SHOP_AUDIT_LOG_BUFFER:
+                audit_log_buffer().add(entry)
+            else:
+                entry.save()
         except Exception:
             # Nunca quebrar fluxo da aplicação por falha de auditoria.
             return
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.11 on 2026-10-17 00:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0014_profitdistributionentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentWebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('request_id', models.CharField(blank=True, max_length=80)),
+                ('payment_id', models.CharField(db_index=True, max_length=40)),
+                ('payload', models.TextField(blank=True)),
+                ('status', models.CharField(choices=[('pending', 'Pendente'), ('processing', 'Processando'), ('processed', 'Processado'), ('ignored', 'Ignorado'), ('failed', 'Falhou')], db_index=True, default='pending', max_length=12)),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_error', models.CharField(blank=True, max_length=255)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Evento de webhook',
+                'verbose_name_plural': 'Eventos de webhook',
+                'ordering': ['id'],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('request_id', ''), _negated=True), fields=('request_id',), name='unique_webhook_request_id')],
+            },
+        ),
+    ]
@@ -0,0 +1,94 @@
+# Generated by Django 5.2.11 on 2026-10-17 00:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_payments_to_attempts(apps, schema_editor):
+    Order = apps.get_model('shop', 'Order')
+    PaymentAttempt = apps.get_model('shop', 'PaymentAttempt')
+
+    orders = Order.objects.exclude(pix_code='', mp_payment_id='', mp_external_reference='')
+    for order in orders.iterator():
+        attempt = PaymentAttempt.objects.create(
+            order_id=order.id,
+            provider='pix_local' if order.mp_status_detail == 'pix_local' else 'mercadopago',
+            payment_id=order.mp_payment_id,
+            external_reference=order.mp_external_reference,
+            status=order.mp_status,
+            status_detail=order.mp_status_detail,
+            pix_code=order.pix_code,
+        )
+        Order.objects.filter(id=order.id).update(current_payment_id=attempt.id)
+
+
+def copy_attempts_to_orders(apps, schema_editor):
+    Order = apps.get_model('shop', 'Order')
+
+    for order in Order.objects.exclude(current_payment=None).select_related('current_payment').iterator():
+        attempt = order.current_payment
+        Order.objects.filter(id=order.id).update(
+            pix_code=attempt.pix_code,
+            mp_payment_id=attempt.payment_id,
+            mp_external_reference=attempt.external_reference,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0016_order_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentAttempt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(choices=[('mercadopago', 'Mercado Pago'), ('pix_local', 'Pix pela chave')], default='mercadopago', max_length=20)),
+                ('payment_id', models.CharField(blank=True, max_length=40)),
+                ('external_reference', models.CharField(blank=True, max_length=80)),
+                ('status', models.CharField(blank=True, max_length=40)),
+                ('status_detail', models.CharField(blank=True, max_length=120)),
+                ('pix_code', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Tentativa de pagamento',
+                'verbose_name_plural': 'Tentativas de pagamento',
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='paymentattempt',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payment_attempts', to='shop.order'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='current_payment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='shop.paymentattempt'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentattempt',
+            index=models.Index(fields=['payment_id'], name='attempt_payment_idx'),
+        ),
+        migrations.RunPython(copy_payments_to_attempts, copy_attempts_to_orders),
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_mp_payment_idx',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='mp_external_reference',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='mp_payment_id',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='pix_code',
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.11 on 2026-10-17 01:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0017_paymentattempt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='checkout_key',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('checkout_key', ''), _negated=True), fields=('checkout_key',), name='unique_order_checkout_key'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.11 on 2026-10-17 01:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0018_order_checkout_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WhatsAppOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('paid', 'Pagamento aprovado'), ('ready', 'Pedido pronto')], max_length=10)),
+                ('phone', models.CharField(max_length=20)),
+                ('message', models.TextField()),
+                ('status', models.CharField(choices=[('pending', 'Pendente'), ('sending', 'Enviando'), ('sent', 'Enviada'), ('failed', 'Falhou')], db_index=True, default='pending', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_error', models.CharField(blank=True, max_length=255)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='whatsapp_messages', to='shop.order')),
+            ],
+            options={
+                'verbose_name': 'Mensagem de WhatsApp',
+                'verbose_name_plural': 'Mensagens de WhatsApp',
+                'ordering': ['id'],
+            },
+        ),
+    ]
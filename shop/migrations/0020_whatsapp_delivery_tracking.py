@@ -0,0 +1,97 @@
+# Generated by Django 5.2.11 on 2026-10-17 01:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def _normalize_phone(value):
+    digits = ''.join(ch for ch in (value or '') if ch.isdigit()).lstrip('0')
+    if digits and not digits.startswith('55') and len(digits) in {10, 11}:
+        return f'55{digits}'
+    return digits
+
+
+def _paid_message(order):
+    # Copia da mensagem de pagamento aprovado da epoca desta migracao.
+    lines = [
+        'Pagamento aprovado!',
+        f'Pedido #{order.id}',
+        f'Cliente: {order.first_name} {order.last_name}',
+        f'WhatsApp: {order.whatsapp}',
+        f'Total: R$ {order.total:.2f}',
+        '',
+        'Itens:',
+    ]
+    for item in order.items_json or []:
+        lines.append(f"- {item.get('quantity', 0)}x {item.get('name', 'Item')} | R$ {item.get('subtotal', '0.00')}")
+    lines.extend(
+        [
+            '',
+            'Retirada: Colegio Adventista de Sao Carlos',
+            'Data: 21/02/2026 a partir das 19:30',
+            '',
+            'Obrigado! Sua contribuicao ajuda a Missao Andrews a alcancar mais criancas e familias.',
+        ]
+    )
+    return '\n'.join(lines)
+
+
+def copy_notify_errors_to_outbox(apps, schema_editor):
+    # O erro antigo era um so por pedido, sem dizer qual telefone falhou: vira
+    # uma entrega sem novas tentativas automaticas, que a tela de reenvio mostra.
+    Order = apps.get_model('shop', 'Order')
+    WhatsAppOutbox = apps.get_model('shop', 'WhatsAppOutbox')
+
+    for order in Order.objects.exclude(whatsapp_notify_error='').iterator():
+        WhatsAppOutbox.objects.get_or_create(
+            order_id=order.id,
+            phone=_normalize_phone(order.whatsapp),
+            kind='paid',
+            defaults={
+                'message': _paid_message(order),
+                'status': 'dead',
+                'attempts': 1,
+                'last_error': order.whatsapp_notify_error[:255],
+            },
+        )
+
+
+def copy_outbox_errors_to_orders(apps, schema_editor):
+    Order = apps.get_model('shop', 'Order')
+    WhatsAppOutbox = apps.get_model('shop', 'WhatsAppOutbox')
+
+    errors = {}
+    failed = WhatsAppOutbox.objects.filter(kind='paid', status__in=['failed', 'dead']).exclude(last_error='')
+    for order_id, last_error in failed.values_list('order_id', 'last_error').order_by('id'):
+        errors.setdefault(order_id, []).append(last_error)
+    for order_id, messages in errors.items():
+        Order.objects.filter(id=order_id).update(whatsapp_notify_error='; '.join(messages)[:255])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0019_whatsappoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='whatsappoutbox',
+            name='next_attempt_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='whatsappoutbox',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pendente'), ('sending', 'Enviando'), ('sent', 'Enviada'), ('failed', 'Falhou (nova tentativa agendada)'), ('dead', 'Falhou (sem novas tentativas)')], db_index=True, default='pending', max_length=10),
+        ),
+        migrations.AddConstraint(
+            model_name='whatsappoutbox',
+            constraint=models.UniqueConstraint(fields=('order', 'phone', 'kind'), name='unique_whatsapp_delivery'),
+        ),
+        migrations.RunPython(copy_notify_errors_to_outbox, copy_outbox_errors_to_orders),
+        migrations.RemoveField(
+            model_name='order',
+            name='whatsapp_notify_error',
+        ),
+    ]
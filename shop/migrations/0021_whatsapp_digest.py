@@ -0,0 +1,23 @@
+# Generated by Django 5.2.11 on 2026-10-17 01:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0020_whatsapp_delivery_tracking'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='whatsapprecipient',
+            name='digest',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='whatsappoutbox',
+            name='kind',
+            field=models.CharField(choices=[('paid', 'Pagamento aprovado'), ('digest', 'Resumo de pedidos aprovados'), ('ready', 'Pedido pronto')], max_length=10),
+        ),
+    ]
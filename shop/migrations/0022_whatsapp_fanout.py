@@ -0,0 +1,23 @@
+# Generated by Django 5.2.11 on 2026-10-17 01:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0021_whatsapp_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='whatsappoutbox',
+            name='priority',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='whatsappoutbox',
+            name='send_ms',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 
 class Product(models.Model):
@@ -53,9 +54,15 @@ class Order(models.Model):
     whatsapp = models.CharField(max_length=25)
     payment_method = models.CharField(max_length=10, choices=PAYMENT_CHOICES)
     total = models.DecimalField(max_digits=10, decimal_places=2)
-    pix_code = models.TextField()
-    mp_payment_id = models.CharField(max_length=40, blank=True)
-    mp_external_reference = models.CharField(max_length=80, blank=True)
+    # Dados do provedor ficam em PaymentAttempt; o pedido guarda so a tentativa
+    # atual e o status dela, que as listas e filtros usam.
+    current_payment = models.ForeignKey(
+        'PaymentAttempt',
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name='+',
+    )
     mp_status = models.CharField(max_length=40, blank=True)
     mp_status_detail = models.CharField(max_length=120, blank=True)
     items_json = models.JSONField(default=list)
@@ -65,21 +72,90 @@ class Order(models.Model):
     delivered_at = models.DateTimeField(blank=True, null=True)
     whatsapp_notified = models.BooleanField(default=False)
     whatsapp_notified_at = models.DateTimeField(blank=True, null=True)
-    whatsapp_notify_error = models.CharField(max_length=255, blank=True)
     created_by_staff = models.BooleanField(default=False)
+    # Hash do envio do checkout: toque duplo / reenvio devolve este pedido.
+    checkout_key = models.CharField(max_length=64, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['checkout_key'],
+                condition=~models.Q(checkout_key=''),
+                name='unique_order_checkout_key',
+            ),
+        ]
+        # Cada indice atende consultas de views.py; OrderQueryPlanTests confere o plano.
+        # O Django filtra booleanos como `WHERE "is_paid"` / `WHERE NOT "is_paid"`,
+        # que o SQLite so resolve por indice parcial com a mesma condicao.
+        indexes = [
+            # Listas de pedidos (painel, relatorios, PDF) ordenadas por data.
+            models.Index(fields=['created_at'], name='order_created_idx'),
+            # Marcar todos como pagos e pendentes do reconcile_payments.
+            models.Index(fields=['created_at'], condition=models.Q(is_paid=False), name='order_unpaid_idx'),
+            # Soma/media/contagem e grafico diario dos pagos nos relatorios.
+            models.Index(fields=['created_at', 'total'], condition=models.Q(is_paid=True), name='order_paid_idx'),
+            # Graficos dos relatorios que agregam todos os pedidos: leem so o indice.
+            models.Index(fields=['payment_method', 'total'], name='order_payment_total_idx'),
+            # Grafico de status (GROUP BY is_paid, is_delivered) e contagem de pagos.
+            models.Index(fields=['is_paid', 'is_delivered'], name='order_status_idx'),
+            # Marcar todos como entregues.
+            models.Index(fields=['id'], condition=models.Q(is_delivered=False), name='order_undelivered_idx'),
+        ]
 
     def __str__(self) -> str:
         return f'Pedido #{self.id} - {self.first_name} {self.last_name}'
 
+    # Compatibilidade: os dados da cobranca agora ficam em PaymentAttempt.
+    # Somente leitura, sempre da tentativa atual.
+    @property
+    def pix_code(self) -> str:
+        return self.current_payment.pix_code if self.current_payment_id else ''
+
+    @property
+    def mp_payment_id(self) -> str:
+        return self.current_payment.payment_id if self.current_payment_id else ''
+
+
+class PaymentAttempt(models.Model):
+    PROVIDER_MERCADO_PAGO = 'mercadopago'
+    PROVIDER_PIX_LOCAL = 'pix_local'
+    PROVIDER_CHOICES = [
+        (PROVIDER_MERCADO_PAGO, 'Mercado Pago'),
+        (PROVIDER_PIX_LOCAL, 'Pix pela chave'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='payment_attempts')
+    provider = models.CharField(max_length=20, choices=PROVIDER_CHOICES, default=PROVIDER_MERCADO_PAGO)
+    payment_id = models.CharField(max_length=40, blank=True)
+    external_reference = models.CharField(max_length=80, blank=True)
+    status = models.CharField(max_length=40, blank=True)
+    status_detail = models.CharField(max_length=120, blank=True)
+    pix_code = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-id']
+        indexes = [
+            # Webhook/reconciliacao acham o pedido pelo pagamento do MP.
+            models.Index(fields=['payment_id'], name='attempt_payment_idx'),
+        ]
+        verbose_name = 'Tentativa de pagamento'
+        verbose_name_plural = 'Tentativas de pagamento'
+
+    def __str__(self) -> str:
+        return f'Pagamento {self.payment_id or self.provider} do pedido #{self.order_id}'
+
 
 class WhatsAppRecipient(models.Model):
     name = models.CharField(max_length=120)
     phone = models.CharField(max_length=20, unique=True)
     active = models.BooleanField(default=True)
+    # Resumo: um aviso com os pedidos aprovados na janela (WAPI_DIGEST_WINDOW_SECONDS)
+    # em vez de uma mensagem por pedido.
+    digest = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -172,10 +248,104 @@ class AuditLog(models.Model):
     user_agent = models.CharField(max_length=255, blank=True)
     response_ms = models.IntegerField(default=0)
     is_error = models.BooleanField(default=False)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         ordering = ['-created_at']
 
     def __str__(self) -> str:
         return f'{self.method} {self.path} [{self.status_code}]'
+
+
+class PaymentWebhookEvent(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_PROCESSED = 'processed'
+    STATUS_IGNORED = 'ignored'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pendente'),
+        (STATUS_PROCESSING, 'Processando'),
+        (STATUS_PROCESSED, 'Processado'),
+        (STATUS_IGNORED, 'Ignorado'),
+        (STATUS_FAILED, 'Falhou'),
+    ]
+
+    request_id = models.CharField(max_length=80, blank=True)
+    payment_id = models.CharField(max_length=40, db_index=True)
+    payload = models.TextField(blank=True)
+    status = models.CharField(max_length=12, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.CharField(max_length=255, blank=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['request_id'],
+                condition=~models.Q(request_id=''),
+                name='unique_webhook_request_id',
+            ),
+        ]
+        verbose_name = 'Evento de webhook'
+        verbose_name_plural = 'Eventos de webhook'
+
+    def __str__(self) -> str:
+        return f'Webhook pagamento {self.payment_id} [{self.status}]'
+
+
+class WhatsAppOutbox(models.Model):
+    KIND_PAID = 'paid'
+    KIND_DIGEST = 'digest'
+    KIND_READY = 'ready'
+    KIND_CHOICES = [
+        (KIND_PAID, 'Pagamento aprovado'),
+        (KIND_DIGEST, 'Resumo de pedidos aprovados'),
+        (KIND_READY, 'Pedido pronto'),
+    ]
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_DEAD = 'dead'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pendente'),
+        (STATUS_SENDING, 'Enviando'),
+        (STATUS_SENT, 'Enviada'),
+        (STATUS_FAILED, 'Falhou (nova tentativa agendada)'),
+        (STATUS_DEAD, 'Falhou (sem novas tentativas)'),
+    ]
+    # Menor sai primeiro: a confirmacao do comprador nao espera as da equipe.
+    PRIORITY_BUYER = 0
+    PRIORITY_STAFF = 1
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='whatsapp_messages')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    phone = models.CharField(max_length=20)
+    message = models.TextField()
+    priority = models.PositiveSmallIntegerField(default=PRIORITY_STAFF)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.CharField(max_length=255, blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+    # Duracao da chamada a W-API no ultimo envio (ajuste de WAPI_FANOUT_WORKERS).
+    send_ms = models.PositiveIntegerField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['id']
+        # Um registro de entrega por pedido, telefone e tipo de mensagem.
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'phone', 'kind'], name='unique_whatsapp_delivery'),
+        ]
+        verbose_name = 'Mensagem de WhatsApp'
+        verbose_name_plural = 'Mensagens de WhatsApp'
+
+    def __str__(self) -> str:
+        return f'WhatsApp {self.phone} pedido #{self.order_id} [{self.status}]'
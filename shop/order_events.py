@@ -0,0 +1,158 @@
+import asyncio
+import threading
+import time
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Order
+
+
+ORDER_STATUS_VERSION_TTL = 60 * 60 * 12
+# Campos que mudam o que o cliente ve na tela de pagamento.
+ORDER_STATUS_FIELDS = {'is_paid', 'paid_at', 'mp_status', 'mp_status_detail', 'current_payment'}
+
+
+def order_cache():
+    # Chaves por pedido ficam no cache 'orders' (ver CACHES no settings).
+    return caches['orders']
+
+
+def _version_cache_key(order_id):
+    return f'shop:order_status:{order_id}'
+
+
+class OrderStatusHub:
+    # Cada mudanca de status grava uma versao no cache do Django. Conexoes SSE /
+    # long-poll esperam num asyncio.Event; uma unica tarefa por processo le as
+    # versoes do cache para enxergar mudancas feitas por outros workers.
+    def __init__(self, poll_interval=1.0):
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._waiters = {}
+        self._versions = {}
+        self._watchers = {}
+        self._stats = {'published': 0, 'notified': 0}
+
+    def publish(self, order_id):
+        version = time.time_ns()
+        order_cache().set(_version_cache_key(order_id), version, ORDER_STATUS_VERSION_TTL)
+        with self._lock:
+            self._stats['published'] += 1
+        self._notify(order_id, version)
+        return version
+
+    def current_version(self, order_id):
+        return order_cache().get(_version_cache_key(order_id)) or 0
+
+    async def acurrent_version(self, order_id):
+        return await sync_to_async(self.current_version, thread_sensitive=False)(order_id)
+
+    def _notify(self, order_id, version):
+        with self._lock:
+            self._versions[order_id] = version
+            waiters = list(self._waiters.get(order_id, ()))
+            self._stats['notified'] += len(waiters)
+        for waiter in waiters:
+            waiter()
+
+    def _add_waiter(self, order_id, waiter):
+        with self._lock:
+            self._waiters.setdefault(order_id, set()).add(waiter)
+
+    def _remove_waiter(self, order_id, waiter):
+        with self._lock:
+            waiters = self._waiters.get(order_id)
+            if waiters is None:
+                return
+            waiters.discard(waiter)
+            if not waiters:
+                del self._waiters[order_id]
+                self._versions.pop(order_id, None)
+
+    async def wait_for_change(self, order_id, since, timeout):
+        # Devolve a versao atual assim que ela for diferente de `since`, ou a
+        # mesma versao depois de `timeout` segundos.
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+
+        def waiter():
+            loop.call_soon_threadsafe(event.set)
+
+        self._add_waiter(order_id, waiter)
+        self._ensure_watcher(loop)
+        try:
+            version = await self.acurrent_version(order_id)
+            with self._lock:
+                self._versions.setdefault(order_id, version)
+            if version != since:
+                return version
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            with self._lock:
+                return self._versions.get(order_id, version)
+        finally:
+            self._remove_waiter(order_id, waiter)
+
+    def _ensure_watcher(self, loop):
+        with self._lock:
+            task = self._watchers.get(loop)
+            if task is None or task.done():
+                self._watchers[loop] = loop.create_task(self._watch(loop))
+
+    async def _watch(self, loop):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            with self._lock:
+                order_ids = list(self._waiters)
+                if not order_ids:
+                    self._watchers.pop(loop, None)
+                    return
+            keys = {_version_cache_key(order_id): order_id for order_id in order_ids}
+            try:
+                versions = await sync_to_async(order_cache().get_many, thread_sensitive=False)(list(keys))
+            except Exception:
+                continue
+            for key, version in versions.items():
+                order_id = keys[key]
+                with self._lock:
+                    known = self._versions.get(order_id)
+                if version and version != known:
+                    self._notify(order_id, version)
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self._stats)
+            data['orders_watched'] = len(self._waiters)
+            data['subscribers'] = sum(len(waiters) for waiters in self._waiters.values())
+        return data
+
+
+_hub = OrderStatusHub()
+
+
+def get_order_status_hub():
+    return _hub
+
+
+def publish_order_status(order_id):
+    return _hub.publish(order_id)
+
+
+def publish_order_statuses(order_ids):
+    # Para .update() em lote, que nao dispara post_save.
+    for order_id in order_ids:
+        transaction.on_commit(partial(publish_order_status, order_id))
+
+
+@receiver(post_save, sender=Order)
+def _publish_order_status_on_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not ORDER_STATUS_FIELDS.intersection(update_fields):
+        return
+    transaction.on_commit(partial(publish_order_status, instance.id))
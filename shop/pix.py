@@ -0,0 +1,84 @@
+import io
+import re
+import unicodedata
+from decimal import Decimal
+
+import qrcode
+
+
+# Campos do BR Code (EMV QRCPS-MPM) usados pelo Pix, conforme o manual do BACEN.
+PIX_GUI = 'br.gov.bcb.pix'
+MAX_MERCHANT_NAME = 25
+MAX_MERCHANT_CITY = 15
+MAX_TXID = 25
+
+
+def _tlv(tag, value):
+    value = str(value)
+    if len(value) > 99:
+        raise ValueError(f'Campo {tag} do Pix excede 99 caracteres.')
+    return f'{tag}{len(value):02d}{value}'
+
+
+def _ascii_text(value, max_length):
+    normalized = unicodedata.normalize('NFKD', value or '').encode('ascii', 'ignore').decode('ascii')
+    normalized = re.sub(r'[^A-Za-z0-9 .-]', '', normalized).strip()
+    return normalized[:max_length]
+
+
+def _txid(reference):
+    txid = re.sub(r'[^A-Za-z0-9]', '', reference or '')[:MAX_TXID]
+    return txid or '***'
+
+
+def crc16_ccitt(payload):
+    # CRC16-CCITT-FALSE (poly 0x1021, inicial 0xFFFF), exigido no campo 63.
+    crc = 0xFFFF
+    for byte in payload.encode('utf-8'):
+        crc ^= byte << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+    return f'{crc:04X}'
+
+
+def build_pix_brcode(key='', amount=None, reference='', merchant_name='', merchant_city='', description='', location=''):
+    # Estatico: chave Pix (26.01) + valor/txid opcionais.
+    # Dinamico: URL do payload no PSP (26.25), sem chave.
+    if not key and not location:
+        raise ValueError('Informe a chave Pix ou a URL do Pix dinamico.')
+
+    account_info = _tlv('00', PIX_GUI)
+    if location:
+        account_info += _tlv('25', location.replace('https://', '', 1))
+    else:
+        account_info += _tlv('01', key.strip())
+        if description:
+            account_info += _tlv('02', description[:40])
+
+    payload = _tlv('00', '01')
+    if location:
+        payload += _tlv('01', '12')
+    payload += _tlv('26', account_info)
+    payload += _tlv('52', '0000')
+    payload += _tlv('53', '986')
+    if amount is not None and Decimal(amount) > 0:
+        payload += _tlv('54', f'{Decimal(amount):.2f}')
+    payload += _tlv('58', 'BR')
+    payload += _tlv('59', _ascii_text(merchant_name, MAX_MERCHANT_NAME) or 'RECEBEDOR')
+    payload += _tlv('60', _ascii_text(merchant_city, MAX_MERCHANT_CITY) or 'BRASIL')
+    payload += _tlv('62', _tlv('05', _txid(reference)))
+    payload += '6304'
+    return payload + crc16_ccitt(payload)
+
+
+def render_qr_png(payload, box_size=8, border=2):
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, box_size=box_size, border=border)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    image = qr.make_image(fill_color='black', back_color='white')
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
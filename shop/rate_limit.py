@@ -0,0 +1,81 @@
+import threading
+import time
+
+
+class TokenBucket:
+    # Um token a cada `interval` segundos, acumulando ate `burst`. acquire()
+    # reserva o proximo token e dorme so o necessario; threads concorrentes
+    # entram em fila sem passar da taxa.
+    def __init__(self, name, interval=0.0, burst=1):
+        self.name = name
+        self.interval = max(0.0, interval)
+        self.burst = max(1, int(burst))
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._stats = {'acquired': 0, 'waited': 0, 'wait_seconds': 0.0}
+
+    def _refill(self, now):
+        if self.interval > 0:
+            self._tokens = min(float(self.burst), self._tokens + (now - self._updated_at) / self.interval)
+        self._updated_at = now
+
+    def reserve(self):
+        # Devolve quantos segundos esperar antes de usar o token reservado.
+        if self.interval <= 0:
+            with self._lock:
+                self._stats['acquired'] += 1
+            return 0.0
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            wait = max(0.0, -self._tokens * self.interval)
+            self._stats['acquired'] += 1
+            if wait:
+                self._stats['waited'] += 1
+                self._stats['wait_seconds'] += wait
+        return wait
+
+    def capacity(self, seconds):
+        # Quantas reservas ainda cabem nos proximos `seconds` segundos, ja
+        # descontando as feitas e ainda nao usadas. None = sem limite.
+        if self.interval <= 0:
+            return None
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0, int(self._tokens + seconds / self.interval))
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def snapshot(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            data = dict(self._stats)
+            data.update(
+                {
+                    'name': self.name,
+                    'interval': self.interval,
+                    'burst': self.burst,
+                    'tokens': max(0.0, round(self._tokens, 2)),
+                    'per_minute': round(60 / self.interval, 1) if self.interval else 0,
+                }
+            )
+        data['wait_seconds'] = round(data['wait_seconds'], 1)
+        return data
+
+
+_buckets_lock = threading.Lock()
+_buckets = {}
+
+
+def get_token_bucket(name, **options):
+    with _buckets_lock:
+        bucket = _buckets.get(name)
+        if bucket is None:
+            bucket = TokenBucket(name, **options)
+            _buckets[name] = bucket
+        return bucket
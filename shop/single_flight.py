@@ -0,0 +1,149 @@
+import asyncio
+import threading
+import time
+
+
+class _Call:
+    def __init__(self, future=None):
+        self.event = threading.Event()
+        # Seguidores no mesmo event loop esperam o future; threads, o event.
+        self.future = future
+        self.value = None
+        self.error = None
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SingleFlightCache:
+    # Cache em memoria com validade curta + coalescencia: chamadas simultaneas
+    # para a mesma chave esperam a primeira em vez de repetir a consulta.
+    def __init__(self, name, ttl=5.0, max_entries=2048, wait_timeout=30.0):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max(1, int(max_entries))
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._inflight = {}
+        self._stats = {'hits': 0, 'coalesced': 0, 'calls': 0, 'errors': 0}
+
+    def _prune(self, now):
+        expired = [key for key, entry in self._entries.items() if entry[0] <= now]
+        for key in expired:
+            del self._entries[key]
+        while len(self._entries) >= self.max_entries:
+            self._entries.pop(next(iter(self._entries)))
+
+    def _begin(self, key, future_factory=None):
+        # Devolve (entrada_em_cache, chamada, lider).
+        with self._lock:
+            now = time.monotonic()
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._stats['hits'] += 1
+                return entry, None, False
+            call = self._inflight.get(key)
+            if call is None:
+                call = _Call(future_factory() if future_factory else None)
+                self._inflight[key] = call
+                self._stats['calls'] += 1
+                return None, call, True
+            self._stats['coalesced'] += 1
+            return None, call, False
+
+    def _finish(self, key, call, store=True):
+        with self._lock:
+            # Falhas tambem ficam guardadas pelo TTL: limita as consultas mesmo
+            # com o servico externo fora do ar.
+            if store:
+                now = time.monotonic()
+                self._prune(now)
+                self._entries[key] = (now + self.ttl, call.value, call.error)
+            if call.error is not None:
+                self._stats['errors'] += 1
+            self._inflight.pop(key, None)
+        call.event.set()
+        if call.future is not None and not call.future.done():
+            call.future.set_result(None)
+
+    @staticmethod
+    def _entry_result(entry):
+        _, value, error = entry
+        if error is not None:
+            raise error
+        return value
+
+    def get_or_call(self, key, func):
+        entry, call, leader = self._begin(key)
+        if entry is not None:
+            return self._entry_result(entry)
+        if not leader:
+            if not call.event.wait(self.wait_timeout):
+                raise TimeoutError(f'{self.name}: consulta em andamento demorou demais.')
+            return call.result()
+
+        try:
+            call.value = func()
+        except Exception as exc:
+            call.error = exc
+        self._finish(key, call)
+        return call.result()
+
+    async def aget_or_call(self, key, coro_func):
+        loop = asyncio.get_running_loop()
+        entry, call, leader = self._begin(key, loop.create_future)
+        if entry is not None:
+            return self._entry_result(entry)
+        if not leader:
+            try:
+                if call.future is not None and call.future.get_loop() is loop:
+                    await asyncio.wait_for(asyncio.shield(call.future), self.wait_timeout)
+                elif not await asyncio.to_thread(call.event.wait, self.wait_timeout):
+                    raise TimeoutError
+            except TimeoutError:
+                raise TimeoutError(f'{self.name}: consulta em andamento demorou demais.') from None
+            return call.result()
+
+        try:
+            call.value = await coro_func()
+        except Exception as exc:
+            call.error = exc
+        except BaseException:
+            # Lider cancelado (cliente desconectou): libera os seguidores sem cachear.
+            call.error = TimeoutError(f'{self.name}: consulta cancelada.')
+            self._finish(key, call, store=False)
+            raise
+        self._finish(key, call)
+        return call.result()
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self._stats)
+            data.update({'name': self.name, 'entries': len(self._entries), 'ttl': self.ttl})
+        lookups = data['hits'] + data['coalesced'] + data['calls']
+        data['saved_ratio'] = (data['hits'] + data['coalesced']) / lookups if lookups else 0
+        return data
+
+
+_caches_lock = threading.Lock()
+_caches = {}
+
+
+def get_single_flight_cache(name, **options):
+    with _caches_lock:
+        single_flight = _caches.get(name)
+        if single_flight is None:
+            single_flight = SingleFlightCache(name, **options)
+            _caches[name] = single_flight
+        return single_flight
@@ -1,23 +1,102 @@
+import asyncio
+import importlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import re
+import threading
+import time
+from datetime import timedelta
 from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import skipUnless
 from unittest.mock import patch
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import TestCase
-from django.urls import reverse
-
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import Http404
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, resolve, reverse
+from django.utils import timezone
+
+from . import urls as shop_urls
+from . import views
+from .admission import AdmissionController
+from .audit_buffer import AuditLogBuffer
+from .catalog import catalog_snapshot_stats, get_catalog_snapshot
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .http_client import AsyncHttpClient, HttpClient, close_http_clients
 from .models import (
+    AuditLog,
     DonationEntry,
     Order,
+    PaymentAttempt,
+    PaymentWebhookEvent,
     Product,
     ProductVariant,
     ProfitDistributionConfig,
     ProfitDistributionEntry,
     ProfitDistributionPerson,
+    WhatsAppOutbox,
+    WhatsAppRecipient,
 )
+from .order_events import get_order_status_hub, order_cache, publish_order_status
+from .pix import build_pix_brcode, crc16_ccitt, render_qr_png
+from .rate_limit import TokenBucket
+from .single_flight import SingleFlightCache
+
+
+def _create_pix_order(payment_id='', pix_code='pix-code', **fields):
+    order = Order.objects.create(
+        **{
+            'first_name': 'Ana',
+            'last_name': 'Lima',
+            'whatsapp': '16999999999',
+            'payment_method': Order.PAYMENT_PIX,
+            'total': Decimal('10.00'),
+            'mp_status': 'pending',
+            **fields,
+        }
+    )
+    order.current_payment = PaymentAttempt.objects.create(
+        order=order,
+        payment_id=payment_id,
+        status=order.mp_status,
+        status_detail=order.mp_status_detail,
+        pix_code=pix_code,
+    )
+    order.save(update_fields=['current_payment'])
+    return order
+
+
+# Cache so na memoria do processo: nada do servidor de desenvolvimento ou de
+# uma rodada anterior (heartbeat do conciliador, versao do catalogo,
+# pagamentos do MP) vaza para os testes.
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shop-tests'},
+    'orders': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shop-tests-orders'},
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ShopTestCase(TestCase):
+    # Cada teste comeca com o cache vazio.
+    def setUp(self):
+        cache.clear()
+        order_cache().clear()
 
 
-class StoreFlowTests(TestCase):
+class StoreFlowTests(ShopTestCase):
     def setUp(self):
+        super().setUp()
         self.product = Product.objects.create(
             name='Pastel de Queijo',
             description='Tradicional',
@@ -49,6 +128,116 @@ class StoreFlowTests(TestCase):
         self.assertContains(response, self.product.name)
         self.assertNotContains(response, self.inactive_product.name)
 
+    def test_catalog_snapshot_is_reused_until_catalog_changes(self):
+        get_catalog_snapshot()
+        hits_before = catalog_snapshot_stats()['hits']
+
+        with self.assertNumQueries(0):
+            snapshot = get_catalog_snapshot()
+
+        self.assertEqual(catalog_snapshot_stats()['hits'], hits_before + 1)
+        self.assertEqual([product.id for product in snapshot['active_products']], [self.product.id])
+        self.assertEqual(snapshot['active_products'][0].active_variants, [self.variant])
+
+        self.client.login(username='admin', password='senha-segura')
+        self.client.post(
+            reverse('manage_products_save_page'),
+            {
+                'name': 'Pastel de Carne',
+                'cause': 'Missoes',
+                'price': '14.00',
+                'active': 'on',
+            },
+        )
+
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'Pastel de Carne')
+
+    def test_catalog_snapshot_drops_deleted_product(self):
+        get_catalog_snapshot()
+
+        self.client.login(username='admin', password='senha-segura')
+        self.client.post(reverse('manage_products_delete_page', args=[self.product.id]))
+
+        response = self.client.get(reverse('home'))
+        self.assertNotContains(response, self.product.name)
+
+    def test_home_is_cacheable_and_does_not_touch_session(self):
+        response = self.client.get(reverse('home'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('public', response['Cache-Control'])
+        self.assertTrue(response.has_header('ETag'))
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+        self.assertEqual(len(response.cookies), 0)
+        self.assertFalse(Session.objects.exists())
+
+        cached_response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached_response.status_code, 304)
+
+    def test_cart_state_returns_cart_and_sets_cart_cookie(self):
+        self.client.post(
+            reverse('cart_add', args=[self.product.id]),
+            {'quantity': 2, 'variant_id': self.variant.id},
+        )
+
+        response = self.client.get(reverse('cart_state'))
+
+        self.assertEqual(response.status_code, 200)
+        payload = response.json()
+        self.assertEqual(payload['cart']['count'], 2)
+        self.assertFalse(payload['is_authenticated'])
+        self.assertTrue(payload['csrf_token'])
+        self.assertTrue(response.cookies['shop_cart'].value)
+
+    def test_signed_cookie_cart_does_not_write_session(self):
+        self.client.post(
+            reverse('cart_add', args=[self.product.id]),
+            {'quantity': 2, 'variant_id': self.variant.id},
+        )
+        update_response = self.client.post(
+            reverse('cart_update', args=[self.product.id]),
+            {'action': 'inc'},
+        )
+
+        self.assertEqual(update_response.json()['count'], 3)
+        self.assertFalse(Session.objects.exists())
+
+        self.client.cookies['shop_cart'] = self.client.cookies['shop_cart'].value + 'x'
+        self.assertEqual(self.client.get(reverse('cart_state')).json()['cart']['count'], 0)
+
+    def test_signed_cookie_cart_rejects_cart_above_cookie_limit(self):
+        cart = {f'{product_id}:0': 1 for product_id in range(100000, 100400)}
+        session = self.client.session
+        session['cart'] = cart
+        session.save()
+
+        response = self.client.post(reverse('cart_add', args=[self.product.id]), {'quantity': 1})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.json())
+
+    def test_session_cart_is_migrated_to_signed_cookie(self):
+        session = self.client.session
+        session['cart'] = {f'{self.product.id}:{self.variant.id}': 2}
+        session.save()
+
+        response = self.client.get(reverse('cart_state'))
+
+        self.assertEqual(response.json()['cart']['count'], 2)
+        self.assertNotIn('cart', self.client.session)
+        self.assertEqual(self.client.get(reverse('cart_state')).json()['cart']['count'], 2)
+
+    @override_settings(SHOP_CART_BACKEND='shop.cart.SessionCartStore')
+    def test_session_cart_backend_keeps_cart_in_session(self):
+        self.client.post(
+            reverse('cart_add', args=[self.product.id]),
+            {'quantity': 2, 'variant_id': self.variant.id},
+        )
+
+        self.assertEqual(self.client.session['cart'], {f'{self.product.id}:{self.variant.id}': 2})
+        self.assertEqual(self.client.cookies['shop_cart'].value, '2')
+
     def test_cart_add_and_update_quantity(self):
         add_response = self.client.post(
             reverse('cart_add', args=[self.product.id]),
@@ -70,6 +259,102 @@ class StoreFlowTests(TestCase):
         self.assertEqual(update_payload['count'], 1)
         self.assertEqual(update_payload['total'], '12.50')
 
+    def test_cart_batch_applies_operations_in_one_request(self):
+        operations = [
+            {'action': 'add', 'product_id': self.product.id, 'variant_id': self.variant.id, 'quantity': 2},
+            {'action': 'inc', 'product_id': self.product.id, 'variant_id': self.variant.id},
+            {'action': 'inc', 'product_id': self.product.id, 'variant_id': ''},
+            {'action': 'dec', 'product_id': self.product.id, 'variant_id': self.variant.id},
+            {'action': 'set', 'product_id': self.product.id, 'variant_id': None, 'quantity': 3},
+        ]
+
+        response = self.client.post(reverse('cart_batch'), {'operations': json.dumps(operations)})
+
+        self.assertEqual(response.status_code, 200)
+        payload = response.json()
+        self.assertEqual(payload['count'], 5)
+        self.assertEqual(payload['total'], '55.00')
+
+    def test_cart_batch_rejects_whole_batch_on_invalid_operation(self):
+        self.client.post(reverse('cart_add', args=[self.product.id]), {'quantity': 1})
+        operations = [
+            {'action': 'inc', 'product_id': self.product.id},
+            {'action': 'inc', 'product_id': self.inactive_product.id},
+        ]
+
+        response = self.client.post(reverse('cart_batch'), {'operations': json.dumps(operations)})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(reverse('cart_state')).json()['cart']['count'], 1)
+
+    def test_cart_add_uses_price_index_without_queries(self):
+        get_catalog_snapshot()
+        request = RequestFactory().post(
+            reverse('cart_add', args=[self.product.id]),
+            {'quantity': 2, 'variant_id': self.variant.id},
+        )
+
+        with self.assertNumQueries(0):
+            response = views.cart_add(request, self.product.id)
+
+        self.assertEqual(json.loads(response.content)['total'], '25.00')
+
+        request = RequestFactory().post(
+            reverse('cart_add', args=[self.inactive_product.id]),
+            {'quantity': 1},
+        )
+        with self.assertRaises(Http404):
+            views.cart_add(request, self.inactive_product.id)
+
+    @patch('shop.views._create_mp_pix_payment')
+    def test_checkout_finalize_uses_database_prices(self, create_pix_mock):
+        create_pix_mock.return_value = {
+            'payment_id': '123456789',
+            'external_reference': 'ORDER_1',
+            'status': 'pending',
+            'status_detail': 'pending_waiting_transfer',
+            'pix_code': 'pix-code-copy-paste',
+        }
+        self.client.post(
+            reverse('cart_add', args=[self.product.id]),
+            {'quantity': 2, 'variant_id': self.variant.id},
+        )
+        # update() nao dispara sinais: o indice em memoria fica com o preco antigo.
+        ProductVariant.objects.filter(id=self.variant.id).update(price=Decimal('15.00'))
+
+        response = self.client.post(
+            reverse('checkout_finalize'),
+            {
+                'first_name': 'Maria',
+                'last_name': 'Souza',
+                'whatsapp': '16999999999',
+                'payment_method': 'pix',
+            },
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Order.objects.get().total, Decimal('30.00'))
+
+    def test_checkout_finalize_is_busy_when_saturated(self):
+        controller = AdmissionController('Checkout', max_limit=1)
+        controller.try_acquire()
+        data = {'first_name': 'Joao', 'last_name': 'Silva', 'whatsapp': '16999999999', 'payment_method': 'pix'}
+
+        with patch('shop.views._checkout_admission', return_value=controller):
+            response = self.client.post(reverse('checkout_finalize'), data)
+            self.assertEqual(response.status_code, 503)
+            payload = response.json()
+            self.assertTrue(payload['busy'])
+            self.assertNotIn('queue_position', payload)
+            self.assertEqual(response['Retry-After'], str(payload['retry_after']))
+
+            controller.release()
+            response = self.client.post(reverse('checkout_finalize'), data)
+
+        # Admitido: segue para a validacao normal (carrinho vazio) e libera a vaga.
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(controller.snapshot()['in_flight'], 0)
+
     def test_checkout_finalize_requires_items_in_cart(self):
         response = self.client.post(
             reverse('checkout_finalize'),
@@ -92,7 +377,6 @@ class StoreFlowTests(TestCase):
             'status': 'pending',
             'status_detail': 'pending_waiting_transfer',
             'pix_code': 'pix-code-copy-paste',
-            'qr_base64': 'base64-image',
         }
 
         self.client.post(
@@ -120,12 +404,424 @@ class StoreFlowTests(TestCase):
         self.assertEqual(order.first_name, 'Maria')
         self.assertEqual(order.total, self.product.price * 2)
         self.assertFalse(order.is_paid)
-        self.assertEqual(order.mp_payment_id, '123456789')
+        self.assertEqual(order.current_payment.payment_id, '123456789')
 
+        self.assertEqual(self.client.get(reverse('cart_state')).json()['cart']['count'], 0)
         session = self.client.session
-        self.assertEqual(session.get('cart'), {})
         self.assertEqual(session.get('last_public_print_order_id'), order.id)
 
+    @patch('shop.views._create_mp_pix_payment')
+    def test_checkout_finalize_repeated_submission_returns_same_order(self, create_pix_mock):
+        create_pix_mock.return_value = {
+            'payment_id': '123456789',
+            'external_reference': 'ORDER_1',
+            'status': 'pending',
+            'status_detail': 'pending_waiting_transfer',
+            'pix_code': 'pix-code-copy-paste',
+        }
+        self.client.post(reverse('cart_add', args=[self.product.id]), {'quantity': 2})
+        cart_cookie = self.client.cookies['shop_cart'].value
+        data = {'first_name': 'Maria', 'last_name': 'Souza', 'whatsapp': '16999999999', 'payment_method': 'pix'}
+
+        first = self.client.post(reverse('checkout_finalize'), data).json()
+        # Segundo toque saiu antes da resposta do primeiro: ainda com o carrinho.
+        self.client.cookies['shop_cart'] = cart_cookie
+        second = self.client.post(reverse('checkout_finalize'), data).json()
+
+        self.assertEqual(second['order_id'], first['order_id'])
+        self.assertEqual(second['pix_code'], 'pix-code-copy-paste')
+        self.assertEqual(second['qr_code_url'], first['qr_code_url'])
+        self.assertEqual(second['cart']['count'], 0)
+        self.assertEqual(create_pix_mock.call_count, 1)
+
+        # Fora da janela o mesmo carrinho e uma compra nova.
+        self.client.cookies['shop_cart'] = cart_cookie
+        with patch.dict(os.environ, {'CHECKOUT_IDEMPOTENCY_SECONDS': '0'}):
+            third = self.client.post(reverse('checkout_finalize'), data).json()
+        self.assertNotEqual(third['order_id'], first['order_id'])
+        self.assertEqual(Order.objects.count(), 2)
+
+    @patch('shop.views._create_mp_pix_payment')
+    def test_concurrent_checkout_with_same_key_collapses(self, create_pix_mock):
+        self.client.post(reverse('cart_add', args=[self.product.id]), {'quantity': 1})
+        data = {'first_name': 'Maria', 'last_name': 'Souza', 'whatsapp': '16999999999', 'payment_method': 'pix'}
+        winner = _create_pix_order(payment_id='555', pix_code='pix-winner', checkout_key='k' * 64)
+
+        # A consulta inicial nao viu o outro envio; o insert esbarra na unique.
+        with (
+            patch('shop.views._checkout_idempotency_key', return_value='k' * 64),
+            patch('shop.views._checkout_order_by_key', side_effect=[None, views._checkout_order_by_key('k' * 64)]),
+        ):
+            response = self.client.post(reverse('checkout_finalize'), data)
+
+        self.assertEqual(response.json()['order_id'], winner.id)
+        self.assertEqual(response.json()['pix_code'], 'pix-winner')
+        create_pix_mock.assert_not_called()
+        self.assertEqual(Order.objects.count(), 1)
+
+    def _post_async_checkout(self):
+        self.client.post(reverse('cart_add', args=[self.product.id]), {'quantity': 2})
+        with patch('shop.views.submit_background', side_effect=lambda func, *args: func(*args)) as submit_mock:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    reverse('checkout_finalize'),
+                    {
+                        'first_name': 'Maria',
+                        'last_name': 'Souza',
+                        'whatsapp': '16999999999',
+                        'payment_method': 'pix',
+                    },
+                )
+        self.assertEqual(submit_mock.call_count, 1)
+        return response
+
+    @patch.dict(os.environ, {'MP_PIX_ASYNC': '1'})
+    @patch('shop.views._create_mp_pix_payment')
+    def test_checkout_finalize_async_pix_is_delivered_through_status(self, create_pix_mock):
+        create_pix_mock.return_value = {
+            'payment_id': '123456789',
+            'external_reference': 'ORDER_1',
+            'status': 'pending',
+            'status_detail': 'pending_waiting_transfer',
+            'pix_code': 'pix-code-copy-paste',
+        }
+
+        response = self._post_async_checkout()
+
+        self.assertEqual(response.status_code, 200)
+        payload = response.json()
+        self.assertEqual(payload['order_status'], 'creating')
+        self.assertEqual(payload['pix_code'], '')
+
+        order = Order.objects.get()
+        self.assertEqual(order.current_payment.payment_id, '123456789')
+        self.assertEqual(order.mp_status, 'pending')
+
+        status_payload = self.client.get(reverse('checkout_status', args=[order.id]), {'pix': '1'}).json()
+        self.assertEqual(status_payload['pix_code'], 'pix-code-copy-paste')
+        self.assertIn(f'/orders/{order.id}/pix-qr/', status_payload['qr_code_url'])
+
+    @patch('shop.views._get_mp_payment')
+    def test_checkout_status_caches_mp_lookups_and_trusts_paid_orders(self, get_payment_mock):
+        get_payment_mock.return_value = {'id': '555000111', 'status': 'pending', 'status_detail': 'pending_waiting_transfer'}
+        order = _create_pix_order('555000111')
+        status_cache = views._mp_status_cache()
+        status_cache.clear()
+        order_cache().delete(views._mp_payment_cache_key('555000111'))
+        self.addCleanup(status_cache.clear)
+        self.addCleanup(order_cache().delete, views._mp_payment_cache_key('555000111'))
+
+        for _ in range(3):
+            payload = self.client.get(reverse('checkout_status', args=[order.id])).json()
+            self.assertFalse(payload['is_paid'])
+        self.assertEqual(get_payment_mock.call_count, 1)
+
+        Order.objects.filter(id=order.id).update(is_paid=True, mp_status='approved')
+        payload = self.client.get(reverse('checkout_status', args=[order.id])).json()
+        self.assertTrue(payload['is_paid'])
+        self.assertEqual(get_payment_mock.call_count, 1)
+
+    @patch('shop.views._queue_whatsapp_notifications_for_order')
+    @patch('shop.management.commands.reconcile_payments._get_mp_payment')
+    @patch('shop.management.commands.reconcile_payments._search_mp_payments')
+    def test_reconcile_payments_updates_pending_orders_in_bulk(self, search_mock, get_payment_mock, notify_mock):
+        orders = [
+            _create_pix_order(f'90{index}', last_name=str(index), mp_status_detail='pending_waiting_transfer')
+            for index in range(3)
+        ]
+        results = [
+            {'id': '900', 'status': 'approved', 'status_detail': 'accredited', 'external_reference': f'ORDER_{orders[0].id}'},
+            {'id': '901', 'status': 'rejected', 'status_detail': 'cc_rejected_other_reason'},
+        ]
+        search_mock.side_effect = lambda params: {
+            'paging': {'total': len(results), 'limit': params['limit'], 'offset': params['offset']},
+            'results': results[params['offset']:params['offset'] + params['limit']],
+        }
+        get_payment_mock.return_value = {'id': '902', 'status': 'pending', 'status_detail': 'pending_waiting_transfer'}
+        for payment_id in ('900', '901', '902'):
+            self.addCleanup(order_cache().delete, views._mp_payment_cache_key(payment_id))
+
+        output = io.StringIO()
+        call_command('reconcile_payments', '--once', '--page-size', '1', stdout=output)
+
+        self.assertEqual(search_mock.call_count, 2)
+        self.assertEqual([call.args[0]['offset'] for call in search_mock.call_args_list], [0, 1])
+        get_payment_mock.assert_called_once_with('902')
+        orders = [Order.objects.get(id=order.id) for order in orders]
+        self.assertTrue(orders[0].is_paid)
+        self.assertEqual(orders[1].mp_status, 'rejected')
+        self.assertEqual(orders[2].mp_status, 'pending')
+        self.assertIn('2 atualizados, 1 pagos', output.getvalue())
+
+    @patch('shop.views._queue_whatsapp_notifications_for_order')
+    @patch('shop.management.commands.reconcile_payments._search_mp_payments')
+    def test_reconcile_replay_never_unpays_manually_paid_orders(self, search_mock, notify_mock):
+        order = _create_pix_order('930', is_paid=True, paid_at=timezone.now(), mp_status='approved_manual')
+        pending = _create_pix_order('931', last_name='Pendente')
+        search_mock.return_value = {
+            'paging': {'total': 2},
+            'results': [
+                {'id': '930', 'status': 'cancelled', 'status_detail': 'expired', 'external_reference': f'ORDER_{order.id}'},
+                {'id': '931', 'status': 'approved', 'status_detail': 'accredited', 'external_reference': f'ORDER_{pending.id}'},
+            ],
+        }
+        self.addCleanup(order_cache().delete, views._mp_payment_cache_key('931'))
+
+        output = io.StringIO()
+        call_command('reconcile_payments', '--since', '2026-10-01', '--until', '2026-10-02', stdout=output)
+
+        order.refresh_from_db()
+        self.assertTrue(order.is_paid)
+        self.assertIsNotNone(order.paid_at)
+        self.assertEqual(order.mp_status, 'approved_manual')
+        pending.refresh_from_db()
+        self.assertTrue(pending.is_paid)
+        self.assertIn('1 atualizados, 1 pagos, 1 ja pagos mantidos', output.getvalue())
+
+    def test_order_admin_shows_current_pix_code(self):
+        order = _create_pix_order('333', pix_code='pix-atual')
+        self.assertEqual(Order.objects.create(total=Decimal('1.00')).mp_payment_id, '')
+
+        User.objects.create_superuser(username='root', password='senha-segura')
+        self.client.login(username='root', password='senha-segura')
+        response = self.client.get(reverse('admin:shop_order_change', args=[order.id]))
+        self.assertContains(response, 'pix-atual')
+
+    @patch('shop.views._queue_whatsapp_notifications_for_order')
+    def test_mp_update_for_an_older_attempt_only_wins_when_approved(self, notify_mock):
+        order = _create_pix_order('111')
+        old_attempt = order.current_payment
+        views._apply_pix_payload(
+            order,
+            {'payment_id': '222', 'external_reference': '', 'status': 'pending', 'status_detail': '', 'pix_code': 'novo'},
+        )
+
+        views._sync_order_from_mp_payment(order, {'id': '111', 'status': 'cancelled', 'status_detail': 'expired'})
+        order.refresh_from_db()
+        old_attempt.refresh_from_db()
+        self.assertEqual(old_attempt.status, 'cancelled')
+        self.assertEqual(order.mp_status, 'pending')
+        self.assertEqual((order.mp_payment_id, order.pix_code), ('222', 'novo'))
+
+        views._sync_order_from_mp_payment(order, {'id': '111', 'status': 'approved', 'status_detail': 'accredited'})
+        order.refresh_from_db()
+        self.assertTrue(order.is_paid)
+        self.assertEqual(order.current_payment_id, old_attempt.id)
+
+    @patch('shop.views._get_mp_payment')
+    def test_checkout_status_skips_mp_while_reconciler_is_alive(self, get_payment_mock):
+        order = _create_pix_order('555000222')
+        views._mark_payment_reconciler_alive(60)
+        self.addCleanup(cache.delete, views.MP_RECONCILER_HEARTBEAT_KEY)
+
+        payload = self.client.get(reverse('checkout_status', args=[order.id])).json()
+
+        self.assertEqual(payload['status'], 'pending')
+        get_payment_mock.assert_not_called()
+
+    @patch('shop.views._queue_whatsapp_notifications_for_order')
+    @patch('shop.views._get_mp_payment')
+    def test_payments_webhook_queues_events_and_worker_coalesces_them(self, get_payment_mock, notify_mock):
+        order = _create_pix_order()
+        get_payment_mock.return_value = {
+            'id': '321',
+            'status': 'approved',
+            'status_detail': 'accredited',
+            'external_reference': f'ORDER_{order.id}',
+        }
+        self.addCleanup(order_cache().delete, views._mp_payment_cache_key('321'))
+        for request_id in ('req-1', 'req-2', 'req-2'):
+            response = self.client.post(
+                reverse('payments_webhook'),
+                data=json.dumps({'data': {'id': '321'}}),
+                content_type='application/json',
+                headers={'x-request-id': request_id},
+            )
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'ok': True, 'queued': False})
+        get_payment_mock.assert_not_called()
+
+        stats = views._drain_webhook_inbox()
+
+        self.assertEqual(stats, {'events': 2, 'payments': 1, 'coalesced': 1, 'failed': 0})
+        get_payment_mock.assert_called_once_with('321')
+        order.refresh_from_db()
+        self.assertTrue(order.is_paid)
+        self.assertEqual(
+            list(PaymentWebhookEvent.objects.values_list('status', flat=True)),
+            [PaymentWebhookEvent.STATUS_PROCESSED] * 2,
+        )
+
+    @patch('shop.views._get_mp_payment')
+    def test_failed_webhook_events_stop_retrying_and_can_be_replayed(self, get_payment_mock):
+        get_payment_mock.side_effect = ValueError('Mercado Pago fora do ar')
+        event = PaymentWebhookEvent.objects.create(payment_id='654', request_id='req-654')
+
+        for attempt in range(1, views.WEBHOOK_MAX_ATTEMPTS + 1):
+            views._drain_webhook_inbox()
+            # Espera crescente: a passada seguinte nao pega o evento de novo.
+            self.assertEqual(views._drain_webhook_inbox()['events'], 0)
+            event.refresh_from_db()
+            if attempt < views.WEBHOOK_MAX_ATTEMPTS:
+                self.assertGreater(
+                    event.next_attempt_at,
+                    timezone.now() + timedelta(seconds=views._webhook_retry_delay(attempt) - 5),
+                )
+            PaymentWebhookEvent.objects.filter(id=event.id).update(next_attempt_at=timezone.now())
+        event.refresh_from_db()
+        self.assertEqual(event.status, PaymentWebhookEvent.STATUS_FAILED)
+        self.assertEqual(event.attempts, views.WEBHOOK_MAX_ATTEMPTS)
+        self.assertEqual(views._drain_webhook_inbox()['events'], 0)
+
+        get_payment_mock.side_effect = None
+        get_payment_mock.return_value = {'id': '654', 'status': 'approved'}
+        self.addCleanup(order_cache().delete, views._mp_payment_cache_key('654'))
+        output = io.StringIO()
+        call_command('replay_webhooks', '--process', stdout=output)
+
+        event.refresh_from_db()
+        self.assertEqual(event.status, PaymentWebhookEvent.STATUS_IGNORED)
+        self.assertIn('1 eventos devolvidos', output.getvalue())
+
+    @patch('shop.views._get_mp_payment')
+    def test_webhook_events_wait_for_open_circuit_without_spending_attempts(self, get_payment_mock):
+        get_payment_mock.side_effect = CircuitOpenError('Mercado Pago indisponivel no momento.')
+        event = PaymentWebhookEvent.objects.create(payment_id='655', request_id='req-655')
+
+        for _ in range(views.WEBHOOK_MAX_ATTEMPTS + 1):
+            views._drain_webhook_inbox()
+            PaymentWebhookEvent.objects.filter(id=event.id).update(next_attempt_at=timezone.now())
+
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), (PaymentWebhookEvent.STATUS_PENDING, 0))
+        views._drain_webhook_inbox()
+        event.refresh_from_db()
+        self.assertGreater(event.next_attempt_at, timezone.now())
+        self.assertEqual(views._drain_webhook_inbox()['events'], 0)
+
+    def test_order_status_changes_publish_a_new_version(self):
+        order = _create_pix_order()
+        hub = get_order_status_hub()
+        version = hub.current_version(order.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.whatsapp_notified = True
+            order.save(update_fields=['whatsapp_notified'])
+        self.assertEqual(hub.current_version(order.id), version)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.is_paid = True
+            order.save(update_fields=['is_paid'])
+        self.assertNotEqual(hub.current_version(order.id), version)
+
+    def test_per_order_keys_stay_out_of_the_default_cache(self):
+        # O corte aleatorio do cache 'orders' nao alcanca a versao do catalogo.
+        order = _create_pix_order()
+        version = get_order_status_hub().publish(order.id)
+        views._remember_mp_payment('321', {'id': '321', 'status': 'pending'})
+
+        self.assertEqual(order_cache().get(f'shop:order_status:{order.id}'), version)
+        self.assertIsNotNone(order_cache().get(views._mp_payment_cache_key('321')))
+        self.assertIsNone(cache.get(f'shop:order_status:{order.id}'))
+        self.assertIsNone(cache.get(views._mp_payment_cache_key('321')))
+
+    def test_order_status_stream_under_wsgi_sends_one_event_and_retry(self):
+        order = _create_pix_order()
+
+        response = self.client.get(reverse('order_status_stream', args=[order.id]), {'pix': '1'})
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response.streaming_content).decode('utf-8')
+        self.assertTrue(body.startswith('retry: 5000\n'))
+        data = json.loads(body.split('data: ', 1)[1])
+        self.assertEqual(data['order_id'], order.id)
+        self.assertEqual(data['pix_code'], 'pix-code')
+
+        wait_payload = self.client.get(reverse('order_status_wait', args=[order.id]), {'since': '0'}).json()
+        self.assertEqual(wait_payload['retry_ms'], 5000)
+        self.assertFalse(wait_payload['is_paid'])
+
+    @patch('shop.views._queue_whatsapp_notifications_for_order')
+    @patch('shop.views._aget_mp_payment')
+    @patch('shop.views._get_mp_payment')
+    def test_order_status_stream_under_wsgi_uses_the_pooled_sync_client(self, get_payment_mock, aget_payment_mock, notify_mock):
+        # Sob WSGI cada requisicao tem seu loop: o cliente async nao seria reaproveitado.
+        get_payment_mock.return_value = {'id': '321', 'status': 'approved', 'status_detail': 'accredited'}
+        order = _create_pix_order(payment_id='321')
+
+        response = self.client.get(reverse('order_status_stream', args=[order.id]))
+        body = b''.join(response.streaming_content).decode('utf-8')
+
+        self.assertTrue(json.loads(body.split('data: ', 1)[1])['is_paid'])
+        get_payment_mock.assert_called_once_with('321')
+        aget_payment_mock.assert_not_called()
+
+    async def test_order_status_long_poll_wakes_up_on_publish(self):
+        order = await sync_to_async(_create_pix_order)()
+        hub = get_order_status_hub()
+        version = await hub.acurrent_version(order.id)
+
+        async def mark_paid():
+            await asyncio.sleep(0.2)
+            await Order.objects.filter(id=order.id).aupdate(is_paid=True, mp_status='approved_manual')
+            await sync_to_async(publish_order_status)(order.id)
+
+        task = asyncio.create_task(mark_paid())
+        started = time.monotonic()
+        response = await self.async_client.get(
+            reverse('order_status_wait', args=[order.id]),
+            {'since': str(version)},
+        )
+        await task
+
+        payload = response.json()
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertTrue(payload['is_paid'])
+        self.assertNotEqual(payload['version'], version)
+        self.assertEqual(payload['retry_ms'], 0)
+
+    @patch.dict(os.environ, {'MP_PIX_ASYNC': '1'})
+    @patch('shop.views._create_mp_pix_payment')
+    def test_checkout_finalize_async_pix_failure_marks_order(self, create_pix_mock):
+        create_pix_mock.side_effect = ValueError('Erro Mercado Pago: indisponivel')
+
+        response = self._post_async_checkout()
+
+        self.assertEqual(response.status_code, 200)
+        order = Order.objects.get()
+        self.assertEqual(order.mp_status, 'failed')
+        self.assertIn('indisponivel', order.mp_status_detail)
+        status_payload = self.client.get(reverse('checkout_status', args=[order.id]), {'pix': '1'}).json()
+        self.assertEqual(status_payload['status'], 'failed')
+        self.assertNotIn('pix_code', status_payload)
+
+    @patch('shop.views._create_mp_pix_payment')
+    def test_checkout_finalize_fails_fast_while_mp_circuit_is_open(self, create_pix_mock):
+        breaker = views._mp_circuit_breaker()
+        self.addCleanup(breaker.reset)
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure('HTTP 503')
+        self.client.post(reverse('cart_add', args=[self.product.id]), {'quantity': 1})
+
+        response = self.client.post(
+            reverse('checkout_finalize'),
+            {
+                'first_name': 'Maria',
+                'last_name': 'Souza',
+                'whatsapp': '16999999999',
+                'payment_method': 'pix',
+            },
+        )
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+        create_pix_mock.assert_not_called()
+        self.assertFalse(Order.objects.exists())
+
+        self.client.login(username='admin', password='senha-segura')
+        self.assertContains(self.client.get(reverse('manage_audit_page')), 'Aberto (falha rapida)')
+        self.assertContains(self.client.get(reverse('manage_products_page')), 'novas cobrancas Pix estao sendo recusadas')
+
     def test_auth_login_success(self):
         response = self.client.post(
             reverse('auth_login'),
@@ -149,6 +845,17 @@ class StoreFlowTests(TestCase):
 
         self.assertEqual(response.status_code, 200)
 
+    def test_manage_reports_order_lists_load_only_list_fields(self):
+        _create_pix_order(is_delivered=True, delivered_at=timezone.now())
+
+        self.client.login(username='admin', password='senha-segura')
+        response = self.client.get(reverse('manage_reports_page'))
+
+        for key in ('recent_orders', 'delivered_orders'):
+            order = response.context[key][0]
+            self.assertIn('items_json', order.get_deferred_fields())
+        self.assertNotIn('delivered_at', response.context['delivered_orders'][0].get_deferred_fields())
+
     def test_manage_reports_shows_profit_distribution_person(self):
         person = ProfitDistributionPerson.objects.create(name='Ana', amount=Decimal('120.00'))
         ProfitDistributionEntry.objects.create(person=person, amount=Decimal('120.00'))
@@ -238,7 +945,6 @@ class StoreFlowTests(TestCase):
             whatsapp='16999990000',
             payment_method=Order.PAYMENT_CASH,
             total=Decimal('20.00'),
-            pix_code='',
             items_json=[{'id': self.product.id, 'name': self.product.name, 'price': '20.00', 'quantity': 1, 'subtotal': '20.00'}],
             is_paid=True,
         )
@@ -258,7 +964,6 @@ class StoreFlowTests(TestCase):
             whatsapp='16999990000',
             payment_method=Order.PAYMENT_CASH,
             total=Decimal('20.00'),
-            pix_code='',
             items_json=[{'id': self.product.id, 'name': self.product.name, 'price': '20.00', 'quantity': 1, 'subtotal': '20.00'}],
             is_paid=True,
         )
@@ -312,7 +1017,6 @@ class StoreFlowTests(TestCase):
             'status': 'pending',
             'status_detail': 'pending_waiting_transfer',
             'pix_code': 'pix-code-venda',
-            'qr_base64': 'qr-base64',
         }
 
         self.client.login(username='admin', password='senha-segura')
@@ -328,13 +1032,117 @@ class StoreFlowTests(TestCase):
 
         self.assertEqual(response.status_code, 200)
         payload = response.json()
-        self.assertIn('qr_code_base64', payload)
+        self.assertIn('/pix-qr/', payload['qr_code_url'])
         self.assertFalse(payload['is_paid'])
 
         order = Order.objects.latest('id')
         self.assertEqual(order.payment_method, Order.PAYMENT_PIX)
         self.assertFalse(order.is_paid)
-        self.assertEqual(order.mp_payment_id, '111222333')
+        self.assertEqual(order.current_payment.payment_id, '111222333')
+
+    @patch.dict(os.environ, {'PIX_KEY': 'pix@missaoandrews.com.br'})
+    @patch('shop.views._create_mp_pix_payment')
+    def test_manage_sales_create_order_local_pix_skips_mercado_pago(self, create_pix_mock):
+        self.client.login(username='admin', password='senha-segura')
+        self.assertContains(self.client.get(reverse('manage_sales_page')), 'data-payment-choice="pix_local"')
+
+        response = self.client.post(
+            reverse('manage_sales_create_order'),
+            {
+                'customer_name': 'Venda Pix',
+                'whatsapp': '16988887777',
+                'payment_method': 'pix',
+                'pix_provider': 'local',
+                'items_json': f'[{{"product_id": {self.product.id}, "variant_id": {self.variant.id}, "quantity": 2}}]',
+            },
+        )
+
+        self.assertEqual(response.status_code, 200)
+        payload = response.json()
+        self.assertTrue(payload['pix_local'])
+        self.assertTrue(payload['qr_code_url'])
+        create_pix_mock.assert_not_called()
+
+        order = Order.objects.latest('id')
+        pix_code = order.current_payment.pix_code
+        self.assertIn('0014br.gov.bcb.pix0124pix@missaoandrews.com.br', pix_code)
+        self.assertIn('540525.00', pix_code)
+        self.assertEqual(pix_code[-4:], crc16_ccitt(pix_code[:-4]))
+        self.assertEqual(order.current_payment.provider, PaymentAttempt.PROVIDER_PIX_LOCAL)
+        self.assertEqual(order.current_payment.payment_id, '')
+        self.assertEqual(views._order_status_label(order), 'Aguardando confirmacao do Pix')
+
+    @patch.dict(os.environ, {'PIX_KEY': 'pix@missaoandrews.com.br'})
+    @patch('shop.views._create_mp_pix_payment')
+    def test_checkout_finalize_falls_back_to_local_pix_when_mp_is_down(self, create_pix_mock):
+        create_pix_mock.side_effect = views.MercadoPagoUnavailableError('Erro Mercado Pago: HTTP 503')
+        self.client.post(reverse('cart_add', args=[self.product.id]), {'quantity': 1})
+
+        response = self.client.post(
+            reverse('checkout_finalize'),
+            {
+                'first_name': 'Maria',
+                'last_name': 'Souza',
+                'whatsapp': '16999999999',
+                'payment_method': 'pix',
+            },
+        )
+
+        self.assertEqual(response.status_code, 200)
+        payload = response.json()
+        self.assertTrue(payload['pix_code'].startswith('000201'))
+        self.assertTrue(payload['qr_code_url'])
+        order = Order.objects.get()
+        self.assertEqual(order.mp_status_detail, 'pix_local')
+
+    def test_pix_qr_image_is_signed_cacheable_and_rendered_once(self):
+        order = _create_pix_order(pix_code='00020126pix-code-copy-paste')
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, True)
+        qr_url = views._build_pix_qr_url(order)
+
+        with override_settings(MEDIA_ROOT=media_root), patch(
+            'shop.views.render_qr_png', wraps=views.render_qr_png
+        ) as render_mock:
+            response = self.client.get(qr_url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'image/png')
+            self.assertIn('immutable', response['Cache-Control'])
+            self.assertTrue(response.content.startswith(b'\x89PNG'))
+
+            second = self.client.get(qr_url)
+            self.assertEqual(second.content, response.content)
+            self.assertEqual(render_mock.call_count, 1)
+
+            not_modified = self.client.get(qr_url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(not_modified.status_code, 304)
+
+        tampered = qr_url.replace('sig=', 'sig=x')
+        self.assertEqual(self.client.get(tampered).status_code, 403)
+
+        # Pix gerado de novo: link novo, e o do Pix anterior continua valido.
+        views._apply_pix_payload(
+            order,
+            {
+                'payment_id': '',
+                'external_reference': '',
+                'status': 'pending',
+                'status_detail': '',
+                'pix_code': '00020126outro-pix',
+            },
+        )
+        new_qr_url = views._build_pix_qr_url(order)
+        self.assertNotEqual(new_qr_url, qr_url)
+        self.assertEqual(order.payment_attempts.count(), 2)
+        digest = views._pix_code_digest('00020126desconhecido')
+        unknown_url = reverse('order_pix_qr_image', args=[order.id, digest])
+        with override_settings(MEDIA_ROOT=media_root):
+            self.assertEqual(self.client.get(new_qr_url).status_code, 200)
+            self.assertEqual(self.client.get(qr_url).status_code, 200)
+            self.assertEqual(
+                self.client.get(unknown_url, {'sig': views._pix_qr_signature(order.id, digest)}).status_code,
+                404,
+            )
 
     def test_manage_sales_create_order_requires_variant_when_product_has_variants(self):
         self.client.login(username='admin', password='senha-segura')
@@ -358,7 +1166,6 @@ class StoreFlowTests(TestCase):
             whatsapp='16999998888',
             payment_method=Order.PAYMENT_CARD,
             total=Decimal('20.00'),
-            pix_code='',
             items_json=[{'id': self.product.id, 'name': self.product.name, 'price': '20.00', 'quantity': 1, 'subtotal': '20.00'}],
             mp_status='pending',
         )
@@ -379,7 +1186,6 @@ class StoreFlowTests(TestCase):
             whatsapp='16999997777',
             payment_method=Order.PAYMENT_PIX,
             total=Decimal('15.00'),
-            pix_code='',
             items_json=[{'id': self.product.id, 'name': self.product.name, 'price': '15.00', 'quantity': 1, 'subtotal': '15.00'}],
             mp_status='pending',
         )
@@ -403,7 +1209,6 @@ class StoreFlowTests(TestCase):
             whatsapp='16999997777',
             payment_method=Order.PAYMENT_PIX,
             total=Decimal('30.00'),
-            pix_code='',
             items_json=[{'id': self.product.id, 'name': self.product.name, 'price': '10.00', 'quantity': 5, 'subtotal': '50.00'}],
             mp_status='pending',
         )
@@ -428,7 +1233,6 @@ class StoreFlowTests(TestCase):
             whatsapp='16999997777',
             payment_method=Order.PAYMENT_PIX,
             total=Decimal('30.00'),
-            pix_code='',
             items_json=[{'id': self.product.id, 'name': self.product.name, 'price': '10.00', 'quantity': 5, 'delivered_quantity': 3, 'subtotal': '50.00'}],
             mp_status='pending',
         )
@@ -449,7 +1253,6 @@ class StoreFlowTests(TestCase):
             whatsapp='16999997777',
             payment_method=Order.PAYMENT_PIX,
             total=Decimal('15.00'),
-            pix_code='',
             items_json=[{'id': self.product.id, 'name': self.product.name, 'price': '15.00', 'quantity': 1, 'subtotal': '15.00'}],
             mp_status='pending',
         )
@@ -470,7 +1273,6 @@ class StoreFlowTests(TestCase):
             whatsapp='16999996666',
             payment_method=Order.PAYMENT_CASH,
             total=Decimal('12.00'),
-            pix_code='',
             items_json=[{'id': self.product.id, 'name': self.product.name, 'price': '12.00', 'quantity': 1, 'subtotal': '12.00'}],
             mp_status='pending',
             is_delivered=False,
@@ -496,14 +1298,184 @@ class StoreFlowTests(TestCase):
         self.assertEqual(order.items_json[0]['delivered_quantity'], 1)
 
     @patch('shop.views._wapi_send_text')
-    def test_manage_order_notify_ready_page_sends_whatsapp(self, send_text_mock):
+    def test_mark_paid_queues_whatsapp_for_the_worker(self, send_text_mock):
+        WhatsAppRecipient.objects.create(name='Equipe', phone='16988887777')
+        order = _create_pix_order(whatsapp='16999995555')
+
+        self.client.login(username='admin', password='senha-segura')
+        self.client.post(reverse('manage_order_mark_paid_page', args=[order.id]))
+
+        send_text_mock.assert_not_called()
+        self.assertEqual(
+            list(WhatsAppOutbox.objects.values_list('phone', 'status')),
+            [('5516988887777', 'pending'), ('5516999995555', 'pending')],
+        )
+
+        def send_text(phone, message):
+            if phone == '5516988887777':
+                raise ValueError('Erro W-API HTTP 500')
+
+        send_text_mock.side_effect = send_text
+        output = io.StringIO()
+        # Intervalo de 0.2s: a ordem das chamadas segue a ordem das reservas.
+        with patch('shop.views._wapi_rate_limiter', return_value=TokenBucket('W-API', interval=0.2)):
+            call_command('whatsapp_worker', '--once', stdout=output)
+
+        # O comprador sai primeiro, mesmo com o id (e o telefone) depois do da equipe.
+        self.assertEqual([call.args[0] for call in send_text_mock.call_args_list], ['5516999995555', '5516988887777'])
+        self.assertIn('2 mensagens (2 entregas), 1 enviadas, 1 falhas', output.getvalue())
+        failed = WhatsAppOutbox.objects.get(status=WhatsAppOutbox.STATUS_FAILED)
+        self.assertEqual((failed.phone, failed.attempts, failed.last_error), ('5516988887777', 1, 'Erro W-API HTTP 500'))
+        self.assertGreater(failed.next_attempt_at, timezone.now())
+        self.assertFalse(WhatsAppOutbox.objects.filter(send_ms__isnull=True).exists())
+        self.assertEqual(views._whatsapp_latency_stats()['samples'], 2)
+
+    @patch('shop.views._wapi_send_text')
+    def test_whatsapp_fan_out_sends_to_different_phones_concurrently(self, send_text_mock):
+        orders = [_create_pix_order(whatsapp=f'1699999000{index}', last_name=str(index)) for index in range(2)]
+        for order in orders:
+            views._queue_whatsapp_notifications_for_order(order)
+        # So passa se as duas chamadas estiverem em andamento ao mesmo tempo.
+        barrier = threading.Barrier(2, timeout=5)
+        send_text_mock.side_effect = lambda phone, message: barrier.wait()
+
+        with (
+            patch.dict(os.environ, {'WAPI_FANOUT_WORKERS': '2'}),
+            patch('shop.views._wapi_rate_limiter', return_value=TokenBucket('W-API')),
+        ):
+            stats = views._drain_whatsapp_outbox()
+
+        self.assertEqual((stats['sent'], stats['failed']), (2, 0))
+
+    @patch('shop.views._wapi_send_text')
+    def test_whatsapp_drain_only_claims_what_the_limiter_releases_in_time(self, send_text_mock):
+        orders = [_create_pix_order(whatsapp=f'1699999000{index}', last_name=str(index)) for index in range(4)]
+        for order in orders:
+            views._queue_whatsapp_notifications_for_order(order)
+        # Uma vaga a cada 100s: na metade da trava (150s) cabem 2 envios.
+        limiter = TokenBucket('W-API', interval=100.0)
+
+        with (
+            patch('shop.views._wapi_rate_limiter', return_value=limiter),
+            patch('shop.views.time.sleep') as sleep_mock,
+        ):
+            stats = views._drain_whatsapp_outbox()
+
+        self.assertEqual((stats['messages'], stats['sent']), (2, 2))
+        self.assertEqual(WhatsAppOutbox.objects.filter(status=WhatsAppOutbox.STATUS_PENDING).count(), 2)
+        # A espera roda na thread do drain, antes de entregar o envio ao pool.
+        self.assertEqual(sleep_mock.call_count, 1)
+        self.assertFalse(WhatsAppOutbox.objects.filter(status=WhatsAppOutbox.STATUS_SENDING).exists())
+
+    @patch('shop.views._wapi_send_text')
+    def test_whatsapp_drain_skips_messages_taken_over_while_waiting(self, send_text_mock):
+        order = _create_pix_order()
+        views._queue_whatsapp_notifications_for_order(order)
+        limiter = TokenBucket('W-API')
+
+        def reserve():
+            # Outra passada retoma a mensagem enquanto esta esperava a vez.
+            WhatsAppOutbox.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+            return 0.0
+
+        with (
+            patch('shop.views._wapi_rate_limiter', return_value=limiter),
+            patch.object(limiter, 'reserve', side_effect=reserve),
+        ):
+            stats = views._drain_whatsapp_outbox()
+
+        send_text_mock.assert_not_called()
+        self.assertEqual(stats['messages'], 0)
+
+    def test_inline_whatsapp_drain_runs_once_per_process(self):
+        release = threading.Event()
+        passes = []
+
+        def drain():
+            passes.append(1)
+            release.wait(5)
+            return {'messages': 0}
+
+        with patch('shop.views._drain_whatsapp_outbox', side_effect=drain):
+            self.assertTrue(views._start_whatsapp_drain())
+            while not passes:
+                time.sleep(0.01)
+            # Em andamento: so pede mais uma passada, sem abrir outra thread.
+            self.assertFalse(views._start_whatsapp_drain())
+            self.assertFalse(views._start_whatsapp_drain())
+            release.set()
+            deadline = time.monotonic() + 5
+            while views._whatsapp_drain_state['running'] and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+        self.assertFalse(views._whatsapp_drain_state['running'])
+        self.assertEqual(len(passes), 2)
+
+    @patch('shop.views._wapi_send_text')
+    def test_digest_recipients_get_one_message_per_window(self, send_text_mock):
+        WhatsAppRecipient.objects.create(name='Equipe', phone='16988887777', digest=True)
+        orders = [_create_pix_order(whatsapp=f'1699999000{index}', last_name=str(index)) for index in range(3)]
+        for order in orders:
+            order.is_paid = True
+            views._queue_whatsapp_notifications_for_order(order)
+
+        limiter = TokenBucket('W-API')
+        with patch('shop.views._wapi_rate_limiter', return_value=limiter):
+            stats = views._drain_whatsapp_outbox()
+            # Compradores na hora; o resumo espera a janela fechar.
+            self.assertEqual(stats['messages'], 3)
+            self.assertTrue(all(call.args[0].startswith('55169999900') for call in send_text_mock.call_args_list))
+
+            WhatsAppOutbox.objects.filter(kind=WhatsAppOutbox.KIND_DIGEST).update(next_attempt_at=timezone.now())
+            stats = views._drain_whatsapp_outbox()
+
+        self.assertEqual((stats['messages'], stats['deliveries'], stats['sent']), (1, 3, 3))
+        phone, text = send_text_mock.call_args.args
+        self.assertEqual(phone, '5516988887777')
+        self.assertIn('3 pedido(s)', text)
+        for order in orders:
+            self.assertIn(f'#{order.id} Ana {order.last_name}', text)
+        self.assertEqual(limiter.snapshot()['acquired'], 4)
+
+    @patch('shop.views._wapi_send_text')
+    def test_whatsapp_failures_back_off_then_dead_letter_and_retry(self, send_text_mock):
+        send_text_mock.side_effect = ValueError('Erro W-API HTTP 503')
+        order = _create_pix_order()
+        delivery = WhatsAppOutbox.objects.create(order=order, kind=WhatsAppOutbox.KIND_PAID, phone='55169', message='Oi')
+        self.assertEqual(
+            [views._whatsapp_retry_delay(attempts) for attempts in (1, 2, 3, 9)],
+            [30, 60, 120, views.WHATSAPP_BACKOFF_MAX_SECONDS],
+        )
+
+        with patch('shop.views._wapi_rate_limiter', return_value=TokenBucket('W-API')):
+            for _ in range(views.WHATSAPP_MAX_ATTEMPTS):
+                views._drain_whatsapp_outbox()
+                # Ainda agendada para depois: a passada seguinte nao a pega.
+                self.assertEqual(views._drain_whatsapp_outbox()['messages'], 0)
+                WhatsAppOutbox.objects.filter(id=delivery.id).update(next_attempt_at=timezone.now())
+
+        delivery.refresh_from_db()
+        self.assertEqual(delivery.status, WhatsAppOutbox.STATUS_DEAD)
+        self.assertEqual(send_text_mock.call_count, views.WHATSAPP_MAX_ATTEMPTS)
+
+        self.client.login(username='admin', password='senha-segura')
+        response = self.client.post(reverse('manage_whatsapp_retry_failed_page'))
+        self.assertEqual(response.status_code, 302)
+        delivery.refresh_from_db()
+        self.assertEqual((delivery.status, delivery.attempts), (WhatsAppOutbox.STATUS_PENDING, 0))
+        self.assertContains(
+            self.client.get(reverse('manage_products_page')),
+            'Pendentes 1',
+        )
+
+    @patch('shop.views._wapi_send_text')
+    def test_manage_order_notify_ready_page_queues_whatsapp(self, send_text_mock):
         order = Order.objects.create(
             first_name='Cliente',
             last_name='Pronto',
             whatsapp='16999995555',
             payment_method=Order.PAYMENT_CASH,
             total=Decimal('25.00'),
-            pix_code='',
             items_json=[{'id': self.product.id, 'name': self.product.name, 'price': '25.00', 'quantity': 1, 'subtotal': '25.00'}],
             mp_status='pending',
         )
@@ -512,7 +1484,609 @@ class StoreFlowTests(TestCase):
         response = self.client.post(reverse('manage_order_notify_ready_page', args=[order.id]))
 
         self.assertEqual(response.status_code, 302)
-        send_text_mock.assert_called_once()
-        args, _ = send_text_mock.call_args
-        self.assertEqual(args[0], '5516999995555')
-        self.assertIn(f'#{order.id}', args[1])
+        send_text_mock.assert_not_called()
+        delivery = WhatsAppOutbox.objects.get(order=order, kind=WhatsAppOutbox.KIND_READY)
+        self.assertEqual((delivery.phone, delivery.status), ('5516999995555', WhatsAppOutbox.STATUS_PENDING))
+        self.assertIn(f'#{order.id}', delivery.message)
+
+        with patch('shop.views._wapi_rate_limiter', return_value=TokenBucket('W-API')):
+            views._drain_whatsapp_outbox()
+        send_text_mock.assert_called_once_with('5516999995555', delivery.message)
+
+        # Avisar de novo reabre a mesma entrega.
+        self.client.post(reverse('manage_order_notify_ready_page', args=[order.id]))
+        delivery.refresh_from_db()
+        self.assertEqual((delivery.status, delivery.sent_at), (WhatsAppOutbox.STATUS_PENDING, None))
+        self.assertEqual(WhatsAppOutbox.objects.filter(order=order).count(), 1)
+
+        # Clique repetido durante o envio nao devolve a entrega para a fila.
+        locked_at = timezone.now()
+        WhatsAppOutbox.objects.filter(pk=delivery.pk).update(
+            status=WhatsAppOutbox.STATUS_SENDING, attempts=1, locked_at=locked_at
+        )
+        self.client.post(reverse('manage_order_notify_ready_page', args=[order.id]))
+        delivery.refresh_from_db()
+        self.assertEqual(
+            (delivery.status, delivery.attempts, delivery.locked_at),
+            (WhatsAppOutbox.STATUS_SENDING, 1, locked_at),
+        )
+        self.assertEqual(WhatsAppOutbox.objects.filter(order=order).count(), 1)
+
+    @patch('shop.views._wapi_send_text')
+    def test_bulk_notify_ready_queues_selected_orders_and_reports_progress(self, send_text_mock):
+        orders = [_create_pix_order(whatsapp=f'1699999000{index}', last_name=str(index)) for index in range(3)]
+        no_phone = _create_pix_order(whatsapp='')
+
+        self.client.login(username='admin', password='senha-segura')
+        response = self.client.post(
+            reverse('manage_orders_notify_ready_bulk_page'),
+            {'order_ids': [order.id for order in orders] + [no_phone.id]},
+        )
+
+        self.assertEqual(response.status_code, 302)
+        send_text_mock.assert_not_called()
+        self.assertEqual(WhatsAppOutbox.objects.filter(kind=WhatsAppOutbox.KIND_READY).count(), 3)
+        progress = self.client.get(reverse('manage_orders_notify_ready_status')).json()
+        self.assertEqual(
+            (progress['total'], progress['sent'], progress['pending'], progress['skipped'], progress['done']),
+            (3, 0, 3, [no_phone.id], False),
+        )
+
+        def send_text(phone, message):
+            if phone == '5516999990001':
+                raise ValueError('Erro W-API HTTP 500')
+
+        send_text_mock.side_effect = send_text
+        with patch('shop.views._wapi_rate_limiter', return_value=TokenBucket('W-API')):
+            views._drain_whatsapp_outbox()
+
+        progress = self.client.get(reverse('manage_orders_notify_ready_status')).json()
+        self.assertEqual((progress['sent'], progress['failed'], progress['pending'], progress['done']), (2, 1, 0, True))
+        self.assertEqual(
+            progress['failures'],
+            [{'order_id': orders[1].id, 'error': 'Erro W-API HTTP 500', 'retrying': True}],
+        )
+        page = self.client.get(reverse('manage_products_page'))
+        self.assertContains(page, '2 de 3 enviados')
+        self.assertContains(page, f'Pedido #{no_phone.id}: sem WhatsApp valido')
+
+class _StubApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        self.server.received.append(
+            {
+                'method': self.command,
+                'path': self.path,
+                'headers': dict(self.headers),
+                'body': json.loads(body) if body else None,
+                'connection': id(self.connection),
+            }
+        )
+        status, payload = self.server.responses.pop(0) if self.server.responses else (200, {})
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = _reply
+    do_POST = _reply
+
+    def log_message(self, format, *args):
+        return
+
+
+class OutboundHttpClientTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _StubApiHandler)
+        self.server.received = []
+        self.server.responses = []
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        sleep_patcher = patch('shop.http_client.time.sleep')
+        self.sleep_mock = sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+    def tearDown(self):
+        close_http_clients()
+        views._mp_circuit_breaker().reset()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_client_reuses_keep_alive_connection(self):
+        client = HttpClient(self.base_url)
+
+        client.request('GET', '/v1/payments/1')
+        client.request('GET', '/v1/payments/2')
+
+        self.assertEqual(client.stats['connections_opened'], 1)
+        self.assertEqual(client.stats['connections_reused'], 1)
+        self.assertEqual(len({item['connection'] for item in self.server.received}), 1)
+        client.close()
+
+    def test_client_retries_idempotent_requests_with_backoff(self):
+        self.server.responses = [(503, {}), (502, {}), (200, {'id': 1})]
+        client = HttpClient(self.base_url, max_retries=2)
+
+        response = client.request('GET', '/v1/payments/1')
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(client.stats['retries'], 2)
+        self.assertEqual(self.sleep_mock.call_count, 2)
+        client.close()
+
+    def test_client_does_not_retry_post_without_idempotency_key(self):
+        self.server.responses = [(503, {}), (200, {})]
+        client = HttpClient(self.base_url, max_retries=2)
+
+        response = client.request('POST', '/v1/message/send-text', json_body={'phone': '1'})
+
+        self.assertEqual(response.status, 503)
+        self.assertEqual(len(self.server.received), 1)
+        client.close()
+
+    def test_mp_payment_retry_reuses_deterministic_idempotency_key(self):
+        order = Order.objects.create(
+            first_name='Maria',
+            last_name='Souza',
+            whatsapp='16999999999',
+            payment_method=Order.PAYMENT_PIX,
+            total=Decimal('20.00'),
+            items_json=[],
+            mp_status='pending',
+        )
+        payment = {
+            'id': 987,
+            'status': 'pending',
+            'status_detail': 'pending_waiting_transfer',
+            'point_of_interaction': {'transaction_data': {'qr_code': 'pix-code', 'qr_code_base64': 'qr'}},
+        }
+        self.server.responses = [(500, {'message': 'instavel'}), (201, payment), (201, payment)]
+
+        with patch.dict(os.environ, {'MP_API_BASE_URL': self.base_url, 'MP_ACCESS_TOKEN_PROD': 'token-teste'}):
+            pix_payload = views._create_mp_pix_payment(order)
+            views._create_mp_pix_payment(order)
+
+        self.assertEqual(pix_payload['payment_id'], '987')
+        keys = {item['headers']['X-Idempotency-Key'] for item in self.server.received}
+        self.assertEqual(len(self.server.received), 3)
+        self.assertEqual(keys, {views._mp_payment_idempotency_key(order)})
+
+    def test_mp_api_request_turns_connection_failure_into_value_error(self):
+        self.server.responses = [(503, {})] * 3
+
+        with patch.dict(os.environ, {'MP_API_BASE_URL': self.base_url, 'MP_ACCESS_TOKEN_PROD': 'token-teste'}):
+            with self.assertRaises(ValueError):
+                views._get_mp_payment('123')
+
+        self.assertEqual(len(self.server.received), 3)
+
+    def test_wapi_send_text_uses_shared_client(self):
+        env = {'WAPI_API_BASE_URL': self.base_url, 'WAPI_INSTANCE_ID': 'inst', 'WAPI_TOKEN': 'tok'}
+        with patch.dict(os.environ, env):
+            views._wapi_send_text('5516999999999', 'Ola')
+            views._wapi_send_text('5516988888888', 'Ola')
+
+        self.assertEqual(self.server.received[0]['path'], '/v1/message/send-text?instanceId=inst')
+        self.assertEqual(self.server.received[0]['body'], {'phone': '5516999999999', 'message': 'Ola'})
+        self.assertEqual(len({item['connection'] for item in self.server.received}), 1)
+
+
+    async def test_async_client_reuses_connection_and_retries(self):
+        self.server.responses = [(200, {'id': 1}), (503, {}), (200, {'id': 2})]
+        client = AsyncHttpClient(self.base_url, max_retries=1, backoff_base=0)
+
+        first = await client.request('GET', '/v1/payments/1')
+        second = await client.request('GET', '/v1/payments/2')
+
+        self.assertEqual(first.json(), {'id': 1})
+        self.assertEqual(second.json(), {'id': 2})
+        self.assertEqual(client.stats['retries'], 1)
+        self.assertEqual(client.stats['connections_opened'], 1)
+        self.assertEqual(len({item['connection'] for item in self.server.received}), 1)
+        await client.aclose()
+
+    async def test_async_mp_requests_overlap_on_one_event_loop(self):
+        self.server.responses = [(200, {'id': index, 'status': 'pending'}) for index in range(20)]
+
+        with patch.dict(os.environ, {'MP_API_BASE_URL': self.base_url, 'MP_ACCESS_TOKEN_PROD': 'token-teste'}):
+            payments = await asyncio.gather(*(views._aget_mp_payment(str(index)) for index in range(20)))
+
+        self.assertEqual(len(payments), 20)
+        self.assertEqual(len(self.server.received), 20)
+        self.assertEqual(self.server.received[0]['headers']['Authorization'], 'Bearer token-teste')
+
+
+def _reload_shop_urls():
+    # include() guarda os resolvers ja montados: recarrega tambem o ROOT_URLCONF.
+    importlib.reload(shop_urls)
+    importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+    clear_url_caches()
+
+
+@override_settings(SHOP_ASYNC_VIEWS=True)
+class AsyncPaymentViewsTests(ShopTestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Registrado antes do override_settings: roda depois que ele e desfeito.
+        cls.addClassCleanup(_reload_shop_urls)
+        super().setUpClass()
+        _reload_shop_urls()
+
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.create(name='Pastel', price=Decimal('10.00'), active=True)
+        self.order = _create_pix_order('777')
+        status_cache = views._mp_status_cache()
+        status_cache.clear()
+        order_cache().delete(views._mp_payment_cache_key('777'))
+        self.addCleanup(status_cache.clear)
+        self.addCleanup(order_cache().delete, views._mp_payment_cache_key('777'))
+
+    def test_urls_point_to_async_views(self):
+        self.assertTrue(asyncio.iscoroutinefunction(resolve(reverse('checkout_status', args=[1])).func))
+        self.assertTrue(asyncio.iscoroutinefunction(resolve(reverse('payments_webhook')).func))
+
+    @patch('shop.views._queue_whatsapp_notifications_for_order')
+    @patch('shop.views._aget_mp_payment')
+    async def test_checkout_status_async_syncs_order_from_mp(self, get_payment_mock, notify_mock):
+        get_payment_mock.return_value = {'id': '777', 'status': 'approved', 'status_detail': 'accredited'}
+
+        response = await self.async_client.get(reverse('checkout_status', args=[self.order.id]))
+
+        self.assertTrue(response.json()['is_paid'])
+        order = await Order.objects.aget(id=self.order.id)
+        self.assertTrue(order.is_paid)
+        self.assertEqual(get_payment_mock.await_count, 1)
+        notify_mock.assert_called_once()
+
+    @patch('shop.views._aget_mp_payment')
+    async def test_payments_webhook_async_only_queues_the_event(self, get_payment_mock):
+        for _ in range(2):
+            response = await self.async_client.post(
+                reverse('payments_webhook'),
+                data=json.dumps({'data': {'id': '777'}}),
+                content_type='application/json',
+                headers={'x-request-id': 'req-777'},
+            )
+        self.assertEqual(response.json(), {'ok': True, 'queued': False})
+        self.assertEqual(await PaymentWebhookEvent.objects.filter(payment_id='777').acount(), 1)
+        get_payment_mock.assert_not_called()
+
+    @patch('shop.views._acreate_mp_pix_payment')
+    async def test_checkout_finalize_async_creates_pix_with_async_client(self, create_pix_mock):
+        create_pix_mock.return_value = {
+            'payment_id': '888',
+            'external_reference': 'ORDER_2',
+            'status': 'pending',
+            'status_detail': 'pending_waiting_transfer',
+            'pix_code': 'pix-async',
+        }
+        await self.async_client.post(reverse('cart_add', args=[self.product.id]), {'quantity': 2})
+
+        response = await self.async_client.post(
+            reverse('checkout_finalize'),
+            {'first_name': 'Maria', 'last_name': 'Souza', 'whatsapp': '16999999999', 'payment_method': 'pix'},
+        )
+
+        payload = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(payload['pix_code'], 'pix-async')
+        order = await Order.objects.select_related('current_payment').aget(id=payload['order_id'])
+        self.assertEqual(order.current_payment.payment_id, '888')
+        self.assertEqual(order.total, Decimal('20.00'))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN do SQLite')
+class OrderQueryPlanTests(ShopTestCase):
+    # Roda as consultas reais das views e falha se o SQLite varrer shop_order
+    # sem indice.
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='admin', password='senha-segura')
+        self.client.force_login(self.user)
+        for index in range(6):
+            _create_pix_order(f'70{index}', last_name=str(index), is_paid=index % 2 == 0, is_delivered=index % 3 == 0)
+
+    def _order_query_plans(self, func):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        plans = []
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if '"shop_order"' not in sql or not sql.startswith(('SELECT', 'UPDATE', 'DELETE')):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plans.append((sql, [row[-1] for row in cursor.fetchall()]))
+        return plans
+
+    def assertIndexedOrderQueries(self, func, *index_names):
+        plans = self._order_query_plans(func)
+        self.assertTrue(plans)
+        for sql, plan in plans:
+            for detail in plan:
+                self.assertFalse(
+                    re.fullmatch(r'SCAN (TABLE )?shop_order', detail),
+                    f'Varredura completa de shop_order:\n{sql}\n{plan}',
+                )
+        used = ' '.join(detail for _, plan in plans for detail in plan)
+        for index_name in index_names:
+            self.assertIn(f'INDEX {index_name}', used)
+
+    def test_order_lists_and_reports_use_indexes(self):
+        self.assertIndexedOrderQueries(
+            lambda: self.client.get(reverse('manage_products_page')),
+            'order_created_idx',
+        )
+        self.assertIndexedOrderQueries(
+            lambda: self.client.get(reverse('manage_reports_page')),
+            'order_created_idx',
+            'order_paid_idx',
+            'order_payment_total_idx',
+            # Grafico de status (pago x entregue) e contagem de pagos.
+            'order_status_idx',
+        )
+
+    def test_bulk_marks_use_partial_indexes(self):
+        self.assertIndexedOrderQueries(
+            lambda: self.client.post(
+                reverse('manage_orders_mark_all_paid_page'),
+                {'bulk_paid_password': views._bulk_mark_paid_password()},
+            ),
+            'order_unpaid_idx',
+        )
+        self.assertIndexedOrderQueries(
+            lambda: self.client.post(
+                reverse('manage_orders_mark_all_delivered_page'),
+                {'bulk_delivered_password': views._bulk_mark_delivered_password()},
+            ),
+            'order_undelivered_idx',
+        )
+
+    @patch('shop.management.commands.reconcile_payments._search_mp_payments')
+    @patch('shop.views._get_mp_payment')
+    def test_payment_lookups_use_indexes(self, get_payment_mock, search_mock):
+        get_payment_mock.return_value = {'id': '701', 'status': 'pending', 'status_detail': 'pending_waiting_transfer'}
+        search_mock.return_value = {'paging': {'total': 0}, 'results': []}
+        self.addCleanup(order_cache().delete, views._mp_payment_cache_key('701'))
+
+        self.assertIndexedOrderQueries(lambda: views._process_webhook_payment('701'), 'attempt_payment_idx')
+        self.assertIndexedOrderQueries(
+            lambda: call_command('reconcile_payments', '--once', stdout=io.StringIO()),
+            'order_unpaid_idx',
+        )
+
+    def test_checkout_key_lookup_uses_unique_index(self):
+        self.assertIndexedOrderQueries(
+            lambda: views._checkout_order_by_key('k' * 64),
+            'unique_order_checkout_key',
+        )
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_breaker_opens_fails_fast_and_closes_after_probe(self):
+        breaker = CircuitBreaker('MP', failure_threshold=2, reset_timeout=30, open_message='indisponivel')
+
+        with patch('shop.circuit_breaker.time.monotonic', return_value=100.0):
+            breaker.before_call()
+            breaker.record_failure('HTTP 500')
+            breaker.before_call()
+            breaker.record_failure('HTTP 502')
+            self.assertEqual(breaker.snapshot()['state'], 'open')
+            with self.assertRaises(CircuitOpenError):
+                breaker.before_call()
+
+        with patch('shop.circuit_breaker.time.monotonic', return_value=131.0):
+            self.assertTrue(breaker.is_available())
+            breaker.before_call()
+            with self.assertRaises(CircuitOpenError):
+                breaker.before_call()
+            breaker.record_success(0.2)
+
+        self.assertEqual(breaker.snapshot()['state'], 'closed')
+        self.assertEqual(breaker.snapshot()['rejected'], 2)
+
+    def test_slow_calls_count_as_failures_and_failed_probe_reopens(self):
+        breaker = CircuitBreaker('MP', failure_threshold=2, slow_call_seconds=5, reset_timeout=10)
+
+        with patch('shop.circuit_breaker.time.monotonic', return_value=50.0):
+            breaker.record_success(6.0)
+            breaker.record_success(7.5)
+            self.assertEqual(breaker.snapshot()['state'], 'open')
+            self.assertEqual(breaker.snapshot()['slow_calls'], 2)
+
+        with patch('shop.circuit_breaker.time.monotonic', return_value=61.0):
+            breaker.before_call()
+            breaker.record_failure('timeout')
+            self.assertEqual(breaker.snapshot()['state'], 'open')
+
+
+class AdmissionControllerTests(SimpleTestCase):
+    def test_rejects_over_the_limit_with_retry_after(self):
+        controller = AdmissionController('Checkout', max_limit=1, target_latency=2.0)
+        self.assertTrue(controller.try_acquire().admitted)
+
+        rejected = controller.try_acquire()
+        self.assertFalse(rejected.admitted)
+        self.assertEqual(rejected.retry_after, 2)
+
+        controller.release(hold_seconds=0.5)
+        self.assertTrue(controller.try_acquire().admitted)
+        self.assertEqual(controller.try_acquire().retry_after, 1)
+        self.assertEqual(controller.snapshot()['rejected'], 2)
+
+    def test_limit_follows_latency(self):
+        controller = AdmissionController('Checkout', max_limit=8, min_limit=2, target_latency=1.0)
+        for _ in range(10):
+            controller.observe_latency(5.0)
+        self.assertEqual(controller.snapshot()['limit'], 2)
+
+        for _ in range(60):
+            controller.observe_latency(0.1)
+        self.assertEqual(controller.snapshot()['limit'], 8)
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_reservations_are_spaced_by_interval(self):
+        with patch('shop.rate_limit.time.monotonic', return_value=100.0):
+            bucket = TokenBucket('W-API', interval=3.0, burst=2)
+            self.assertEqual([bucket.reserve() for _ in range(4)], [0.0, 0.0, 3.0, 6.0])
+        with patch('shop.rate_limit.time.monotonic', return_value=112.0):
+            # 12s depois: as duas reservas pagas e o balde cheio de novo.
+            self.assertEqual(bucket.reserve(), 0.0)
+            self.assertEqual(bucket.snapshot()['waited'], 2)
+
+    def test_capacity_counts_slots_left_in_a_window(self):
+        with patch('shop.rate_limit.time.monotonic', return_value=100.0):
+            bucket = TokenBucket('W-API', interval=10.0, burst=2)
+            self.assertEqual(bucket.capacity(30), 5)
+            bucket.reserve()
+            bucket.reserve()
+            bucket.reserve()
+            self.assertEqual(bucket.capacity(30), 2)
+        self.assertIsNone(TokenBucket('W-API').capacity(30))
+
+
+class AuditLogBufferTests(ShopTestCase):
+    def test_batch_is_flushed_by_background_thread_and_rest_on_close(self):
+        written = []
+        flushed = threading.Event()
+
+        class Row:
+            class objects:
+                @staticmethod
+                def bulk_create(batch):
+                    written.append(len(batch))
+                    flushed.set()
+
+        buffer = AuditLogBuffer('teste', max_rows=10, batch_size=2, flush_interval=60)
+        buffer.add(Row())
+        buffer.add(Row())
+        # Lote cheio acorda a thread sem esperar o intervalo.
+        self.assertTrue(flushed.wait(5))
+        self.assertEqual(written, [2])
+
+        buffer.add(Row())
+        self.assertEqual(buffer.close(), 1)
+        self.assertEqual(written, [2, 1])
+        self.assertFalse(buffer.add(Row()))
+        snapshot = buffer.snapshot()
+        self.assertEqual((snapshot['written'], snapshot['flushes'], snapshot['dropped']), (3, 2, 1))
+
+    def test_full_buffer_drops_rows_instead_of_blocking(self):
+        with patch.object(AuditLogBuffer, '_ensure_thread'):
+            buffer = AuditLogBuffer('teste', max_rows=2, batch_size=2)
+            self.assertEqual([buffer.add(object()) for _ in range(3)], [True, True, False])
+        snapshot = buffer.snapshot()
+        self.assertEqual((snapshot['buffered'], snapshot['dropped']), (2, 1))
+
+    def test_middleware_buffers_audit_rows_until_flush(self):
+        with patch.object(AuditLogBuffer, '_ensure_thread'):
+            buffer = AuditLogBuffer('audit', flush_interval=60)
+            with (
+                override_settings(SHOP_AUDIT_LOG_BUFFER=True),
+                patch('shop.middleware.audit_log_buffer', return_value=buffer),
+            ):
+                self.client.get(reverse('home'))
+
+        self.assertFalse(AuditLog.objects.filter(path='/').exists())
+        self.assertEqual(buffer.snapshot()['buffered'], 1)
+        flushed_at = timezone.now()
+        self.assertEqual(buffer.flush(), 1)
+        entry = AuditLog.objects.get(path='/')
+        self.assertEqual((entry.method, entry.status_code), ('GET', 200))
+        # Hora da requisicao, nao da gravacao do lote.
+        self.assertLess(entry.created_at, flushed_at)
+
+
+class SingleFlightCacheTests(SimpleTestCase):
+    def test_concurrent_lookups_share_one_call(self):
+        single_flight = SingleFlightCache('status', ttl=60)
+        release = threading.Event()
+        calls = []
+
+        def slow_lookup():
+            calls.append(1)
+            release.wait(5)
+            return {'status': 'pending'}
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(single_flight.get_or_call('123', slow_lookup)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        while single_flight.snapshot()['coalesced'] < 4:
+            threading.Event().wait(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'status': 'pending'}] * 5)
+        self.assertEqual(single_flight.get_or_call('123', slow_lookup), {'status': 'pending'})
+        self.assertEqual(len(calls), 1)
+
+    def test_errors_are_cached_until_ttl_expires(self):
+        single_flight = SingleFlightCache('status', ttl=5)
+        calls = []
+
+        def failing_lookup():
+            calls.append(1)
+            raise ValueError('HTTP 500')
+
+        with patch('shop.single_flight.time.monotonic', return_value=10.0):
+            for _ in range(2):
+                with self.assertRaises(ValueError):
+                    single_flight.get_or_call('123', failing_lookup)
+        self.assertEqual(len(calls), 1)
+
+        with patch('shop.single_flight.time.monotonic', return_value=16.0):
+            with self.assertRaises(ValueError):
+                single_flight.get_or_call('123', failing_lookup)
+        self.assertEqual(len(calls), 2)
+
+
+class PixBrCodeTests(SimpleTestCase):
+    def test_crc16_matches_bacen_example(self):
+        payload = build_pix_brcode(
+            key='123e4567-e12b-12d1-a456-426655440000',
+            merchant_name='Fulano de Tal',
+            merchant_city='BRASILIA',
+        )
+
+        self.assertEqual(
+            payload,
+            '00020126580014br.gov.bcb.pix0136123e4567-e12b-12d1-a456-426655440000'
+            '5204000053039865802BR5913Fulano de Tal6008BRASILIA62070503***63041D3D',
+        )
+
+    def test_brcode_with_amount_reference_and_dynamic_location(self):
+        payload = build_pix_brcode(
+            key='16999999999',
+            amount=Decimal('12.5'),
+            reference='PEDIDO-42',
+            merchant_name='Missão Andrews da Igreja Adventista',
+            merchant_city='São Carlos',
+        )
+
+        self.assertIn('540512.50', payload)
+        self.assertIn('5925Missao Andrews da Igreja', payload)
+        self.assertIn('6010Sao Carlos', payload)
+        self.assertIn('62120508PEDIDO42', payload)
+        self.assertEqual(payload[-4:], crc16_ccitt(payload[:-4]))
+
+        dynamic = build_pix_brcode(location='https://pix.example.com/qr/v2/abc', merchant_name='Loja')
+        self.assertIn('010212', dynamic)
+        self.assertIn('2525pix.example.com/qr/v2/abc', dynamic)
+
+    def test_render_qr_png_returns_png_bytes(self):
+        self.assertTrue(render_qr_png(build_pix_brcode(key='chave')).startswith(b'\x89PNG'))
@@ -1,7 +1,14 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
 
+
+def _payment_view(sync_view, async_view):
+    # Sob ASGI (SHOP_ASYNC_VIEWS) as views de pagamento sao async; no WSGI, sync.
+    return async_view if settings.SHOP_ASYNC_VIEWS else sync_view
+
+
 urlpatterns = [
     path('', views.home, name='home'),
     path('auth/login/', views.auth_login, name='auth_login'),
@@ -26,6 +33,8 @@ urlpatterns = [
     path('manage/orders/page/mark-all-delivered/', views.manage_orders_mark_all_delivered_page, name='manage_orders_mark_all_delivered_page'),
     path('manage/orders/page/mark-paid/<int:order_id>/', views.manage_order_mark_paid_page, name='manage_order_mark_paid_page'),
     path('manage/orders/page/notify-ready/<int:order_id>/', views.manage_order_notify_ready_page, name='manage_order_notify_ready_page'),
+    path('manage/orders/page/notify-ready-bulk/', views.manage_orders_notify_ready_bulk_page, name='manage_orders_notify_ready_bulk_page'),
+    path('manage/orders/notify-ready/status/', views.manage_orders_notify_ready_status, name='manage_orders_notify_ready_status'),
     path('manage/orders/page/manual-create/', views.manage_order_manual_create_page, name='manage_order_manual_create_page'),
     path('manage/orders/page/delete/<int:order_id>/', views.manage_order_delete_page, name='manage_order_delete_page'),
     path('manage/users/page/create/', views.manage_users_create_page, name='manage_users_create_page'),
@@ -35,13 +44,19 @@ urlpatterns = [
     path('manage/donations/page/delete/<int:donation_id>/', views.manage_donations_delete_page, name='manage_donations_delete_page'),
     path('manage/whatsapp/page/create/', views.manage_whatsapp_recipient_create_page, name='manage_whatsapp_recipient_create_page'),
     path('manage/whatsapp/page/delete/<int:recipient_id>/', views.manage_whatsapp_recipient_delete_page, name='manage_whatsapp_recipient_delete_page'),
+    path('manage/whatsapp/page/retry/', views.manage_whatsapp_retry_failed_page, name='manage_whatsapp_retry_failed_page'),
     path('manage/products/', views.product_manage_list, name='product_manage_list'),
     path('manage/products/save/', views.product_manage_save, name='product_manage_save'),
     path('manage/products/delete/<int:product_id>/', views.product_manage_delete, name='product_manage_delete'),
+    path('cart/state/', views.cart_state, name='cart_state'),
     path('cart/add/<int:product_id>/', views.cart_add, name='cart_add'),
     path('cart/update/<int:product_id>/', views.cart_update, name='cart_update'),
-    path('checkout/finalize/', views.checkout_finalize, name='checkout_finalize'),
-    path('checkout/status/<int:order_id>/', views.checkout_status, name='checkout_status'),
-    path('payments/webhook/', views.payments_webhook, name='payments_webhook'),
+    path('cart/batch/', views.cart_batch, name='cart_batch'),
+    path('checkout/finalize/', _payment_view(views.checkout_finalize, views.checkout_finalize_async), name='checkout_finalize'),
+    path('checkout/status/<int:order_id>/', _payment_view(views.checkout_status, views.checkout_status_async), name='checkout_status'),
+    path('checkout/status/<int:order_id>/stream/', views.order_status_stream, name='order_status_stream'),
+    path('checkout/status/<int:order_id>/wait/', views.order_status_wait, name='order_status_wait'),
+    path('payments/webhook/', _payment_view(views.payments_webhook, views.payments_webhook_async), name='payments_webhook'),
     path('orders/print/<int:order_id>/', views.order_print_public_page, name='order_print_public_page'),
+    path('orders/<int:order_id>/pix-qr/<str:digest>.png', views.order_pix_qr_image, name='order_pix_qr_image'),
 ]
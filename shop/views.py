@@ -3,38 +3,69 @@ import hmac
 import io
 import json
 import os
-import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from decimal import Decimal, InvalidOperation
+from functools import partial
 from urllib.parse import urlencode
-from urllib import error, request as urllib_request
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.models import User
 from django.core import signing
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIRequest
 from django.core.signing import BadSignature, SignatureExpired
-from django.db.models import Avg, Count, Sum
+from django.db import IntegrityError, transaction
+from django.db.models import Avg, Count, F, Min, Sum
 from django.db.models.functions import TruncDate
-from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.middleware.csrf import get_token
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.crypto import constant_time_compare
+from django.views.decorators.cache import cache_control, never_cache
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_GET, require_POST
-
+from django.views.decorators.http import condition, require_GET, require_POST
+
+from .admission import get_admission_controller
+from .background import spawn_async, start_background_thread, submit_background
+from .cart import CART_COOKIE_NAME, CartTooLargeError, get_cart_store
+from .catalog import (
+    catalog_snapshot_stats,
+    get_catalog_snapshot,
+    get_catalog_version,
+    get_price_index,
+    load_price_index,
+)
+from .circuit_breaker import CircuitOpenError, get_circuit_breaker
+from .http_client import HttpClientError, get_async_http_client, get_http_client
+from .middleware import audit_log_buffer
+from .order_events import get_order_status_hub, order_cache, publish_order_status, publish_order_statuses
+from .pix import build_pix_brcode, render_qr_png
+from .rate_limit import get_token_bucket
+from .single_flight import get_single_flight_cache
 from .models import (
     AuditLog,
     CostEntry,
     DonationEntry,
     Order,
+    PaymentAttempt,
+    PaymentWebhookEvent,
     Product,
     ProductVariant,
     ProfitDistributionConfig,
     ProfitDistributionEntry,
     ProfitDistributionPerson,
+    WhatsAppOutbox,
     WhatsAppRecipient,
 )
 
@@ -47,13 +78,85 @@ MANAGE_PRODUCTS_TABS = {
     'secao-usuarios',
 }
 
-
-def _get_cart(session):
-    cart = session.get('cart')
-    if not isinstance(cart, dict):
-        cart = {}
-        session['cart'] = cart
-    return cart
+# Cookies legiveis pelo app.js (shop_cart vem de shop.cart): indicam se vale a
+# pena buscar o estado do carrinho/login, ja que a pagina inicial e servida sem
+# sessao (cacheavel).
+STAFF_COOKIE_NAME = 'shop_staff'
+STOREFRONT_CACHE_SECONDS = 60
+
+CART_BATCH_ACTIONS = {'add', 'inc', 'dec', 'set'}
+CART_BATCH_MAX_OPERATIONS = 100
+
+# Pix criado em segundo plano (MP_PIX_ASYNC): o pedido nasce "creating" e o
+# QR Code chega ao cliente pelo checkout_status.
+PIX_STATUS_CREATING = 'creating'
+PIX_STATUS_FAILED = 'failed'
+# PNG do QR gerado uma vez a partir de PaymentAttempt.pix_code e servido por URL
+# assinada; a URL muda junto com o pix_code, entao pode ficar em cache para sempre.
+PIX_QR_STORAGE_DIR = 'pix_qr'
+PIX_QR_CACHE_SECONDS = 60 * 60 * 24 * 365
+# Colunas que as listas de pedidos (painel, relatorios, PDF) mostram.
+ORDER_LIST_FIELDS = (
+    'id',
+    'first_name',
+    'last_name',
+    'whatsapp',
+    'payment_method',
+    'total',
+    'is_paid',
+    'is_delivered',
+    'created_at',
+)
+# Status do pedido por SSE / long-poll (shop.order_events). Sob WSGI nao ha
+# espera: o navegador reconecta depois de ORDER_STATUS_RETRY_MS.
+ORDER_STATUS_WAIT_SECONDS = 25
+ORDER_STATUS_STREAM_SECONDS = 10 * 60
+ORDER_STATUS_HEARTBEAT_SECONDS = 20
+ORDER_STATUS_RETRY_MS = 5000
+ORDER_STATUS_FINAL = {'approved_manual', 'rejected', 'cancelled', PIX_STATUS_FAILED}
+MP_RECONCILER_HEARTBEAT_KEY = 'shop:mp_reconciler:alive'
+# Inbox do webhook: o MP recebe 200 na hora e o processamento fica para o worker.
+WEBHOOK_DRAIN_BATCH = 100
+WEBHOOK_MAX_ATTEMPTS = 5
+WEBHOOK_LOCK_SECONDS = 5 * 60
+WEBHOOK_BACKOFF_SECONDS = 30
+WEBHOOK_BACKOFF_MAX_SECONDS = 30 * 60
+# Outbox do WhatsApp: a requisicao so grava as mensagens; o whatsapp_worker envia.
+WHATSAPP_DRAIN_BATCH = 50
+WHATSAPP_LOCK_SECONDS = 5 * 60
+# Falha agenda nova tentativa em 30s, 1min, 2min... (ate 1h); na sexta vira "dead".
+WHATSAPP_MAX_ATTEMPTS = 6
+WHATSAPP_BACKOFF_SECONDS = 30
+WHATSAPP_BACKOFF_MAX_SECONDS = 60 * 60
+NOTIFY_READY_BATCH_SESSION_KEY = 'notify_ready_batch'
+# Pix gerado localmente pela chave (PIX_KEY): sem retorno automatico do MP,
+# a equipe confirma pelo fluxo de marcar como pago.
+PIX_LOCAL_DETAIL = 'pix_local'
+
+
+class MercadoPagoUnavailableError(ValueError):
+    pass
+
+
+def _get_cart(request):
+    return get_cart_store().load(request)
+
+
+def _save_cart(request, response, cart):
+    return get_cart_store().save(request, response, cart)
+
+
+def _storefront_revision():
+    paths = (
+        settings.BASE_DIR / 'templates' / 'shop' / 'home.html',
+        settings.BASE_DIR / 'static' / 'shop' / 'app.js',
+    )
+    return ':'.join(str(int(os.path.getmtime(path))) if os.path.exists(path) else '0' for path in paths)
+
+
+def _storefront_etag(request):
+    raw = f'{get_catalog_version()}:{_storefront_revision()}'
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
 
 
 def _get_manage_products_tab(request, default='secao-produtos'):
@@ -78,7 +181,7 @@ def _redirect_manage_reports_page(anchor='secao-lucro-por-pessoa'):
 
 
 def _product_payload(product):
-    variants = product.variants.filter(active=True)
+    variants = [variant for variant in product.variants.all() if variant.active]
     return {
         'id': product.id,
         'name': product.name,
@@ -103,58 +206,84 @@ def _cart_item_key(product_id, variant_id=None):
     return f'{product_id}:{variant_id or 0}'
 
 
-def _build_cart_payload(cart):
-    product_ids = []
-    variant_ids = []
+def _parse_cart_keys(cart):
     parsed_keys = []
-
     for item_key in cart.keys():
         try:
             pid_text, vid_text = str(item_key).split(':', 1)
-            pid = int(pid_text)
-            vid = int(vid_text)
-            product_ids.append(pid)
-            if vid > 0:
-                variant_ids.append(vid)
-            parsed_keys.append((item_key, pid, vid))
+            parsed_keys.append((item_key, int(pid_text), int(vid_text)))
         except (ValueError, TypeError):
             continue
+    return parsed_keys
+
+
+def _resolve_price_index(product_ids, authoritative=False):
+    # Indice em memoria do catalogo (zero consultas) para carrinho/vitrine;
+    # quem grava pedido usa authoritative=True e le os precos do banco.
+    if not product_ids:
+        return {}
+    if authoritative:
+        return load_price_index(product_ids)
+    return get_price_index()
+
+
+def _apply_cart_action(cart, key, action, quantity=1):
+    current = int(cart.get(key, 0))
+    if action == 'add':
+        current += max(1, quantity)
+    elif action == 'inc':
+        current += 1
+    elif action == 'dec':
+        current -= 1
+    else:
+        current = quantity
 
-    products = Product.objects.filter(id__in=product_ids, active=True).prefetch_related('variants')
-    product_map = {p.id: p for p in products}
-    variant_map = {}
-    if variant_ids:
-        variants = ProductVariant.objects.filter(id__in=variant_ids, active=True)
-        variant_map = {variant.id: variant for variant in variants}
+    if current <= 0:
+        cart.pop(key, None)
+    else:
+        cart[key] = current
+    return cart
+
+
+def _get_indexed_product_or_404(product_id):
+    product = get_price_index().get(product_id)
+    if not product:
+        raise Http404('Produto nao encontrado.')
+    return product
+
+
+def _build_cart_payload(cart, authoritative=False):
+    parsed_keys = _parse_cart_keys(cart)
+    price_index = _resolve_price_index([pid for _item_key, pid, _vid in parsed_keys], authoritative)
 
     items = []
     total = Decimal('0.00')
 
     for item_key, pid, vid in parsed_keys:
         qty = cart.get(item_key, 0)
-        product = product_map.get(pid)
+        product = price_index.get(pid)
         if not product:
             continue
         quantity = int(qty)
-        variant = variant_map.get(vid) if vid > 0 else None
-        if vid > 0 and (not variant or variant.product_id != product.id):
+        variant = product['variants'].get(vid) if vid > 0 else None
+        if vid > 0 and not variant:
             continue
-        unit_price = variant.price if variant else product.price
+        unit_price = variant['price'] if variant else product['price']
         subtotal = unit_price * quantity
         total += subtotal
-        item_label = product.name
+        item_label = product['name']
         if variant:
-            item_label = f'{product.name} - {variant.name}'
+            item_label = f"{product['name']} - {variant['name']}"
         items.append(
             {
                 'item_key': item_key,
-                'id': product.id,
-                'variant_id': variant.id if variant else None,
-                'variant_name': variant.name if variant else '',
+                'id': product['id'],
+                'variant_id': variant['id'] if variant else None,
+                'variant_name': variant['name'] if variant else '',
                 'name': item_label,
                 'price': f'{unit_price:.2f}',
                 'quantity': quantity,
-                'image_url': product.image_source,
+                'image_url': product['image_source'],
                 'subtotal': f'{subtotal:.2f}',
             }
         )
@@ -166,12 +295,11 @@ def _build_cart_payload(cart):
     }
 
 
-def _build_order_items_from_payload(items_payload):
+def _build_order_items_from_payload(items_payload, authoritative=False):
     if not isinstance(items_payload, list) or not items_payload:
         return None, None, 'Carrinho vazio para venda.'
 
     product_ids = []
-    variant_ids = []
     normalized = []
 
     for raw in items_payload:
@@ -183,8 +311,6 @@ def _build_order_items_from_payload(items_payload):
             if quantity <= 0:
                 continue
             product_ids.append(product_id)
-            if variant_id:
-                variant_ids.append(variant_id)
             normalized.append((product_id, variant_id, quantity))
         except (TypeError, ValueError, AttributeError):
             return None, None, 'Item invalido no carrinho.'
@@ -192,44 +318,33 @@ def _build_order_items_from_payload(items_payload):
     if not normalized:
         return None, None, 'Carrinho vazio para venda.'
 
-    products = Product.objects.filter(id__in=product_ids, active=True).prefetch_related('variants')
-    product_map = {product.id: product for product in products}
-    active_variant_ids_by_product = {
-        product.id: {variant.id for variant in product.variants.all() if variant.active}
-        for product in products
-    }
-    variants_map = {}
-    if variant_ids:
-        variants = ProductVariant.objects.filter(id__in=variant_ids, active=True)
-        variants_map = {variant.id: variant for variant in variants}
-
+    price_index = _resolve_price_index(product_ids, authoritative)
     order_items = []
     total = Decimal('0.00')
 
     for product_id, variant_id, quantity in normalized:
-        product = product_map.get(product_id)
+        product = price_index.get(product_id)
         if not product:
             return None, None, f'Produto {product_id} nao encontrado ou inativo.'
-        product_active_variant_ids = active_variant_ids_by_product.get(product.id, set())
-        if product_active_variant_ids and not variant_id:
-            return None, None, f'Selecione uma variacao para {product.name}.'
-        variant = variants_map.get(variant_id) if variant_id else None
-        if variant_id and (not variant or variant.product_id != product.id):
-            return None, None, f'Variacao invalida para {product.name}.'
-
-        unit_price = variant.price if variant else product.price
+        if product['variants'] and not variant_id:
+            return None, None, f"Selecione uma variacao para {product['name']}."
+        variant = product['variants'].get(variant_id) if variant_id else None
+        if variant_id and not variant:
+            return None, None, f"Variacao invalida para {product['name']}."
+
+        unit_price = variant['price'] if variant else product['price']
         subtotal = unit_price * quantity
         total += subtotal
-        item_name = product.name if not variant else f'{product.name} - {variant.name}'
+        item_name = product['name'] if not variant else f"{product['name']} - {variant['name']}"
         order_items.append(
             {
-                'id': product.id,
-                'variant_id': variant.id if variant else None,
+                'id': product['id'],
+                'variant_id': variant['id'] if variant else None,
                 'name': item_name,
                 'price': f'{unit_price:.2f}',
                 'quantity': quantity,
                 'subtotal': f'{subtotal:.2f}',
-                'image_url': product.image_source,
+                'image_url': product['image_source'],
             }
         )
 
@@ -292,8 +407,10 @@ def _audit_action_label(log):
         return 'Pedidos marcados como entregues (lote)'
     if '/manage/orders/page/mark-paid' in path:
         return 'Pedido marcado como pago'
+    if '/manage/orders/page/notify-ready-bulk' in path:
+        return 'Notificacoes de pedido pronto enfileiradas (lote)'
     if '/manage/orders/page/notify-ready' in path:
-        return 'Notificacao de pedido pronto enviada'
+        return 'Notificacao de pedido pronto enfileirada'
     if '/manage/orders/page/manual-create' in path:
         return 'Pedido manual lancado'
     if '/manage/orders/page/delete' in path:
@@ -310,6 +427,8 @@ def _audit_action_label(log):
         return 'Contato WhatsApp cadastrado'
     if '/manage/whatsapp/page/delete' in path:
         return 'Contato WhatsApp removido'
+    if '/manage/whatsapp/page/retry' in path:
+        return 'Mensagens WhatsApp reenviadas'
     if '/manage/users/page/create' in path:
         return 'Usuario criado'
     if '/manage/audit/page' in path:
@@ -413,34 +532,49 @@ def _normalize_whatsapp_phone(value):
     return digits
 
 
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, '').strip() or default)
+    except ValueError:
+        return default
+
+
+def _outbound_http_options():
+    return {
+        'connect_timeout': _env_float('HTTP_CONNECT_TIMEOUT_SECONDS', 5.0),
+        'read_timeout': _env_float('HTTP_READ_TIMEOUT_SECONDS', 20.0),
+        'max_retries': int(_env_float('HTTP_MAX_RETRIES', 2)),
+    }
+
+
+def _wapi_http_client():
+    base_url = os.getenv('WAPI_API_BASE_URL', 'https://api.w-api.app').strip()
+    return get_http_client(base_url, **_outbound_http_options())
+
+
 def _wapi_send_text(phone, message):
     instance_id = os.getenv('WAPI_INSTANCE_ID', '').strip()
     token = os.getenv('WAPI_TOKEN', '').strip()
     if not instance_id or not token:
         raise ValueError('W-API nao configurada. Defina WAPI_INSTANCE_ID e WAPI_TOKEN.')
 
-    url = f'https://api.w-api.app/v1/message/send-text?instanceId={instance_id}'
     payload = {
         'phone': phone,
         'message': message,
     }
-    req = urllib_request.Request(
-        url=url,
-        data=json.dumps(payload).encode('utf-8'),
-        headers={
-            'Authorization': f'Bearer {token}',
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-        },
-        method='POST',
-    )
     try:
-        with urllib_request.urlopen(req, timeout=30) as response:
-            if response.status != 200:
-                raise ValueError(f'W-API retornou HTTP {response.status}.')
-    except error.HTTPError as exc:
-        body = exc.read().decode('utf-8', 'ignore')
-        raise ValueError(f'Erro W-API HTTP {exc.code}: {body}') from exc
+        response = _wapi_http_client().request(
+            'POST',
+            f'/v1/message/send-text?instanceId={instance_id}',
+            json_body=payload,
+            headers={'Authorization': f'Bearer {token}'},
+        )
+    except HttpClientError as exc:
+        raise ValueError(f'Erro W-API: {exc}') from exc
+    if response.status >= 400:
+        raise ValueError(f'Erro W-API HTTP {response.status}: {response.text()}')
+    if response.status != 200:
+        raise ValueError(f'W-API retornou HTTP {response.status}.')
 
 
 def _build_order_whatsapp_message(order):
@@ -499,12 +633,70 @@ def _wapi_delay_bounds():
     return minimum, maximum
 
 
-def _send_whatsapp_notifications_for_order(order):
-    # Lock idempotente: se outro processo/webhook ja marcou envio, nao envia de novo.
+def _wapi_rate_limiter():
+    # Intervalo medio de _wapi_delay_bounds entre envios. O estado fica na
+    # memoria do processo: o limite da W-API so vale com um unico processo
+    # enviando (um whatsapp_worker, ou o envio no servidor web com um processo).
+    minimum_delay, maximum_delay = _wapi_delay_bounds()
+    return get_token_bucket(
+        'W-API',
+        interval=(minimum_delay + maximum_delay) / 2,
+        burst=int(_env_float('WAPI_BURST', 1)),
+    )
+
+
+def _whatsapp_inline_drain_enabled():
+    # Envio dentro do servidor web, so para instalacoes com um unico processo:
+    # cada processo teria o proprio limitador. Em producao use o whatsapp_worker.
+    return os.getenv('WAPI_INLINE_DRAIN', '').strip().lower() in {'1', 'true', 'on', 'yes'}
+
+
+_whatsapp_drain_lock = threading.Lock()
+_whatsapp_drain_state = {'running': False, 'requested': False}
+
+
+def _start_whatsapp_drain():
+    # No maximo um envio em andamento por processo, numa thread propria (as
+    # esperas do limitador nao ocupam o pool de submit_background). Pedidos
+    # enquanto ele roda so garantem mais uma passada no final.
+    with _whatsapp_drain_lock:
+        _whatsapp_drain_state['requested'] = True
+        if _whatsapp_drain_state['running']:
+            return False
+        _whatsapp_drain_state['running'] = True
+    start_background_thread(_run_whatsapp_drain, name='whatsapp-drain')
+    return True
+
+
+def _run_whatsapp_drain():
+    try:
+        while True:
+            with _whatsapp_drain_lock:
+                if not _whatsapp_drain_state['requested']:
+                    _whatsapp_drain_state['running'] = False
+                    return
+                _whatsapp_drain_state['requested'] = False
+            if _drain_whatsapp_outbox()['messages']:
+                # A passada pode ter parado no limite de vagas: tenta de novo.
+                with _whatsapp_drain_lock:
+                    _whatsapp_drain_state['requested'] = True
+    finally:
+        with _whatsapp_drain_lock:
+            _whatsapp_drain_state['running'] = False
+
+
+def _schedule_whatsapp_drain():
+    if _whatsapp_inline_drain_enabled():
+        transaction.on_commit(_start_whatsapp_drain)
+
+
+def _queue_whatsapp_notifications_for_order(order):
+    # So grava na outbox; chame na mesma transacao da mudanca de status para a
+    # mensagem existir se e somente se o pedido foi pago. whatsapp_notified marca
+    # "ja enfileirado"; o resultado de cada envio fica no registro de entrega.
     updated = Order.objects.filter(id=order.id, whatsapp_notified=False).update(
         whatsapp_notified=True,
         whatsapp_notified_at=timezone.now(),
-        whatsapp_notify_error='',
     )
     if updated == 0:
         return
@@ -514,65 +706,454 @@ def _send_whatsapp_notifications_for_order(order):
     if buyer_phone:
         phones.add(buyer_phone)
 
+    digest_phones = set()
     for recipient in WhatsAppRecipient.objects.filter(active=True):
         normalized = _normalize_whatsapp_phone(recipient.phone)
         if normalized:
-            phones.add(normalized)
+            (digest_phones if recipient.digest else phones).add(normalized)
+    # O comprador sempre recebe a confirmacao individual.
+    digest_phones -= phones
 
-    if not phones:
-        order.whatsapp_notify_error = 'Nenhum telefone valido para envio.'
-        order.save(update_fields=['whatsapp_notify_error'])
+    if not phones and not digest_phones:
         return
 
     message = _build_order_whatsapp_message(order)
-    errors = []
-    minimum_delay, maximum_delay = _wapi_delay_bounds()
-    for index, phone in enumerate(sorted(phones)):
-        if index > 0 and maximum_delay > 0:
-            time.sleep(random.uniform(minimum_delay, maximum_delay))
-        try:
-            _wapi_send_text(phone, message)
-        except ValueError as exc:
-            errors.append(str(exc))
+    deliveries = [
+        WhatsAppOutbox(
+            order=order,
+            kind=WhatsAppOutbox.KIND_PAID,
+            phone=phone,
+            message=message,
+            priority=WhatsAppOutbox.PRIORITY_BUYER if phone == buyer_phone else WhatsAppOutbox.PRIORITY_STAFF,
+        )
+        for phone in sorted(phones)
+    ]
+    if digest_phones:
+        # Entra no resumo ja aberto do telefone ou abre um que sai ao fim da janela.
+        open_digests = dict(
+            WhatsAppOutbox.objects.filter(
+                kind=WhatsAppOutbox.KIND_DIGEST,
+                status=WhatsAppOutbox.STATUS_PENDING,
+                phone__in=digest_phones,
+            )
+            .values_list('phone')
+            .annotate(send_at=Min('next_attempt_at'))
+            .order_by()
+        )
+        window_end = timezone.now() + timedelta(seconds=_wapi_digest_window_seconds())
+        deliveries.extend(
+            WhatsAppOutbox(
+                order=order,
+                kind=WhatsAppOutbox.KIND_DIGEST,
+                phone=phone,
+                message=_build_order_digest_line(order),
+                next_attempt_at=open_digests.get(phone, window_end),
+            )
+            for phone in sorted(digest_phones)
+        )
+    # ignore_conflicts: a unique (pedido, telefone, tipo) segura enfileiramento repetido.
+    WhatsAppOutbox.objects.bulk_create(deliveries, ignore_conflicts=True)
+    _schedule_whatsapp_drain()
+
+
+def _wapi_digest_window_seconds():
+    return max(0.0, _env_float('WAPI_DIGEST_WINDOW_SECONDS', 60))
+
+
+def _build_order_digest_line(order):
+    count = sum(int(item.get('quantity', 0) or 0) for item in order.items_json)
+    return f'#{order.id} {order.first_name} {order.last_name} - R$ {order.total:.2f} ({count} itens)'
+
+
+def _build_digest_whatsapp_message(deliveries):
+    lines = [f'Pagamentos aprovados: {len(deliveries)} pedido(s)', '']
+    lines.extend(delivery.message for delivery in deliveries)
+    return '\n'.join(lines)
+
+
+def _wapi_fanout_workers():
+    return max(1, int(_env_float('WAPI_FANOUT_WORKERS', 4)))
+
+
+def _send_whatsapp_text(phone, text):
+    # Roda no pool do fan-out: so HTTP aqui; o banco e atualizado pela thread
+    # que chamou _drain_whatsapp_outbox.
+    started_at = time.monotonic()
+    try:
+        _wapi_send_text(phone, text)
+        error = None
+    except Exception as exc:
+        error = exc
+    return error, int((time.monotonic() - started_at) * 1000)
+
+
+def _whatsapp_latency_stats(samples=200):
+    latencies = sorted(
+        WhatsAppOutbox.objects.filter(send_ms__isnull=False)
+        .order_by('-sent_at', '-id')
+        .values_list('send_ms', flat=True)[:samples]
+    )
+    if not latencies:
+        return {'samples': 0, 'avg_ms': 0, 'p95_ms': 0, 'workers': _wapi_fanout_workers()}
+    return {
+        'samples': len(latencies),
+        'avg_ms': sum(latencies) // len(latencies),
+        'p95_ms': latencies[max(0, int(len(latencies) * 0.95) - 1)],
+        'workers': _wapi_fanout_workers(),
+    }
+
 
-    order.whatsapp_notify_error = '; '.join(errors)[:255] if errors else ''
-    order.save(update_fields=['whatsapp_notify_error'])
+def _whatsapp_retry_delay(attempts):
+    return min(WHATSAPP_BACKOFF_MAX_SECONDS, WHATSAPP_BACKOFF_SECONDS * 2 ** max(0, attempts - 1))
+
+
+def _drain_whatsapp_outbox(limit=WHATSAPP_DRAIN_BATCH):
+    # Uma passada pela outbox: compradores primeiro, depois ordem de chegada.
+    # Pendentes e falhas com a nova tentativa vencida entram na mesma fila; os
+    # registros de resumo vencidos de um telefone saem juntos numa so mensagem.
+    # Telefones diferentes sao enviados em paralelo (WAPI_FANOUT_WORKERS), com
+    # as vagas do _wapi_rate_limiter reservadas na ordem da fila.
+    outbox = WhatsAppOutbox.objects
+    limiter = _wapi_rate_limiter()
+    # So pega o que o limitador libera bem antes de WHATSAPP_LOCK_SECONDS: uma
+    # mensagem presa esperando a vez nao pode ser devolvida a fila e sair duas vezes.
+    capacity = limiter.capacity(WHATSAPP_LOCK_SECONDS / 2)
+    if capacity is not None:
+        limit = min(limit, capacity)
+    stats = {'messages': 0, 'deliveries': 0, 'sent': 0, 'failed': 0, 'dead': 0}
+    outbox.filter(
+        status=WhatsAppOutbox.STATUS_SENDING,
+        locked_at__lt=timezone.now() - timedelta(seconds=WHATSAPP_LOCK_SECONDS),
+    ).update(status=WhatsAppOutbox.STATUS_PENDING, locked_at=None)
+
+    due = {'status__in': [WhatsAppOutbox.STATUS_PENDING, WhatsAppOutbox.STATUS_FAILED]}
+    sends = []
+    busy_phones = set()
+    for message_id, kind, phone in list(
+        outbox.filter(next_attempt_at__lte=timezone.now(), **due)
+        .order_by('priority', 'id')
+        .values_list('id', 'kind', 'phone')[:limit]
+    ):
+        if phone in busy_phones:
+            # Uma mensagem por telefone por passada; a proxima sai na seguinte.
+            continue
+        locked_at = timezone.now()
+        if kind == WhatsAppOutbox.KIND_DIGEST:
+            claim = outbox.filter(kind=kind, phone=phone, next_attempt_at__lte=locked_at, **due)
+        else:
+            claim = outbox.filter(id=message_id, **due)
+        if not claim.update(status=WhatsAppOutbox.STATUS_SENDING, locked_at=locked_at):
+            # Outro worker (ou o resumo de uma linha anterior) ja pegou.
+            continue
+        deliveries = list(
+            outbox.filter(status=WhatsAppOutbox.STATUS_SENDING, locked_at=locked_at, phone=phone, kind=kind).order_by(
+                'id'
+            )
+        )
+        if kind == WhatsAppOutbox.KIND_DIGEST:
+            text = _build_digest_whatsapp_message(deliveries)
+        else:
+            text = deliveries[0].message
+        sends.append((phone, text, deliveries, locked_at))
+        busy_phones.add(phone)
+        if len(sends) >= limit:
+            break
+    if not sends:
+        return stats
+
+    with ThreadPoolExecutor(max_workers=min(_wapi_fanout_workers(), len(sends))) as executor:
+        futures = []
+        for phone, text, deliveries, locked_at in sends:
+            # Espera a vez aqui (o pool so faz HTTP) e renova a trava logo antes
+            # de enviar; se outra passada ja retomou a mensagem, nao envia.
+            wait = limiter.reserve()
+            if wait:
+                time.sleep(wait)
+            if not outbox.filter(
+                id__in=[delivery.id for delivery in deliveries],
+                status=WhatsAppOutbox.STATUS_SENDING,
+                locked_at=locked_at,
+            ).update(locked_at=timezone.now()):
+                continue
+            futures.append((deliveries, executor.submit(_send_whatsapp_text, phone, text)))
+        for deliveries, future in futures:
+            error, send_ms = future.result()
+            stats['messages'] += 1
+            stats['deliveries'] += len(deliveries)
+            if error is not None:
+                for delivery in deliveries:
+                    attempts = delivery.attempts + 1
+                    dead = attempts >= WHATSAPP_MAX_ATTEMPTS
+                    stats['dead' if dead else 'failed'] += 1
+                    outbox.filter(id=delivery.id).update(
+                        status=WhatsAppOutbox.STATUS_DEAD if dead else WhatsAppOutbox.STATUS_FAILED,
+                        attempts=attempts,
+                        last_error=str(error)[:255],
+                        next_attempt_at=timezone.now() + timedelta(seconds=_whatsapp_retry_delay(attempts)),
+                        locked_at=None,
+                        send_ms=send_ms,
+                    )
+                continue
+            stats['sent'] += len(deliveries)
+            outbox.filter(id__in=[delivery.id for delivery in deliveries]).update(
+                status=WhatsAppOutbox.STATUS_SENT,
+                attempts=F('attempts') + 1,
+                last_error='',
+                locked_at=None,
+                sent_at=timezone.now(),
+                send_ms=send_ms,
+            )
+    return stats
+
+
+def _queue_ready_whatsapp(orders):
+    # Aviso de pedido pronto tambem vai pela outbox. Avisar de novo o mesmo
+    # pedido reabre o registro de entrega (unique pedido/telefone/tipo) se ele
+    # ja terminou; pendente ou em envio fica como esta, senao sairia duas vezes.
+    deliveries = []
+    skipped = []
+    for order in orders:
+        phone = _normalize_whatsapp_phone(order.whatsapp)
+        if not phone:
+            skipped.append(order.id)
+            continue
+        deliveries.append(
+            WhatsAppOutbox(
+                order=order,
+                kind=WhatsAppOutbox.KIND_READY,
+                phone=phone,
+                message=_build_order_ready_whatsapp_message(order),
+                priority=WhatsAppOutbox.PRIORITY_BUYER,
+            )
+        )
+    if deliveries:
+        ready = WhatsAppOutbox.objects.filter(kind=WhatsAppOutbox.KIND_READY)
+        existing = set(
+            ready.filter(order_id__in=[delivery.order_id for delivery in deliveries]).values_list('order_id', 'phone')
+        )
+        WhatsAppOutbox.objects.bulk_create(
+            [delivery for delivery in deliveries if (delivery.order_id, delivery.phone) not in existing],
+            ignore_conflicts=True,
+        )
+        for delivery in deliveries:
+            if (delivery.order_id, delivery.phone) not in existing:
+                continue
+            ready.filter(
+                order_id=delivery.order_id,
+                phone=delivery.phone,
+                status__in=[WhatsAppOutbox.STATUS_SENT, WhatsAppOutbox.STATUS_FAILED, WhatsAppOutbox.STATUS_DEAD],
+            ).update(
+                message=delivery.message,
+                status=WhatsAppOutbox.STATUS_PENDING,
+                attempts=0,
+                last_error='',
+                next_attempt_at=timezone.now(),
+                locked_at=None,
+                sent_at=None,
+            )
+        _schedule_whatsapp_drain()
+    return [delivery.order_id for delivery in deliveries], skipped
+
+
+def _notify_ready_batch_progress(batch):
+    progress = {
+        'total': len(batch['order_ids']),
+        'sent': 0,
+        'pending': 0,
+        'failed': 0,
+        'skipped': batch['skipped'],
+        'failures': [],
+    }
+    for order_id, status, last_error in (
+        WhatsAppOutbox.objects.filter(kind=WhatsAppOutbox.KIND_READY, order_id__in=batch['order_ids'])
+        .order_by('order_id')
+        .values_list('order_id', 'status', 'last_error')
+    ):
+        if status == WhatsAppOutbox.STATUS_SENT:
+            progress['sent'] += 1
+        elif status in {WhatsAppOutbox.STATUS_FAILED, WhatsAppOutbox.STATUS_DEAD}:
+            progress['failed'] += 1
+            progress['failures'].append(
+                {'order_id': order_id, 'error': last_error, 'retrying': status == WhatsAppOutbox.STATUS_FAILED}
+            )
+        else:
+            progress['pending'] += 1
+    progress['done'] = progress['pending'] == 0
+    return progress
+
+
+def _retry_whatsapp_deliveries(delivery_ids=None):
+    # Falhas (inclusive "dead") voltam para a fila agora, com as tentativas zeradas.
+    failed = WhatsAppOutbox.objects.filter(status__in=[WhatsAppOutbox.STATUS_FAILED, WhatsAppOutbox.STATUS_DEAD])
+    if delivery_ids:
+        failed = failed.filter(id__in=delivery_ids)
+    return failed.update(
+        status=WhatsAppOutbox.STATUS_PENDING,
+        attempts=0,
+        next_attempt_at=timezone.now(),
+        locked_at=None,
+    )
 
 
 def _mp_access_token():
     return os.getenv('MP_ACCESS_TOKEN_PROD', '').strip()
 
 
-def _mp_api_request(method, path, payload=None):
+def _pix_key():
+    return os.getenv('PIX_KEY', '').strip()
+
+
+def _pix_merchant_name():
+    return os.getenv('PIX_MERCHANT_NAME', 'Missao Andrews').strip()
+
+
+def _pix_merchant_city():
+    return os.getenv('PIX_MERCHANT_CITY', 'Sao Carlos').strip()
+
+
+def _pix_local_fallback_enabled():
+    if not _pix_key():
+        return False
+    return os.getenv('PIX_LOCAL_FALLBACK', '1').strip().lower() in {'1', 'true', 'on', 'yes'}
+
+
+def _pix_async_enabled():
+    return os.getenv('MP_PIX_ASYNC', '').strip().lower() in {'1', 'true', 'on', 'yes'}
+
+
+def _checkout_idempotency_seconds():
+    return max(0.0, _env_float('CHECKOUT_IDEMPOTENCY_SECONDS', 600))
+
+
+def _mp_api_base_url():
+    return os.getenv('MP_API_BASE_URL', 'https://api.mercadopago.com').strip()
+
+
+def _mp_http_client():
+    return get_http_client(_mp_api_base_url(), **_outbound_http_options())
+
+
+def _amp_http_client():
+    return get_async_http_client(_mp_api_base_url(), **_outbound_http_options())
+
+
+def _mp_circuit_breaker():
+    # Abre apos N falhas/lentidoes seguidas; enquanto aberto as chamadas ao MP
+    # falham na hora em vez de prender o worker ate o timeout.
+    return get_circuit_breaker(
+        'Mercado Pago',
+        failure_threshold=int(_env_float('MP_BREAKER_FAILURES', 5)),
+        slow_call_seconds=_env_float('MP_BREAKER_SLOW_SECONDS', 8.0),
+        reset_timeout=_env_float('MP_BREAKER_RESET_SECONDS', 30.0),
+        open_message='Mercado Pago indisponivel no momento. Tente novamente em instantes.',
+    )
+
+
+def _checkout_admission():
+    # Limite de checkouts simultaneos por processo (no total: workers x limite).
+    # Cai quando a latencia do MP passa do alvo e volta a subir aos poucos.
+    return get_admission_controller(
+        'Checkout',
+        max_limit=int(_env_float('CHECKOUT_MAX_CONCURRENCY', 8)),
+        min_limit=int(_env_float('CHECKOUT_MIN_CONCURRENCY', 1)),
+        target_latency=_env_float('CHECKOUT_TARGET_LATENCY', 2.0),
+    )
+
+
+def _checkout_busy_response(admission):
+    response = JsonResponse(
+        {
+            'error': 'Muitos pedidos ao mesmo tempo. Tente novamente em instantes.',
+            'busy': True,
+            'retry_after': admission.retry_after,
+        },
+        status=503,
+    )
+    response['Retry-After'] = str(admission.retry_after)
+    return response
+
+
+def _mp_unavailable_response():
+    breaker = _mp_circuit_breaker()
+    response = JsonResponse({'error': breaker.open_message}, status=503)
+    response['Retry-After'] = str(max(1, breaker.snapshot()['retry_in_seconds']))
+    return response
+
+
+def _mp_payment_idempotency_key(order):
+    # Mesma chave para o mesmo pedido: repetir o POST nao cria outra cobranca.
+    raw = f'mp-payment:ORDER_{order.id}:{order.created_at.isoformat()}'
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _mp_request_options(payload, idempotency_key):
     token = _mp_access_token()
     if not token:
         raise ValueError('MP_ACCESS_TOKEN_PROD nÃ£o configurado no servidor.')
 
-    url = f'https://api.mercadopago.com{path}'
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Accept': 'application/json',
+    if payload is not None and not idempotency_key:
+        idempotency_key = hashlib.sha256(os.urandom(16)).hexdigest()
+    return {
+        'json_body': payload,
+        'headers': {'Authorization': f'Bearer {token}'},
+        'idempotency_key': idempotency_key if payload is not None else None,
     }
-    data = None
 
-    if payload is not None:
-        headers['Content-Type'] = 'application/json'
-        headers['X-Idempotency-Key'] = hashlib.sha256(os.urandom(16)).hexdigest()
-        data = json.dumps(payload).encode('utf-8')
 
-    req = urllib_request.Request(url=url, data=data, headers=headers, method=method)
+def _mp_api_request(method, path, payload=None, idempotency_key=None):
+    options = _mp_request_options(payload, idempotency_key)
+    breaker = _mp_circuit_breaker()
+    breaker.before_call()
+    started_at = time.monotonic()
+    try:
+        response = _mp_http_client().request(method, path, **options)
+    except HttpClientError as exc:
+        breaker.record_failure(str(exc))
+        raise MercadoPagoUnavailableError(f'Erro Mercado Pago: {exc}') from exc
+    except Exception as exc:
+        breaker.record_failure(str(exc))
+        raise
+    return _mp_handle_response(breaker, response, started_at)
+
+
+async def _amp_api_request(method, path, payload=None, idempotency_key=None):
+    # Mesmo fluxo de _mp_api_request sobre o cliente asyncio (views ASGI).
+    options = _mp_request_options(payload, idempotency_key)
+    breaker = _mp_circuit_breaker()
+    breaker.before_call()
+    started_at = time.monotonic()
     try:
-        with urllib_request.urlopen(req, timeout=30) as response:
-            body = response.read().decode('utf-8')
-            return json.loads(body) if body else {}
-    except error.HTTPError as exc:
+        response = await _amp_http_client().request(method, path, **options)
+    except HttpClientError as exc:
+        breaker.record_failure(str(exc))
+        raise MercadoPagoUnavailableError(f'Erro Mercado Pago: {exc}') from exc
+    except Exception as exc:
+        breaker.record_failure(str(exc))
+        raise
+    return _mp_handle_response(breaker, response, started_at)
+
+
+def _mp_handle_response(breaker, response, started_at):
+    elapsed = time.monotonic() - started_at
+    _checkout_admission().observe_latency(elapsed)
+    if response.status >= 500 or response.status == 429:
+        breaker.record_failure(f'HTTP {response.status}')
+    else:
+        breaker.record_success(elapsed)
+
+    if response.status >= 400:
         try:
-            body = exc.read().decode('utf-8')
-            details = json.loads(body)
-            message = details.get('message') or details.get('error') or body
+            details = response.json()
+            message = details.get('message') or details.get('error') or response.text()
         except Exception:
-            message = str(exc)
-        raise ValueError(f'Erro Mercado Pago: {message}') from exc
+            message = f'HTTP {response.status}'
+        if response.status >= 500 or response.status == 429:
+            raise MercadoPagoUnavailableError(f'Erro Mercado Pago: {message}')
+        raise ValueError(f'Erro Mercado Pago: {message}')
+    try:
+        return response.json()
+    except ValueError as exc:
+        raise ValueError('Erro Mercado Pago: resposta invalida.') from exc
 
 
 def _mp_generate_payer_email(order):
@@ -581,9 +1162,9 @@ def _mp_generate_payer_email(order):
     return f'pedido{order.id}.{suffix}@missaoandrewsc.com.br'
 
 
-def _create_mp_pix_payment(order):
+def _mp_pix_payment_request(order):
     external_reference = f'ORDER_{order.id}'
-    payload = {
+    return {
         'transaction_amount': float(order.total),
         'description': f'Pedido #{order.id} - Loja MissÃ£o Andrews',
         'payment_method_id': 'pix',
@@ -595,12 +1176,25 @@ def _create_mp_pix_payment(order):
             'last_name': order.last_name[:60],
         },
     }
-    payment = _mp_api_request('POST', '/v1/payments', payload)
+
+
+def _create_mp_pix_payment(order):
+    payload = _mp_pix_payment_request(order)
+    payment = _mp_api_request('POST', '/v1/payments', payload, idempotency_key=_mp_payment_idempotency_key(order))
+    return _mp_pix_payload_from_payment(payment, payload['external_reference'])
+
+
+async def _acreate_mp_pix_payment(order):
+    payload = _mp_pix_payment_request(order)
+    payment = await _amp_api_request('POST', '/v1/payments', payload, idempotency_key=_mp_payment_idempotency_key(order))
+    return _mp_pix_payload_from_payment(payment, payload['external_reference'])
+
+
+def _mp_pix_payload_from_payment(payment, external_reference):
     tx_data = payment.get('point_of_interaction', {}).get('transaction_data', {})
     pix_code = tx_data.get('qr_code', '')
-    qr_base64 = tx_data.get('qr_code_base64', '')
 
-    if not pix_code or not qr_base64:
+    if not pix_code:
         raise ValueError('Mercado Pago nÃ£o retornou QR Code Pix para este pagamento.')
 
     return {
@@ -609,27 +1203,283 @@ def _create_mp_pix_payment(order):
         'status': payment.get('status', '') or '',
         'status_detail': payment.get('status_detail', '') or '',
         'pix_code': pix_code,
-        'qr_base64': qr_base64,
     }
 
 
+def _create_local_pix_payment(order):
+    key = _pix_key()
+    if not key:
+        raise ValueError('PIX_KEY nao configurada no servidor.')
+    external_reference = f'ORDER_{order.id}'
+    pix_code = build_pix_brcode(
+        key=key,
+        amount=order.total,
+        reference=f'PEDIDO{order.id}',
+        merchant_name=_pix_merchant_name(),
+        merchant_city=_pix_merchant_city(),
+    )
+    return {
+        'payment_id': '',
+        'external_reference': external_reference,
+        'status': 'pending',
+        'status_detail': PIX_LOCAL_DETAIL,
+        'pix_code': pix_code,
+    }
+
+
+def _create_order_pix_payment(order, local=False):
+    # Mercado Pago primeiro; com o MP fora do ar usa o BR Code local (PIX_KEY).
+    if local:
+        return _create_local_pix_payment(order)
+    try:
+        return _create_mp_pix_payment(order)
+    except (CircuitOpenError, MercadoPagoUnavailableError):
+        if not _pix_local_fallback_enabled():
+            raise
+        return _create_local_pix_payment(order)
+
+
+async def _acreate_order_pix_payment(order, local=False):
+    if local:
+        return _create_local_pix_payment(order)
+    try:
+        return await _acreate_mp_pix_payment(order)
+    except (CircuitOpenError, MercadoPagoUnavailableError):
+        if not _pix_local_fallback_enabled():
+            raise
+        return _create_local_pix_payment(order)
+
+
+def _pix_code_digest(pix_code):
+    return hashlib.sha256(pix_code.encode('utf-8')).hexdigest()[:24]
+
+
+def _pix_qr_signature(order_id, digest):
+    return signing.Signer(salt='order-pix-qr').signature(f'{order_id}:{digest}')
+
+
+def _build_pix_qr_url(order):
+    pix_code = order.pix_code
+    if not pix_code:
+        return ''
+    digest = _pix_code_digest(pix_code)
+    signature = _pix_qr_signature(order.id, digest)
+    return f"{reverse('order_pix_qr_image', args=[order.id, digest])}?{urlencode({'sig': signature})}"
+
+
+def _pix_qr_storage_name(order_id, digest):
+    return f'{PIX_QR_STORAGE_DIR}/order-{order_id}-{digest}.png'
+
+
+def _get_or_create_pix_qr_png(order_id, digest, pix_code):
+    name = _pix_qr_storage_name(order_id, digest)
+    if default_storage.exists(name):
+        with default_storage.open(name, 'rb') as stored:
+            return stored.read()
+    png = render_qr_png(pix_code)
+    default_storage.save(name, ContentFile(png))
+    return png
+
+
+@transaction.atomic
+def _apply_pix_payload(order, pix_payload):
+    # Cada cobranca criada vira uma PaymentAttempt e passa a ser a atual do pedido.
+    status = (pix_payload['status'] or 'pending').lower()
+    order.current_payment = PaymentAttempt.objects.create(
+        order=order,
+        provider=(
+            PaymentAttempt.PROVIDER_PIX_LOCAL
+            if pix_payload['status_detail'] == PIX_LOCAL_DETAIL
+            else PaymentAttempt.PROVIDER_MERCADO_PAGO
+        ),
+        payment_id=pix_payload['payment_id'],
+        external_reference=pix_payload['external_reference'],
+        status=status,
+        status_detail=pix_payload['status_detail'],
+        pix_code=pix_payload['pix_code'],
+    )
+    order.mp_status = status
+    order.mp_status_detail = pix_payload['status_detail']
+    if order.mp_status == 'approved':
+        order.is_paid = True
+        order.paid_at = timezone.now()
+    order.save()
+    if order.is_paid and not order.whatsapp_notified:
+        _queue_whatsapp_notifications_for_order(order)
+
+
+def _create_pix_charge_for_order(order_id):
+    # Roda no pool de segundo plano. Em falha o pedido fica "failed" com o motivo
+    # (o cliente ja recebeu o numero do pedido, entao nao da para apaga-lo).
+    order = Order.objects.filter(id=order_id, mp_status=PIX_STATUS_CREATING).first()
+    if order is None:
+        return
+    try:
+        pix_payload = _create_order_pix_payment(order)
+    except Exception as exc:
+        _mark_pix_charge_failed(order.id, exc)
+        return
+
+    _apply_pix_payload(order, pix_payload)
+
+
+def _mark_pix_charge_failed(order_id, exc):
+    message = str(exc) if isinstance(exc, ValueError) else 'Falha de comunicacao com o Mercado Pago.'
+    updated = Order.objects.filter(id=order_id, mp_status=PIX_STATUS_CREATING).update(
+        mp_status=PIX_STATUS_FAILED,
+        mp_status_detail=message[:120],
+    )
+    if updated:
+        publish_order_status(order_id)
+
+
+async def _acreate_pix_charge_for_order(order_id):
+    # Versao ASGI: roda como tarefa no event loop, sem ocupar thread do pool.
+    order = await Order.objects.filter(id=order_id, mp_status=PIX_STATUS_CREATING).afirst()
+    if order is None:
+        return
+    try:
+        pix_payload = await _acreate_order_pix_payment(order)
+    except Exception as exc:
+        await sync_to_async(_mark_pix_charge_failed)(order.id, exc)
+        return
+
+    await sync_to_async(_apply_pix_payload)(order, pix_payload)
+
+
 def _get_mp_payment(payment_id):
     return _mp_api_request('GET', f'/v1/payments/{payment_id}')
 
 
+async def _aget_mp_payment(payment_id):
+    return await _amp_api_request('GET', f'/v1/payments/{payment_id}')
+
+
+def _mp_status_cache_seconds():
+    return max(0.0, _env_float('MP_STATUS_CACHE_SECONDS', 5.0))
+
+
+def _mp_status_cache():
+    return get_single_flight_cache('Status Mercado Pago', ttl=_mp_status_cache_seconds())
+
+
+def _mp_payment_cache_key(payment_id):
+    return f'shop:mp_payment:{payment_id}'
+
+
+def _get_mp_payment_cached(payment_id):
+    # Polling do checkout: no maximo uma consulta ao MP por pagamento a cada
+    # MP_STATUS_CACHE_SECONDS. Abas simultaneas no mesmo processo esperam a
+    # mesma chamada; o cache do Django divide o resultado entre os workers.
+    ttl = _mp_status_cache_seconds()
+    if not ttl:
+        return _get_mp_payment(payment_id)
+
+    def load():
+        cache_key = _mp_payment_cache_key(payment_id)
+        payment_data = order_cache().get(cache_key)
+        if payment_data is None:
+            payment_data = _get_mp_payment(payment_id)
+            order_cache().set(cache_key, payment_data, ttl)
+        return payment_data
+
+    return _mp_status_cache().get_or_call(str(payment_id), load)
+
+
+async def _aget_mp_payment_cached(payment_id):
+    ttl = _mp_status_cache_seconds()
+    if not ttl:
+        return await _aget_mp_payment(payment_id)
+
+    async def load():
+        cache_key = _mp_payment_cache_key(payment_id)
+        payment_data = await order_cache().aget(cache_key)
+        if payment_data is None:
+            payment_data = await _aget_mp_payment(payment_id)
+            await order_cache().aset(cache_key, payment_data, ttl)
+        return payment_data
+
+    return await _mp_status_cache().aget_or_call(str(payment_id), load)
+
+
+def _remember_mp_payment(payment_id, payment_data):
+    ttl = _mp_status_cache_seconds()
+    if ttl:
+        order_cache().set(_mp_payment_cache_key(payment_id), payment_data, ttl)
+    _mp_status_cache().invalidate(str(payment_id))
+
+
+def _search_mp_payments(params):
+    return _mp_api_request('GET', f'/v1/payments/search?{urlencode(params)}')
+
+
+def _mark_payment_reconciler_alive(seconds):
+    cache.set(MP_RECONCILER_HEARTBEAT_KEY, time.time(), max(1, int(seconds)))
+
+
+def _payment_reconciler_active():
+    # Com o reconcile_payments rodando, o polling do navegador le so o banco.
+    return cache.get(MP_RECONCILER_HEARTBEAT_KEY) is not None
+
+
+@transaction.atomic
 def _sync_order_from_mp_payment(order, payment_data):
+    update_fields = []
+    attempt = _sync_payment_attempt(order, payment_data)
+    if attempt is not None and attempt.id != order.current_payment_id:
+        # Aviso de outra tentativa do pedido (ex.: Pix antigo expirando) so
+        # substitui a atual quando foi aprovado.
+        if order.current_payment_id and attempt.status != 'approved':
+            return
+        order.current_payment = attempt
+        update_fields.append('current_payment')
+    update_fields.extend(_apply_mp_payment_fields(order, payment_data))
+    if update_fields:
+        order.save(update_fields=update_fields)
+
+    if order.is_paid and not order.whatsapp_notified:
+        _queue_whatsapp_notifications_for_order(order)
+
+
+async def _async_order_from_mp_payment(order, payment_data):
+    await sync_to_async(_sync_order_from_mp_payment)(order, payment_data)
+
+
+def _sync_payment_attempt(order, payment_data):
+    payment_id = str(payment_data.get('id') or '')
+    if not payment_id:
+        return None
+    attempt = order.current_payment if order.current_payment_id else None
+    if attempt is None or attempt.payment_id != payment_id:
+        attempt = PaymentAttempt.objects.filter(order=order, payment_id=payment_id).first()
+    values = {
+        'status': (payment_data.get('status') or '').lower(),
+        'status_detail': payment_data.get('status_detail') or '',
+    }
+    if payment_data.get('external_reference'):
+        values['external_reference'] = payment_data['external_reference']
+    if attempt is None:
+        tx_data = (payment_data.get('point_of_interaction') or {}).get('transaction_data') or {}
+        return PaymentAttempt.objects.create(
+            order=order,
+            payment_id=payment_id,
+            pix_code=tx_data.get('qr_code') or '',
+            **values,
+        )
+
+    changed = [field for field, value in values.items() if getattr(attempt, field) != value]
+    if changed:
+        for field in changed:
+            setattr(attempt, field, values[field])
+        attempt.save(update_fields=[*changed, 'updated_at'])
+    return attempt
+
+
+def _apply_mp_payment_fields(order, payment_data):
     status = (payment_data.get('status') or '').lower()
     status_detail = payment_data.get('status_detail') or ''
-    payment_id = str(payment_data.get('id') or '')
-    external_reference = payment_data.get('external_reference') or order.mp_external_reference
 
     update_fields = []
-    if payment_id and payment_id != order.mp_payment_id:
-        order.mp_payment_id = payment_id
-        update_fields.append('mp_payment_id')
-    if external_reference and external_reference != order.mp_external_reference:
-        order.mp_external_reference = external_reference
-        update_fields.append('mp_external_reference')
     if status != order.mp_status:
         order.mp_status = status
         update_fields.append('mp_status')
@@ -645,12 +1495,7 @@ def _sync_order_from_mp_payment(order, payment_data):
         order.is_paid = False
         order.paid_at = None
         update_fields.extend(['is_paid', 'paid_at'])
-
-    if update_fields:
-        order.save(update_fields=update_fields)
-
-    if order.is_paid and not order.whatsapp_notified:
-        _send_whatsapp_notifications_for_order(order)
+    return update_fields
 
 
 def _is_valid_mp_webhook_signature(request, payment_id):
@@ -702,12 +1547,16 @@ def _extract_webhook_payment_id(request):
 def _order_status_label(order):
     if order.is_paid:
         return 'Pagamento aprovado'
+    if order.mp_status == 'pending' and order.mp_status_detail == PIX_LOCAL_DETAIL:
+        return 'Aguardando confirmacao do Pix'
     status_map = {
         'pending': 'Aguardando pagamento',
         'in_process': 'Processando pagamento',
         'approved_manual': 'Pagamento aprovado',
         'rejected': 'Pagamento recusado',
         'cancelled': 'Pagamento cancelado',
+        PIX_STATUS_CREATING: 'Gerando Pix',
+        PIX_STATUS_FAILED: 'Falha ao gerar Pix',
     }
     return status_map.get(order.mp_status, 'Aguardando pagamento')
 
@@ -866,23 +1715,41 @@ def _wrap_report_label(text, max_chars=22):
 
 
 @require_GET
+@cache_control(public=True, max_age=STOREFRONT_CACHE_SECONDS)
+@condition(etag_func=_storefront_etag)
 def home(request):
-    products = Product.objects.filter(active=True).prefetch_related('variants')
-    for product in products:
-        product.active_variants = [variant for variant in product.variants.all() if variant.active]
-        product.display_price = product.price
-    cart = _get_cart(request.session)
-    cart_payload = _build_cart_payload(cart)
+    # Nao toca em request.session/request.user: a mesma resposta serve qualquer
+    # visitante e pode ficar no cache do nginx. Carrinho e login vem do cart_state.
+    products = get_catalog_snapshot()['active_products']
     return render(
         request,
         'shop/home.html',
         {
             'products': products,
-            'cart': cart_payload,
+            'cart_cookie_name': CART_COOKIE_NAME,
+            'staff_cookie_name': STAFF_COOKIE_NAME,
+            'csrf_cookie_name': settings.CSRF_COOKIE_NAME,
         },
     )
 
 
+@never_cache
+@require_GET
+def cart_state(request):
+    cart = _get_cart(request)
+    response = JsonResponse(
+        {
+            'cart': _build_cart_payload(cart),
+            'csrf_token': get_token(request),
+            'is_authenticated': request.user.is_authenticated,
+        }
+    )
+    try:
+        return _save_cart(request, response, cart)
+    except CartTooLargeError:
+        return response
+
+
 @require_POST
 def auth_login(request):
     username = request.POST.get('username', '').strip()
@@ -893,7 +1760,7 @@ def auth_login(request):
         return JsonResponse({'error': 'UsuÃ¡rio ou senha invÃ¡lidos.'}, status=400)
 
     login(request, user)
-    return JsonResponse(
+    response = JsonResponse(
         {
             'message': 'Login realizado com sucesso.',
             'user': {
@@ -902,12 +1769,16 @@ def auth_login(request):
             },
         }
     )
+    response.set_cookie(STAFF_COOKIE_NAME, '1', max_age=settings.SESSION_COOKIE_AGE, samesite='Lax')
+    return response
 
 
 @require_POST
 def auth_logout(request):
     logout(request)
-    return JsonResponse({'message': 'Logout realizado com sucesso.'})
+    response = JsonResponse({'message': 'Logout realizado com sucesso.'})
+    response.delete_cookie(STAFF_COOKIE_NAME, samesite='Lax')
+    return response
 
 
 @login_required
@@ -920,15 +1791,20 @@ def manage_products_page(request):
     edit_id = request.GET.get('edit')
     editing_product = None
     editing_variants_text = ''
-    orders = Order.objects.all().order_by('-created_at')
+    orders = Order.objects.only(*ORDER_LIST_FIELDS, 'items_json', 'delivered_at').order_by('-created_at')
     costs = CostEntry.objects.all().order_by('-created_at')[:120]
     total_costs = CostEntry.objects.aggregate(total=Sum('amount')).get('total') or Decimal('0.00')
     donations = DonationEntry.objects.all().order_by('-created_at')[:120]
     total_donations = DonationEntry.objects.aggregate(total=Sum('amount')).get('total') or Decimal('0.00')
     whatsapp_recipients = WhatsAppRecipient.objects.all().order_by('name')
+    whatsapp_deliveries = WhatsAppOutbox.objects.exclude(status=WhatsAppOutbox.STATUS_SENT).order_by('-id')[:100]
+    whatsapp_delivery_counts = dict(
+        WhatsAppOutbox.objects.values_list('status').annotate(total=Count('id')).order_by()
+    )
     users = User.objects.all().order_by('username')
     print_order_id = request.session.pop('print_order_id', None)
     print_order_scope = request.session.pop('print_order_scope', '')
+    notify_ready_batch = request.session.get(NOTIFY_READY_BATCH_SESSION_KEY)
     orders = [_decorate_order_for_delivery(order) for order in orders]
     if edit_id:
         editing_product = get_object_or_404(Product, id=edit_id)
@@ -952,10 +1828,15 @@ def manage_products_page(request):
             'donations': donations,
             'total_donations': total_donations,
             'whatsapp_recipients': whatsapp_recipients,
+            'whatsapp_deliveries': whatsapp_deliveries,
+            'whatsapp_delivery_counts': whatsapp_delivery_counts,
+            'whatsapp_digest_window': int(_wapi_digest_window_seconds()),
+            'notify_ready_progress': _notify_ready_batch_progress(notify_ready_batch) if notify_ready_batch else None,
             'users': users,
             'print_order_id': print_order_id,
             'print_order_scope': print_order_scope,
             'print_order_template_url': reverse('manage_order_print_page', args=[0]),
+            'mp_breaker': _mp_circuit_breaker().snapshot(),
         },
     )
 
@@ -964,14 +1845,13 @@ def manage_products_page(request):
 @user_passes_test(_can_manage)
 @require_GET
 def manage_sales_page(request):
-    products = Product.objects.filter(active=True).prefetch_related('variants').order_by('name')
-    for product in products:
-        product.active_variants = [variant for variant in product.variants.all() if variant.active]
+    products = get_catalog_snapshot()['active_products']
     return render(
         request,
         'shop/manage_sales.html',
         {
             'products': products,
+            'pix_local_available': bool(_pix_key()),
         },
     )
 
@@ -982,8 +1862,10 @@ def manage_sales_page(request):
 def manage_reports_page(request):
     orders = Order.objects.all()
     paid_orders = orders.filter(is_paid=True)
-    recent_orders = orders.order_by('-created_at')[:120]
-    delivered_orders = orders.filter(is_delivered=True).order_by('-delivered_at', '-id')[:80]
+    recent_orders = orders.only(*ORDER_LIST_FIELDS).order_by('-created_at')[:120]
+    delivered_orders = (
+        orders.filter(is_delivered=True).only(*ORDER_LIST_FIELDS, 'delivered_at').order_by('-delivered_at', '-id')[:80]
+    )
     total_costs = CostEntry.objects.aggregate(total=Sum('amount')).get('total') or Decimal('0.00')
     total_donations = DonationEntry.objects.aggregate(total=Sum('amount')).get('total') or Decimal('0.00')
     total_orders = orders.count()
@@ -1023,7 +1905,7 @@ def manage_reports_page(request):
     chart_payment_totals = [float(row['total'] or 0) for row in payment_rows]
 
     product_counter = {}
-    for order in paid_orders:
+    for order in paid_orders.only('items_json'):
         for item in order.items_json or []:
             name = (item.get('name') or '').strip() or 'Item'
             try:
@@ -1104,7 +1986,7 @@ def manage_reports_export_pdf(request):
         return JsonResponse({'error': f'Dependencia de PDF indisponivel: {exc}'}, status=500)
 
     try:
-        orders = Order.objects.all().order_by('-created_at')
+        orders = Order.objects.only(*ORDER_LIST_FIELDS).order_by('-created_at')
         paid_orders = orders.filter(is_paid=True)
         costs = CostEntry.objects.all().order_by('-created_at')
         donations = DonationEntry.objects.all().order_by('-created_at')
@@ -1118,7 +2000,7 @@ def manage_reports_export_pdf(request):
         average_ticket = paid_orders.aggregate(avg=Avg('total')).get('avg') or Decimal('0.00')
 
         product_counter = {}
-        for order in paid_orders:
+        for order in paid_orders.only('items_json'):
             for item in order.items_json or []:
                 name = (item.get('name') or '').strip() or 'Item'
                 try:
@@ -1560,6 +2442,7 @@ def manage_audit_page(request):
     error_logs = sum(1 for log in logs if log.status_code >= 400)
     write_logs = sum(1 for log in logs if log.method in {'POST', 'PUT', 'PATCH', 'DELETE'})
     unique_users = len({log.user_id for log in logs if log.user_id})
+    catalog_stats = catalog_snapshot_stats()
 
     return render(
         request,
@@ -1573,6 +2456,17 @@ def manage_audit_page(request):
             'error_logs': error_logs,
             'write_logs': write_logs,
             'unique_users': unique_users,
+            'catalog_stats': catalog_stats,
+            'mp_breaker': _mp_circuit_breaker().snapshot(),
+            'mp_status_cache': _mp_status_cache().snapshot(),
+            'order_status_hub': get_order_status_hub().snapshot(),
+            'checkout_admission': _checkout_admission().snapshot(),
+            'wapi_limiter': _wapi_rate_limiter().snapshot(),
+            'whatsapp_latency': _whatsapp_latency_stats(),
+            'audit_buffer': audit_log_buffer().snapshot() if settings.SHOP_AUDIT_LOG_BUFFER else None,
+            'whatsapp_outbox': dict(
+                WhatsAppOutbox.objects.values_list('status').annotate(total=Count('id')).order_by()
+            ),
         },
     )
 
@@ -1598,9 +2492,14 @@ def manage_sales_create_order(request):
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Carrinho invalido para venda.'}, status=400)
 
-    order_items, total, error_text = _build_order_items_from_payload(items_payload)
+    order_items, total, error_text = _build_order_items_from_payload(items_payload, authoritative=True)
     if error_text:
         return JsonResponse({'error': error_text}, status=400)
+    use_local_pix = request.POST.get('pix_provider', '').strip().lower() == 'local'
+    if payment_method == Order.PAYMENT_PIX and not use_local_pix and not _mp_circuit_breaker().is_available():
+        if not _pix_local_fallback_enabled():
+            return _mp_unavailable_response()
+        use_local_pix = True
 
     parts = customer_name.split()
     first_name = parts[0]
@@ -1612,7 +2511,6 @@ def manage_sales_create_order(request):
         whatsapp=whatsapp_raw,
         payment_method=payment_method,
         total=total,
-        pix_code='',
         items_json=order_items,
         mp_status='pending',
         created_by_staff=True,
@@ -1620,31 +2518,26 @@ def manage_sales_create_order(request):
 
     if payment_method == Order.PAYMENT_PIX:
         try:
-            pix_payload = _create_mp_pix_payment(order)
+            pix_payload = _create_order_pix_payment(order, local=use_local_pix)
         except ValueError as exc:
             order.delete()
-            return JsonResponse({'error': str(exc)}, status=400)
-
-        order.pix_code = pix_payload['pix_code']
-        order.mp_payment_id = pix_payload['payment_id']
-        order.mp_external_reference = pix_payload['external_reference']
-        order.mp_status = (pix_payload['status'] or 'pending').lower()
-        order.mp_status_detail = pix_payload['status_detail']
-        if order.mp_status == 'approved':
-            order.is_paid = True
-            order.paid_at = timezone.now()
-        order.save()
-        if order.is_paid and not order.whatsapp_notified:
-            _send_whatsapp_notifications_for_order(order)
+            return JsonResponse({'error': str(exc)}, status=503 if isinstance(exc, CircuitOpenError) else 400)
+
+        _apply_pix_payload(order, pix_payload)
 
         return JsonResponse(
             {
-                'message': f'Venda #{order.id} criada. Pix gerado.',
+                'message': (
+                    f'Venda #{order.id} criada. Pix pela chave: confira no banco e marque como pago.'
+                    if order.mp_status_detail == PIX_LOCAL_DETAIL
+                    else f'Venda #{order.id} criada. Pix gerado.'
+                ),
                 'order_id': order.id,
                 'is_paid': order.is_paid,
                 'status_label': _order_status_label(order),
-                'qr_code_base64': pix_payload['qr_base64'],
+                'qr_code_url': _build_pix_qr_url(order),
                 'pix_code': pix_payload['pix_code'],
+                'pix_local': order.mp_status_detail == PIX_LOCAL_DETAIL,
                 'total': f'{order.total:.2f}',
             }
         )
@@ -1653,9 +2546,10 @@ def manage_sales_create_order(request):
         order.is_paid = True
         order.paid_at = timezone.now()
         order.mp_status = 'approved_manual'
-        order.save(update_fields=['is_paid', 'paid_at', 'mp_status'])
-        if not order.whatsapp_notified:
-            _send_whatsapp_notifications_for_order(order)
+        with transaction.atomic():
+            order.save(update_fields=['is_paid', 'paid_at', 'mp_status'])
+            if not order.whatsapp_notified:
+                _queue_whatsapp_notifications_for_order(order)
 
     return JsonResponse(
         {
@@ -1678,14 +2572,14 @@ def manage_sales_mark_paid(request, order_id):
 
     order.is_paid = True
     order.paid_at = timezone.now()
-    if order.mp_status in {'', 'pending'}:
-        order.mp_status = 'approved_manual'
-        order.save(update_fields=['is_paid', 'paid_at', 'mp_status'])
-    else:
-        order.save(update_fields=['is_paid', 'paid_at'])
-
-    if not order.whatsapp_notified:
-        _send_whatsapp_notifications_for_order(order)
+    with transaction.atomic():
+        if order.mp_status in {'', 'pending'}:
+            order.mp_status = 'approved_manual'
+            order.save(update_fields=['is_paid', 'paid_at', 'mp_status'])
+        else:
+            order.save(update_fields=['is_paid', 'paid_at'])
+        if not order.whatsapp_notified:
+            _queue_whatsapp_notifications_for_order(order)
 
     return JsonResponse({'message': f'Venda #{order.id} marcada como paga.', 'order_id': order.id, 'is_paid': True})
 
@@ -1824,6 +2718,7 @@ def manage_orders_mark_all_paid_page(request):
     now = timezone.now()
     updated_count = Order.objects.filter(id__in=unpaid_ids).update(is_paid=True, paid_at=now)
     Order.objects.filter(id__in=unpaid_ids, mp_status__in=['', 'pending']).update(mp_status='approved_manual')
+    publish_order_statuses(unpaid_ids)
 
     messages.success(request, f'{updated_count} pedido(s) marcado(s) como pago(s).')
     return _redirect_manage_products_page(request, default_tab='secao-pedidos')
@@ -1869,14 +2764,14 @@ def manage_order_mark_paid_page(request, order_id):
 
     order.is_paid = True
     order.paid_at = timezone.now()
-    if order.mp_status in {'', 'pending', 'in_process'}:
-        order.mp_status = 'approved_manual'
-        order.save(update_fields=['is_paid', 'paid_at', 'mp_status'])
-    else:
-        order.save(update_fields=['is_paid', 'paid_at'])
-
-    if not order.whatsapp_notified:
-        _send_whatsapp_notifications_for_order(order)
+    with transaction.atomic():
+        if order.mp_status in {'', 'pending', 'in_process'}:
+            order.mp_status = 'approved_manual'
+            order.save(update_fields=['is_paid', 'paid_at', 'mp_status'])
+        else:
+            order.save(update_fields=['is_paid', 'paid_at'])
+        if not order.whatsapp_notified:
+            _queue_whatsapp_notifications_for_order(order)
 
     messages.success(request, f'Pedido #{order.id} marcado como pago.')
     return _redirect_manage_products_page(request, default_tab='secao-pedidos')
@@ -1887,22 +2782,46 @@ def manage_order_mark_paid_page(request, order_id):
 @require_POST
 def manage_order_notify_ready_page(request, order_id):
     order = get_object_or_404(Order, id=order_id)
-    phone = _normalize_whatsapp_phone(order.whatsapp)
-    if not phone:
+    with transaction.atomic():
+        queued, _ = _queue_ready_whatsapp([order])
+    if not queued:
         messages.error(request, f'Pedido #{order.id} sem WhatsApp valido para notificacao.')
         return _redirect_manage_products_page(request, default_tab='secao-pedidos')
 
-    message = _build_order_ready_whatsapp_message(order)
-    try:
-        _wapi_send_text(phone, message)
-    except ValueError as exc:
-        messages.error(request, f'Falha ao enviar WhatsApp do pedido #{order.id}: {exc}')
+    request.session[NOTIFY_READY_BATCH_SESSION_KEY] = {'order_ids': queued, 'skipped': []}
+    messages.success(request, f'Notificacao de pedido pronto na fila para #{order.id}.')
+    return _redirect_manage_products_page(request, default_tab='secao-pedidos')
+
+
+@login_required
+@user_passes_test(_can_manage)
+@require_POST
+def manage_orders_notify_ready_bulk_page(request):
+    order_ids = [int(value) for value in request.POST.getlist('order_ids') if value.isdigit()]
+    orders = list(Order.objects.filter(id__in=order_ids).only('id', 'first_name', 'whatsapp').order_by('id'))
+    if not orders:
+        messages.info(request, 'Selecione ao menos um pedido para avisar.')
         return _redirect_manage_products_page(request, default_tab='secao-pedidos')
 
-    messages.success(request, f'Notificacao de pedido pronto enviada para #{order.id}.')
+    with transaction.atomic():
+        queued, skipped = _queue_ready_whatsapp(orders)
+    request.session[NOTIFY_READY_BATCH_SESSION_KEY] = {'order_ids': queued, 'skipped': skipped}
+    messages.success(request, f'{len(queued)} aviso(s) de pedido pronto na fila.')
+    if skipped:
+        messages.error(request, f"Sem WhatsApp valido: {', '.join(f'#{order_id}' for order_id in skipped)}.")
     return _redirect_manage_products_page(request, default_tab='secao-pedidos')
 
 
+@login_required
+@user_passes_test(_can_manage)
+@require_GET
+def manage_orders_notify_ready_status(request):
+    batch = request.session.get(NOTIFY_READY_BATCH_SESSION_KEY)
+    if not batch:
+        return JsonResponse({'error': 'Nenhum lote de avisos em andamento.'}, status=404)
+    return JsonResponse(_notify_ready_batch_progress(batch))
+
+
 @login_required
 @user_passes_test(_can_manage)
 @require_POST
@@ -1936,7 +2855,6 @@ def manage_order_manual_create_page(request):
         whatsapp='Lancamento interno',
         payment_method=Order.PAYMENT_PIX,
         total=amount,
-        pix_code='',
         mp_status='approved_manual',
         is_paid=True,
         paid_at=timezone.now(),
@@ -2132,16 +3050,18 @@ def manage_whatsapp_recipient_create_page(request):
         messages.error(request, 'Informe nome e WhatsApp validos para cadastrar.')
         return _redirect_manage_products_page(request, default_tab='secao-whatsapp')
 
+    digest = request.POST.get('digest') == '1'
     recipient, created = WhatsAppRecipient.objects.get_or_create(
         phone=phone,
-        defaults={'name': name, 'active': True},
+        defaults={'name': name, 'active': True, 'digest': digest},
     )
     if created:
         messages.success(request, f'Contato WhatsApp "{name}" cadastrado.')
     else:
         recipient.name = name
         recipient.active = True
-        recipient.save(update_fields=['name', 'active'])
+        recipient.digest = digest
+        recipient.save(update_fields=['name', 'active', 'digest'])
         messages.success(request, f'Contato WhatsApp "{name}" atualizado.')
     return _redirect_manage_products_page(request, default_tab='secao-whatsapp')
 
@@ -2156,13 +3076,29 @@ def manage_whatsapp_recipient_delete_page(request, recipient_id):
     return _redirect_manage_products_page(request, default_tab='secao-whatsapp')
 
 
+@login_required
+@user_passes_test(_can_manage)
+@require_POST
+def manage_whatsapp_retry_failed_page(request):
+    delivery_ids = [int(value) for value in request.POST.getlist('delivery_ids') if value.isdigit()]
+    with transaction.atomic():
+        retried = _retry_whatsapp_deliveries(delivery_ids)
+        if retried:
+            _schedule_whatsapp_drain()
+    if retried:
+        messages.success(request, f'{retried} mensagem(ns) de WhatsApp de volta na fila.')
+    else:
+        messages.info(request, 'Nenhuma mensagem com falha para reenviar.')
+    return _redirect_manage_products_page(request, default_tab='secao-whatsapp')
+
+
 @require_GET
 def product_manage_list(request):
     guard = _staff_guard(request)
     if guard:
         return guard
 
-    products = Product.objects.all().order_by('name')
+    products = get_catalog_snapshot()['products']
     return JsonResponse({'products': [_product_payload(product) for product in products]})
 
 
@@ -2194,66 +3130,96 @@ def product_manage_delete(request, product_id):
 
 @require_POST
 def cart_add(request, product_id):
-    product = get_object_or_404(Product, id=product_id, active=True)
+    product = _get_indexed_product_or_404(product_id)
     variant_id = request.POST.get('variant_id')
     variant = None
     if variant_id:
         try:
-            variant = ProductVariant.objects.get(id=int(variant_id), product=product, active=True)
-        except (ProductVariant.DoesNotExist, ValueError, TypeError):
+            variant = product['variants'][int(variant_id)]
+        except (KeyError, ValueError, TypeError):
             return JsonResponse({'error': 'VariaÃ§Ã£o invÃ¡lida para este produto.'}, status=400)
 
     try:
         quantity = int(request.POST.get('quantity', 1))
     except (TypeError, ValueError):
         quantity = 1
-    quantity = max(1, quantity)
-    cart = _get_cart(request.session)
-    key = _cart_item_key(product.id, variant.id if variant else None)
-    cart[key] = cart.get(key, 0) + quantity
-    request.session.modified = True
-    payload = _build_cart_payload(cart)
-    return JsonResponse(payload)
+    cart = _get_cart(request)
+    key = _cart_item_key(product['id'], variant['id'] if variant else None)
+    _apply_cart_action(cart, key, 'add', quantity)
+    try:
+        return _save_cart(request, JsonResponse(_build_cart_payload(cart)), cart)
+    except CartTooLargeError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
 
 
 @require_POST
 def cart_update(request, product_id):
-    product = get_object_or_404(Product, id=product_id, active=True)
+    product = _get_indexed_product_or_404(product_id)
     variant_id = request.POST.get('variant_id')
     variant = None
     if variant_id:
         try:
-            variant = ProductVariant.objects.get(id=int(variant_id), product=product, active=True)
-        except (ProductVariant.DoesNotExist, ValueError, TypeError):
+            variant = product['variants'][int(variant_id)]
+        except (KeyError, ValueError, TypeError):
             return JsonResponse({'error': 'VariaÃ§Ã£o invÃ¡lida para este produto.'}, status=400)
 
     action = request.POST.get('action', 'set')
-    cart = _get_cart(request.session)
-    key = _cart_item_key(product.id, variant.id if variant else None)
-    current = int(cart.get(key, 0))
+    if action not in {'inc', 'dec'}:
+        action = 'set'
+    try:
+        quantity = int(request.POST.get('quantity', 1))
+    except (TypeError, ValueError):
+        quantity = 1
+    cart = _get_cart(request)
+    key = _cart_item_key(product['id'], variant['id'] if variant else None)
+    _apply_cart_action(cart, key, action, quantity)
 
-    if action == 'inc':
-        current += 1
-    elif action == 'dec':
-        current -= 1
-    else:
-        try:
-            current = int(request.POST.get('quantity', 1))
-        except (TypeError, ValueError):
-            current = 1
+    try:
+        return _save_cart(request, JsonResponse(_build_cart_payload(cart)), cart)
+    except CartTooLargeError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
 
-    if current <= 0:
-        cart.pop(key, None)
-    else:
-        cart[key] = current
 
-    request.session.modified = True
-    payload = _build_cart_payload(cart)
-    return JsonResponse(payload)
+@require_POST
+def cart_batch(request):
+    # Varios toques de +/- do app.js em uma unica requisicao: valida todas as
+    # operacoes antes de gravar; qualquer erro descarta o lote inteiro.
+    try:
+        operations = json.loads(request.POST.get('operations', '') or '[]')
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Operacoes invalidas para o carrinho.'}, status=400)
+    if not isinstance(operations, list) or len(operations) > CART_BATCH_MAX_OPERATIONS:
+        return JsonResponse({'error': 'Operacoes invalidas para o carrinho.'}, status=400)
 
+    price_index = get_price_index() if operations else {}
+    cart = _get_cart(request)
+    for raw in operations:
+        try:
+            action = str(raw.get('action') or '').strip().lower()
+            product_id = int(raw.get('product_id'))
+            variant_id = raw.get('variant_id')
+            variant_id = int(variant_id) if variant_id not in (None, '', 0, '0') else None
+            quantity = int(raw.get('quantity', 1))
+        except (TypeError, ValueError, AttributeError):
+            return JsonResponse({'error': 'Operacao invalida no carrinho.'}, status=400)
+        if action not in CART_BATCH_ACTIONS:
+            return JsonResponse({'error': 'Operacao invalida no carrinho.'}, status=400)
+
+        product = price_index.get(product_id)
+        if not product:
+            return JsonResponse({'error': f'Produto {product_id} nao encontrado ou inativo.'}, status=400)
+        if variant_id and variant_id not in product['variants']:
+            return JsonResponse({'error': f"Variacao invalida para {product['name']}."}, status=400)
+        _apply_cart_action(cart, _cart_item_key(product_id, variant_id), action, quantity)
 
-@require_POST
-def checkout_finalize(request):
+    try:
+        return _save_cart(request, JsonResponse(_build_cart_payload(cart)), cart)
+    except CartTooLargeError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+
+
+def _create_checkout_order(request):
+    # Valida o formulario e grava o pedido; devolve JsonResponse em caso de erro.
     first_name = request.POST.get('first_name', '').strip()
     last_name = request.POST.get('last_name', '').strip()
     whatsapp = request.POST.get('whatsapp', '').strip()
@@ -2265,42 +3231,154 @@ def checkout_finalize(request):
     if payment_method != Order.PAYMENT_PIX:
         return JsonResponse({'error': 'Selecione a forma de pagamento Pix.'}, status=400)
 
-    cart = _get_cart(request.session)
-    cart_payload = _build_cart_payload(cart)
+    cart = _get_cart(request)
+    cart_payload = _build_cart_payload(cart, authoritative=True)
     if cart_payload['count'] <= 0:
         return JsonResponse({'error': 'Seu carrinho estÃ¡ vazio.'}, status=400)
 
+    checkout_key = _checkout_idempotency_key(
+        request, cart_payload, [first_name, last_name, whatsapp, payment_method]
+    )
+    existing = _checkout_order_by_key(checkout_key)
+    if existing is not None:
+        if existing.created_at >= timezone.now() - timedelta(seconds=_checkout_idempotency_seconds()):
+            return _checkout_duplicate_response(request, existing)
+        # Fora da janela: e uma compra nova com o mesmo carrinho.
+        Order.objects.filter(id=existing.id).update(checkout_key='')
+
+    use_local_pix = not _mp_circuit_breaker().is_available()
+    if use_local_pix and not _pix_local_fallback_enabled():
+        return _mp_unavailable_response()
+
     amount = Decimal(cart_payload['total'])
-    order = Order.objects.create(
-        first_name=first_name,
-        last_name=last_name,
-        whatsapp=whatsapp,
-        payment_method=payment_method,
-        total=amount,
-        pix_code='',
-        items_json=cart_payload['items'],
-        mp_status='pending',
+    pix_async = _pix_async_enabled() and not use_local_pix
+    try:
+        with transaction.atomic():
+            order = Order.objects.create(
+                first_name=first_name,
+                last_name=last_name,
+                whatsapp=whatsapp,
+                payment_method=payment_method,
+                total=amount,
+                items_json=cart_payload['items'],
+                mp_status=PIX_STATUS_CREATING if pix_async else 'pending',
+                checkout_key=checkout_key,
+            )
+    except IntegrityError:
+        # Envio simultaneo com a mesma chave: o outro gravou primeiro.
+        existing = _checkout_order_by_key(checkout_key)
+        if existing is None:
+            return JsonResponse({'error': 'Pedido em processamento. Tente novamente.'}, status=409)
+        return _checkout_duplicate_response(request, existing)
+    return order, use_local_pix, pix_async
+
+
+def _checkout_idempotency_key(request, cart_payload, fields):
+    # Chave do app.js (uma por envio do formulario) ou, sem ela, o cookie do
+    # carrinho (assinado com a hora da ultima alteracao) ou a sessao. Carrinho e
+    # formulario entram sempre: mudar o pedido gera outra chave.
+    client_key = request.POST.get('idempotency_key', '').strip()[:100]
+    if client_key:
+        origin = f'client:{client_key}'
+    elif request.COOKIES.get(CART_COOKIE_NAME):
+        origin = f'cart:{request.COOKIES[CART_COOKIE_NAME]}'
+    else:
+        origin = f"session:{request.session.session_key or ''}"
+    raw = json.dumps([origin, cart_payload['items'], fields], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _checkout_order_by_key(checkout_key):
+    # exclude(''): mesma condicao do indice parcial unique_order_checkout_key.
+    return (
+        Order.objects.select_related('current_payment')
+        .exclude(checkout_key='')
+        .filter(checkout_key=checkout_key)
+        .first()
     )
 
+
+def _checkout_duplicate_response(request, order):
+    # Mesmo pedido e mesmo QR do primeiro envio, sem chamar o MP de novo. Se o
+    # primeiro ainda esta criando o Pix, o app.js espera pela consulta de status.
+    pix_code = order.pix_code
+    waiting = not pix_code and not order.is_paid and order.mp_status not in ORDER_STATUS_FINAL
+    return _checkout_finalize_response(request, order, {'pix_code': pix_code}, waiting)
+
+
+def _pix_creation_error_response(exc):
+    return JsonResponse({'error': str(exc)}, status=503 if isinstance(exc, CircuitOpenError) else 400)
+
+
+@require_POST
+def checkout_finalize(request):
+    admission = _checkout_admission()
+    admitted = admission.try_acquire()
+    if not admitted.admitted:
+        return _checkout_busy_response(admitted)
+    started_at = time.monotonic()
     try:
-        pix_payload = _create_mp_pix_payment(order)
-    except ValueError as exc:
-        order.delete()
-        return JsonResponse({'error': str(exc)}, status=400)
+        return _checkout_finalize(request)
+    finally:
+        admission.release(time.monotonic() - started_at)
 
-    order.pix_code = pix_payload['pix_code']
-    order.mp_payment_id = pix_payload['payment_id']
-    order.mp_external_reference = pix_payload['external_reference']
-    order.mp_status = (pix_payload['status'] or 'pending').lower()
-    order.mp_status_detail = pix_payload['status_detail']
-    if order.mp_status == 'approved':
-        order.is_paid = True
-        order.paid_at = timezone.now()
-    order.save()
-    if order.is_paid and not order.whatsapp_notified:
-        _send_whatsapp_notifications_for_order(order)
 
-    request.session['cart'] = {}
+def _checkout_finalize(request):
+    created = _create_checkout_order(request)
+    if isinstance(created, HttpResponse):
+        return created
+    order, use_local_pix, pix_async = created
+
+    if pix_async:
+        transaction.on_commit(partial(submit_background, _create_pix_charge_for_order, order.id))
+        pix_payload = {'pix_code': ''}
+    else:
+        try:
+            pix_payload = _create_order_pix_payment(order, local=use_local_pix)
+        except ValueError as exc:
+            order.delete()
+            return _pix_creation_error_response(exc)
+        _apply_pix_payload(order, pix_payload)
+
+    return _checkout_finalize_response(request, order, pix_payload, pix_async)
+
+
+@require_POST
+async def checkout_finalize_async(request):
+    admission = _checkout_admission()
+    admitted = admission.try_acquire()
+    if not admitted.admitted:
+        return _checkout_busy_response(admitted)
+    started_at = time.monotonic()
+    try:
+        return await _acheckout_finalize(request)
+    finally:
+        admission.release(time.monotonic() - started_at)
+
+
+async def _acheckout_finalize(request):
+    # Carrinho, sessao e gravacao continuam sync (numa thread); a cobranca no MP
+    # usa o cliente asyncio e, com MP_PIX_ASYNC, vira tarefa no event loop.
+    created = await sync_to_async(_create_checkout_order)(request)
+    if isinstance(created, HttpResponse):
+        return created
+    order, use_local_pix, pix_async = created
+
+    if pix_async:
+        spawn_async(_acreate_pix_charge_for_order(order.id))
+        pix_payload = {'pix_code': ''}
+    else:
+        try:
+            pix_payload = await _acreate_order_pix_payment(order, local=use_local_pix)
+        except ValueError as exc:
+            await order.adelete()
+            return _pix_creation_error_response(exc)
+        await sync_to_async(_apply_pix_payload)(order, pix_payload)
+
+    return await sync_to_async(_checkout_finalize_response)(request, order, pix_payload, pix_async)
+
+
+def _checkout_finalize_response(request, order, pix_payload, pix_async):
     request.session['last_public_print_order_id'] = order.id
     request.session.modified = True
 
@@ -2313,42 +3391,199 @@ def checkout_finalize(request):
     print_token = _build_public_print_token(order.id)
     print_url = f"{reverse('order_print_public_page', args=[order.id])}?token={print_token}&copy=kitchen"
 
-    return JsonResponse(
+    cart_payload = _build_cart_payload({})
+    response = JsonResponse(
         {
-            'message': 'Pedido gerado com sucesso. FaÃ§a o pagamento no Pix.',
+            'message': (
+                'Pedido gerado. Estamos gerando o Pix.'
+                if pix_async
+                else 'Pedido gerado com sucesso. FaÃ§a o pagamento no Pix.'
+            ),
             'order_id': order.id,
-            'order_status': order.mp_status,
+            'order_status': PIX_STATUS_CREATING if pix_async else order.mp_status,
             'status_label': _order_status_label(order),
-            'qr_code_base64': pix_payload['qr_base64'],
+            'qr_code_url': _build_pix_qr_url(order),
             'pix_code': pix_payload['pix_code'],
             'order_summary': order_summary,
             'print_url': print_url,
-            'cart': _build_cart_payload(request.session['cart']),
+            'cart': cart_payload,
         }
     )
+    return _save_cart(request, response, {})
 
 
 @require_GET
 def checkout_status(request, order_id):
-    order = get_object_or_404(Order, id=order_id)
+    version = get_order_status_hub().current_version(order_id)
+    order = get_object_or_404(Order.objects.select_related('current_payment'), id=order_id)
+    _refresh_order_from_mp(order)
+    return JsonResponse(_order_status_payload(order, bool(request.GET.get('pix')), version))
 
-    if order.mp_payment_id and not order.is_paid and order.mp_status in {'pending', 'in_process'}:
-        try:
-            payment_data = _get_mp_payment(order.mp_payment_id)
-            _sync_order_from_mp_payment(order, payment_data)
-            order.refresh_from_db()
-        except ValueError:
-            pass
 
-    return JsonResponse(
-        {
-            'order_id': order.id,
-            'is_paid': order.is_paid,
-            'status': order.mp_status,
-            'status_detail': order.mp_status_detail,
-            'status_label': _order_status_label(order),
-        }
-    )
+@require_GET
+async def checkout_status_async(request, order_id):
+    version = await get_order_status_hub().acurrent_version(order_id)
+    order = await Order.objects.select_related('current_payment').filter(id=order_id).afirst()
+    if order is None:
+        raise Http404('Pedido nao encontrado.')
+    await _arefresh_order_from_mp(order_id, order)
+    return JsonResponse(_order_status_payload(order, bool(request.GET.get('pix')), version))
+
+
+def _order_awaits_mp(order):
+    return bool(order.mp_payment_id) and not order.is_paid and order.mp_status in {'pending', 'in_process'}
+
+
+def _refresh_order_from_mp(order):
+    # Pedido ja pago pelo webhook: vale o banco, sem consultar o MP.
+    if not _order_awaits_mp(order) or _payment_reconciler_active():
+        return
+    try:
+        payment_data = _get_mp_payment_cached(order.mp_payment_id)
+        _sync_order_from_mp_payment(order, payment_data)
+    except (ValueError, TimeoutError):
+        pass
+
+
+def _order_status_payload(order, include_pix=False, version=0):
+    payload = {
+        'order_id': order.id,
+        'is_paid': order.is_paid,
+        'status': order.mp_status,
+        'status_detail': order.mp_status_detail,
+        'status_label': _order_status_label(order),
+        'version': version,
+    }
+    # ?pix=1: o app.js ainda espera o QR do Pix criado em segundo plano.
+    pix_code = order.pix_code if include_pix else ''
+    if pix_code and not order.is_paid:
+        payload['pix_code'] = pix_code
+        payload['qr_code_url'] = _build_pix_qr_url(order)
+    return payload
+
+
+def _order_status_is_final(payload):
+    return payload['is_paid'] or payload['status'] in ORDER_STATUS_FINAL
+
+
+def _is_asgi_request(request):
+    return isinstance(request, ASGIRequest)
+
+
+async def _aorder_status_payload(order_id, include_pix):
+    # Versao lida antes do pedido: uma mudanca no meio do caminho gera outro evento.
+    version = await get_order_status_hub().acurrent_version(order_id)
+    try:
+        order = await Order.objects.select_related('current_payment').aget(id=order_id)
+    except Order.DoesNotExist:
+        raise Http404('Pedido nao encontrado.')
+    return _order_status_payload(order, include_pix, version)
+
+
+async def _arefresh_order_from_mp(order_id, order=None, asgi=True):
+    # So grava quando o status mudou; a gravacao dispara post_save ->
+    # order_events, que acorda quem esta esperando.
+    if order is None:
+        order = await Order.objects.select_related('current_payment').filter(id=order_id).afirst()
+    if order is None or not _order_awaits_mp(order):
+        return
+    if await sync_to_async(_payment_reconciler_active, thread_sensitive=False)():
+        return
+    try:
+        if asgi:
+            payment_data = await _aget_mp_payment_cached(order.mp_payment_id)
+        else:
+            # WSGI: o async_to_sync cria um loop por requisicao e o cliente
+            # async morreria com ele; vai pelo pool keep-alive sync.
+            payment_data = await sync_to_async(_get_mp_payment_cached, thread_sensitive=False)(order.mp_payment_id)
+        await _async_order_from_mp_payment(order, payment_data)
+    except (ValueError, TimeoutError):
+        pass
+
+
+def _sse_event(payload, retry_ms=None):
+    lines = []
+    if retry_ms:
+        lines.append(f'retry: {retry_ms}')
+    lines.append(f"id: {payload['version']}")
+    lines.append(f'data: {json.dumps(payload)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+async def _order_status_events(order_id, include_pix, payload):
+    hub = get_order_status_hub()
+    yield _sse_event(payload, ORDER_STATUS_RETRY_MS)
+    deadline = time.monotonic() + ORDER_STATUS_STREAM_SECONDS
+    while not _order_status_is_final(payload) and time.monotonic() < deadline:
+        version = await hub.wait_for_change(order_id, payload['version'], ORDER_STATUS_HEARTBEAT_SECONDS)
+        if version == payload['version']:
+            # Sem webhook no intervalo: confere no MP (cacheado) e mantem a conexao viva.
+            await _arefresh_order_from_mp(order_id)
+            yield ': ping\n\n'
+            continue
+        payload = await _aorder_status_payload(order_id, include_pix)
+        yield _sse_event(payload)
+
+
+@require_GET
+async def order_status_stream(request, order_id):
+    include_pix = bool(request.GET.get('pix'))
+    if _is_asgi_request(request):
+        payload = await _aorder_status_payload(order_id, include_pix)
+        events = _order_status_events(order_id, include_pix, payload)
+    else:
+        # WSGI: um evento por conexao; o EventSource reconecta sozinho (retry).
+        await _arefresh_order_from_mp(order_id, asgi=False)
+        payload = await _aorder_status_payload(order_id, include_pix)
+        events = [_sse_event(payload, ORDER_STATUS_RETRY_MS)]
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@require_GET
+async def order_status_wait(request, order_id):
+    # Long-poll para navegadores sem EventSource: ?since=<version> segura a
+    # resposta ate o status mudar ou ORDER_STATUS_WAIT_SECONDS passar.
+    include_pix = bool(request.GET.get('pix'))
+    try:
+        since = int(request.GET.get('since', ''))
+    except ValueError:
+        since = None
+    asgi = _is_asgi_request(request)
+    if since is not None:
+        changed = False
+        if asgi:
+            version = await get_order_status_hub().wait_for_change(order_id, since, ORDER_STATUS_WAIT_SECONDS)
+            changed = version != since
+        if not changed:
+            await _arefresh_order_from_mp(order_id, asgi=asgi)
+    payload = await _aorder_status_payload(order_id, include_pix)
+    payload['retry_ms'] = 0 if asgi else ORDER_STATUS_RETRY_MS
+    return JsonResponse(payload)
+
+
+@require_GET
+def order_pix_qr_image(request, order_id, digest):
+    signature = request.GET.get('sig', '')
+    if not signature or not constant_time_compare(signature, _pix_qr_signature(order_id, digest)):
+        return HttpResponseForbidden('Link invalido.')
+
+    etag = f'"{digest}"'
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponse(status=304)
+    else:
+        # Qualquer tentativa do pedido: o link de um Pix anterior continua valido.
+        attempts = PaymentAttempt.objects.filter(order_id=order_id).exclude(pix_code='')
+        pix_codes = attempts.values_list('pix_code', flat=True)
+        pix_code = next((code for code in pix_codes if _pix_code_digest(code) == digest), None)
+        if pix_code is None:
+            raise Http404('QR Code nao encontrado.')
+        response = HttpResponse(_get_or_create_pix_qr_png(order_id, digest, pix_code), content_type='image/png')
+    response['ETag'] = etag
+    response['Cache-Control'] = f'public, max-age={PIX_QR_CACHE_SECONDS}, immutable'
+    return response
 
 
 @csrf_exempt
@@ -2361,26 +3596,180 @@ def payments_webhook(request):
     if not _is_valid_mp_webhook_signature(request, payment_id):
         return JsonResponse({'error': 'assinatura invÃ¡lida'}, status=401)
 
-    try:
-        payment_data = _get_mp_payment(payment_id)
-    except ValueError:
-        return JsonResponse({'ok': False, 'error': 'payment_lookup_failed'}, status=400)
+    queued = _record_webhook_event(request, payment_id)
+    return JsonResponse({'ok': True, 'queued': queued})
 
-    external_reference = payment_data.get('external_reference', '')
+
+@csrf_exempt
+@require_POST
+async def payments_webhook_async(request):
+    payment_id = _extract_webhook_payment_id(request)
+    if not payment_id:
+        return JsonResponse({'ok': True, 'ignored': 'without_payment_id'})
+
+    if not _is_valid_mp_webhook_signature(request, payment_id):
+        return JsonResponse({'error': 'assinatura invÃ¡lida'}, status=401)
+
+    queued = await sync_to_async(_record_webhook_event)(request, payment_id)
+    return JsonResponse({'ok': True, 'queued': queued})
+
+
+def _webhook_inline_drain_enabled():
+    # Sem worker dedicado (process_webhooks), o proprio processo web esvazia a
+    # inbox em segundo plano.
+    return os.getenv('MP_WEBHOOK_INLINE_DRAIN', '1').strip().lower() in {'1', 'true', 'on', 'yes'}
+
+
+def _record_webhook_event(request, payment_id):
+    request_id = request.headers.get('x-request-id', '').strip()[:80]
+    payload = request.body.decode('utf-8', 'replace')
+    if request_id:
+        _, created = PaymentWebhookEvent.objects.get_or_create(
+            request_id=request_id,
+            defaults={'payment_id': payment_id, 'payload': payload},
+        )
+    elif PaymentWebhookEvent.objects.filter(payment_id=payment_id, status=PaymentWebhookEvent.STATUS_PENDING).exists():
+        # Reenvio sem x-request-id: ja existe evento pendente para o pagamento.
+        created = False
+    else:
+        PaymentWebhookEvent.objects.create(payment_id=payment_id, payload=payload)
+        created = True
+
+    if created and _webhook_inline_drain_enabled():
+        transaction.on_commit(partial(submit_background, _drain_webhook_inbox))
+    return created
+
+
+def _process_webhook_payment(payment_id):
+    payment_data = _get_mp_payment(payment_id)
+    _remember_mp_payment(payment_id, payment_data)
+
+    orders = Order.objects.select_related('current_payment')
     order = None
-    if external_reference.startswith('ORDER_'):
-        try:
-            order_id = int(external_reference.replace('ORDER_', '', 1))
-            order = Order.objects.filter(id=order_id).first()
-        except ValueError:
-            order = None
+    order_id = _webhook_order_id(payment_data)
+    if order_id:
+        order = orders.filter(id=order_id).first()
     if order is None:
-        order = Order.objects.filter(mp_payment_id=str(payment_data.get('id', ''))).first()
+        order = orders.filter(payment_attempts__payment_id=str(payment_data.get('id', ''))).first()
     if order is None:
-        return JsonResponse({'ok': True, 'ignored': 'order_not_found'})
+        return False
 
     _sync_order_from_mp_payment(order, payment_data)
-    return JsonResponse({'ok': True})
+    return True
+
+
+def _webhook_retry_delay(attempts):
+    return min(WEBHOOK_BACKOFF_MAX_SECONDS, WEBHOOK_BACKOFF_SECONDS * 2 ** max(0, attempts - 1))
+
+
+def _drain_webhook_inbox(limit=WEBHOOK_DRAIN_BATCH):
+    # Uma passada pela inbox em ordem de chegada. Eventos repetidos do mesmo
+    # pagamento viram uma unica consulta ao MP; falhas voltam para a fila com
+    # espera crescente ate WEBHOOK_MAX_ATTEMPTS e depois ficam como "failed"
+    # (replay_webhooks). Com o circuito do MP aberto a tentativa nao conta.
+    events = PaymentWebhookEvent.objects
+    stats = {'events': 0, 'payments': 0, 'coalesced': 0, 'failed': 0}
+    now = timezone.now()
+    events.filter(
+        status=PaymentWebhookEvent.STATUS_PROCESSING,
+        locked_at__lt=now - timedelta(seconds=WEBHOOK_LOCK_SECONDS),
+    ).update(status=PaymentWebhookEvent.STATUS_PENDING, locked_at=None)
+
+    payment_ids = []
+    for payment_id in events.filter(
+        status=PaymentWebhookEvent.STATUS_PENDING,
+        next_attempt_at__lte=now,
+    ).order_by('id').values_list('payment_id', flat=True)[:limit]:
+        if payment_id not in payment_ids:
+            payment_ids.append(payment_id)
+
+    for payment_id in payment_ids:
+        locked_at = timezone.now()
+        claimed = events.filter(
+            payment_id=payment_id,
+            status=PaymentWebhookEvent.STATUS_PENDING,
+            next_attempt_at__lte=locked_at,
+        ).update(
+            status=PaymentWebhookEvent.STATUS_PROCESSING,
+            locked_at=locked_at,
+        )
+        if not claimed:
+            # Outro worker pegou este pagamento.
+            continue
+        claimed_events = events.filter(
+            payment_id=payment_id,
+            status=PaymentWebhookEvent.STATUS_PROCESSING,
+            locked_at=locked_at,
+        )
+        stats['events'] += claimed
+        stats['payments'] += 1
+        stats['coalesced'] += claimed - 1
+
+        try:
+            found = _process_webhook_payment(payment_id)
+        except CircuitOpenError as exc:
+            # MP fora do ar: espera o circuito tentar de novo sem gastar tentativa.
+            stats['failed'] += 1
+            claimed_events.update(
+                status=PaymentWebhookEvent.STATUS_PENDING,
+                last_error=str(exc)[:255],
+                locked_at=None,
+                next_attempt_at=timezone.now() + timedelta(seconds=_mp_circuit_breaker().reset_timeout),
+            )
+            continue
+        except Exception as exc:
+            error = str(exc)[:255]
+            stats['failed'] += 1
+            claimed_events.filter(attempts__gte=WEBHOOK_MAX_ATTEMPTS - 1).update(
+                status=PaymentWebhookEvent.STATUS_FAILED,
+                attempts=F('attempts') + 1,
+                last_error=error,
+                locked_at=None,
+            )
+            # Mesma espera para todos os eventos do pagamento: conta pela maior tentativa.
+            attempts = max(claimed_events.values_list('attempts', flat=True), default=0) + 1
+            claimed_events.update(
+                status=PaymentWebhookEvent.STATUS_PENDING,
+                attempts=F('attempts') + 1,
+                last_error=error,
+                locked_at=None,
+                next_attempt_at=timezone.now() + timedelta(seconds=_webhook_retry_delay(attempts)),
+            )
+            continue
+
+        claimed_events.update(
+            status=PaymentWebhookEvent.STATUS_PROCESSED if found else PaymentWebhookEvent.STATUS_IGNORED,
+            attempts=F('attempts') + 1,
+            last_error='' if found else 'order_not_found',
+            locked_at=None,
+            processed_at=timezone.now(),
+        )
+    return stats
+
+
+def _replay_webhook_events(event_ids=None, since=None):
+    failed = PaymentWebhookEvent.objects.filter(status=PaymentWebhookEvent.STATUS_FAILED)
+    if event_ids:
+        failed = failed.filter(id__in=event_ids)
+    if since is not None:
+        failed = failed.filter(received_at__gte=since)
+    return failed.update(
+        status=PaymentWebhookEvent.STATUS_PENDING,
+        attempts=0,
+        last_error='',
+        locked_at=None,
+        next_attempt_at=timezone.now(),
+    )
+
+
+def _webhook_order_id(payment_data):
+    external_reference = payment_data.get('external_reference', '')
+    if not external_reference.startswith('ORDER_'):
+        return None
+    try:
+        return int(external_reference.replace('ORDER_', '', 1))
+    except ValueError:
+        return None
 
 
 
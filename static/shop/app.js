@@ -7,6 +7,7 @@
     const cartTotal = document.getElementById('cart-total');
     const cartItems = document.getElementById('cart-items');
     const checkoutForm = document.getElementById('checkout-form');
+    const checkoutQueue = document.getElementById('checkout-queue');
 
     const loginOverlay = document.getElementById('login-modal-overlay');
     const loginModal = document.getElementById('login-modal');
@@ -28,23 +29,57 @@
     const successOkButton = document.getElementById('success-ok-btn');
     const successOrderDetails = document.getElementById('success-order-details');
 
-    const initialCart = JSON.parse(document.getElementById('initial-cart').textContent);
-    const cartUpdateTemplate = document.body.dataset.cartUpdateTemplate;
+    const staffOnlyLinks = document.querySelectorAll('[data-staff-only]');
+
+    const emptyCart = { items: [], total: '0.00', count: 0 };
+    const cartBatchUrl = document.body.dataset.cartBatchUrl;
     const checkoutFinalizeUrl = document.body.dataset.checkoutFinalizeUrl;
-    const checkoutStatusTemplate = document.body.dataset.checkoutStatusTemplate;
+    const orderStatusStreamTemplate = document.body.dataset.orderStatusStreamTemplate;
+    const orderStatusWaitTemplate = document.body.dataset.orderStatusWaitTemplate;
     const authLoginUrl = document.body.dataset.authLoginUrl;
+    const cartStateUrl = document.body.dataset.cartStateUrl;
+    const cartCookieName = document.body.dataset.cartCookieName;
+    const staffCookieName = document.body.dataset.staffCookieName;
+    const csrfCookieName = document.body.dataset.csrfCookieName;
 
     let currentPixCode = '';
     let currentOrderId = null;
-    let paymentPollInterval = null;
+    let stopOrderStatusSubscription = null;
     let currentOrderSummary = null;
     let currentPrintUrl = '';
     let currentBluetoothTicketText = '';
     let paymentApprovedShown = false;
+    let waitingPixCode = false;
+    let csrfTokenValue = '';
+    let cartStateRequest = null;
+    let currentCart = emptyCart;
+    let pendingCartOperations = [];
+    let cartFlushTimer = null;
+    let cartFlushRequest = null;
+    // Toques rapidos em +/- viram um unico POST em cart/batch/.
+    const CART_BATCH_DELAY_MS = 350;
+
+    function getCookie(name) {
+        if (!name) {
+            return '';
+        }
+        const prefix = `${name}=`;
+        const match = document.cookie
+            .split(';')
+            .map((part) => part.trim())
+            .find((part) => part.startsWith(prefix));
+        return match ? decodeURIComponent(match.slice(prefix.length)) : '';
+    }
 
-    function csrfToken() {
-        const input = document.querySelector('input[name=csrfmiddlewaretoken]');
-        return input ? input.value : '';
+    async function ensureCsrfToken() {
+        const cookieToken = getCookie(csrfCookieName);
+        if (cookieToken) {
+            return cookieToken;
+        }
+        if (!csrfTokenValue) {
+            await loadCartState();
+        }
+        return csrfTokenValue;
     }
 
     function showError(message) {
@@ -60,17 +95,21 @@
         }
 
         if (!response.ok) {
-            throw new Error(payload.error || 'Falha ao processar a solicitação.');
+            const error = new Error(payload.error || 'Falha ao processar a solicitação.');
+            error.status = response.status;
+            error.payload = payload;
+            throw error;
         }
         return payload;
     }
 
     async function post(url, body) {
         const data = new URLSearchParams(body);
+        const token = await ensureCsrfToken();
         const response = await fetch(url, {
             method: 'POST',
             headers: {
-                'X-CSRFToken': csrfToken(),
+                'X-CSRFToken': token,
                 'Content-Type': 'application/x-www-form-urlencoded',
             },
             body: data,
@@ -159,7 +198,7 @@
     function closePaymentModal() {
         paymentOverlay.hidden = true;
         paymentModal.hidden = true;
-        stopPaymentStatusPolling();
+        stopPaymentStatusWatch();
     }
 
     function openSuccessModal() {
@@ -172,55 +211,140 @@
         successModal.hidden = true;
     }
 
-    function stopPaymentStatusPolling() {
-        if (paymentPollInterval) {
-            window.clearInterval(paymentPollInterval);
-            paymentPollInterval = null;
+    function stopPaymentStatusWatch() {
+        if (stopOrderStatusSubscription) {
+            stopOrderStatusSubscription();
+            stopOrderStatusSubscription = null;
         }
     }
 
-    async function fetchPaymentStatus(orderId) {
-        const statusUrl = checkoutStatusTemplate.replace('/0/', `/${orderId}/`);
-        const response = await fetch(statusUrl, { method: 'GET' });
-        return parseResponse(response);
+    function orderStatusUrl(template, orderId, params) {
+        const query = new URLSearchParams(params).toString();
+        const url = template.replace('/0/', `/${orderId}/`);
+        return query ? `${url}?${query}` : url;
     }
 
-    async function refreshPaymentStatus() {
-        if (!currentOrderId) {
-            return;
+    function subscribeOrderStatus(orderId, params, onPayload, onError) {
+        // SSE quando o navegador suporta; senao long-poll com ?since=<version>.
+        if (window.EventSource) {
+            const source = new EventSource(orderStatusUrl(orderStatusStreamTemplate, orderId, params));
+            source.onmessage = (event) => onPayload(JSON.parse(event.data));
+            source.onerror = () => {
+                if (source.readyState === EventSource.CLOSED) {
+                    onError(new Error('Conexao de status encerrada.'));
+                }
+            };
+            return () => source.close();
         }
 
-        try {
-            const payload = await fetchPaymentStatus(currentOrderId);
-            paymentStatusLabel.textContent = payload.status_label || 'Aguardando pagamento';
-            if (payload.is_paid) {
-                paymentMessage.textContent = `Pagamento aprovado. Pedido #${payload.order_id}.`;
-                stopPaymentStatusPolling();
-                if (!paymentApprovedShown) {
-                    paymentApprovedShown = true;
-                    const summary = currentOrderSummary || {};
-                    const customerName = summary.customer_name || 'Cliente';
-                    const whatsapp = summary.whatsapp || '-';
-                    const total = summary.total || '0.00';
-                    successOrderDetails.textContent = `Pedido #${payload.order_id} | ${customerName} | WhatsApp: ${whatsapp} | Total: R$ ${total}`;
-                    openSuccessModal();
+        let active = true;
+        let since = '';
+        const waitFor = (ms) => new Promise((resolve) => window.setTimeout(resolve, ms));
+        (async function longPoll() {
+            while (active) {
+                try {
+                    const query = since === '' ? params : { ...params, since };
+                    const response = await fetch(orderStatusUrl(orderStatusWaitTemplate, orderId, query), { method: 'GET' });
+                    const payload = await parseResponse(response);
+                    if (!active) {
+                        return;
+                    }
+                    since = payload.version;
+                    onPayload(payload);
+                    if (payload.retry_ms) {
+                        await waitFor(payload.retry_ms);
+                    }
+                } catch (error) {
+                    if (active) {
+                        active = false;
+                        onError(error);
+                    }
                 }
             }
-        } catch (error) {
-            stopPaymentStatusPolling();
-            showError(error.message);
+        })();
+        return () => {
+            active = false;
+        };
+    }
+
+    function handlePaymentStatus(payload) {
+        paymentStatusLabel.textContent = payload.status_label || 'Aguardando pagamento';
+        if (waitingPixCode && payload.status === 'failed') {
+            waitingPixCode = false;
+            paymentMessage.textContent = payload.status_detail || 'Nao foi possivel gerar o Pix. Tente novamente.';
+            stopPaymentStatusWatch();
+            return;
+        }
+        if (waitingPixCode && payload.pix_code) {
+            showPixCode(payload);
+            paymentMessage.textContent = `Pix gerado. Pedido #${payload.order_id}.`;
+        }
+        if (payload.is_paid) {
+            paymentMessage.textContent = `Pagamento aprovado. Pedido #${payload.order_id}.`;
+            stopPaymentStatusWatch();
+            if (!paymentApprovedShown) {
+                paymentApprovedShown = true;
+                const summary = currentOrderSummary || {};
+                const customerName = summary.customer_name || 'Cliente';
+                const whatsapp = summary.whatsapp || '-';
+                const total = summary.total || '0.00';
+                successOrderDetails.textContent = `Pedido #${payload.order_id} | ${customerName} | WhatsApp: ${whatsapp} | Total: R$ ${total}`;
+                openSuccessModal();
+            }
         }
     }
 
-    function startPaymentStatusPolling(orderId) {
+    function showPixCode(payload) {
+        waitingPixCode = false;
+        currentPixCode = payload.pix_code || '';
+        paymentQr.hidden = !payload.qr_code_url;
+        if (payload.qr_code_url) {
+            paymentQr.src = payload.qr_code_url;
+        }
+    }
+
+    function watchPaymentStatus(orderId) {
         currentOrderId = orderId;
         paymentApprovedShown = false;
-        stopPaymentStatusPolling();
-        refreshPaymentStatus();
-        paymentPollInterval = window.setInterval(refreshPaymentStatus, 5000);
+        stopPaymentStatusWatch();
+        // ?pix=1 enquanto o Pix e criado em segundo plano: o QR chega pelo mesmo canal.
+        stopOrderStatusSubscription = subscribeOrderStatus(
+            orderId,
+            waitingPixCode ? { pix: '1' } : {},
+            handlePaymentStatus,
+            (error) => {
+                stopPaymentStatusWatch();
+                showError(error.message);
+            }
+        );
+    }
+
+    function showStaffLinks(isAuthenticated) {
+        staffOnlyLinks.forEach((link) => {
+            link.hidden = !isAuthenticated;
+        });
+    }
+
+    function loadCartState() {
+        // A pagina vem de cache publico; carrinho, login e token CSRF chegam aqui.
+        if (!cartStateRequest) {
+            cartStateRequest = fetch(cartStateUrl, { method: 'GET', credentials: 'same-origin' })
+                .then(parseResponse)
+                .then((payload) => {
+                    csrfTokenValue = payload.csrf_token || '';
+                    renderCart(payload.cart || emptyCart);
+                    showStaffLinks(Boolean(payload.is_authenticated));
+                    return payload;
+                })
+                .finally(() => {
+                    cartStateRequest = null;
+                });
+        }
+        return cartStateRequest;
     }
 
     function renderCart(cart) {
+        currentCart = cart;
         cartCountBadges.forEach((badge) => {
             badge.textContent = cart.count;
         });
@@ -295,6 +419,7 @@
                     const quantity = form.querySelector('.qty-input').value;
                     const variantSelect = form.querySelector('.variant-select');
                     const variantId = variantSelect ? variantSelect.value : '';
+                    await flushCartOperations();
                     const cart = await post(form.dataset.url, { quantity, variant_id: variantId });
                     renderCart(cart);
                     openCart();
@@ -305,30 +430,125 @@
         });
     }
 
+    function applyLocalCartOperation(operation) {
+        // Atualiza a tela na hora; a resposta do lote substitui estes valores.
+        const items = currentCart.items
+            .map((item) => {
+                const sameItem = String(item.id) === String(operation.product_id)
+                    && String(item.variant_id || '') === String(operation.variant_id || '');
+                if (!sameItem) {
+                    return item;
+                }
+                let quantity = item.quantity;
+                if (operation.action === 'inc') {
+                    quantity += 1;
+                } else if (operation.action === 'dec') {
+                    quantity -= 1;
+                } else if (operation.action === 'set') {
+                    quantity = operation.quantity;
+                }
+                const subtotal = (parseFloat(item.price) * quantity).toFixed(2);
+                return { ...item, quantity, subtotal };
+            })
+            .filter((item) => item.quantity > 0);
+        const total = items.reduce((sum, item) => sum + parseFloat(item.subtotal), 0).toFixed(2);
+        const count = items.reduce((sum, item) => sum + item.quantity, 0);
+        renderCart({ items, total, count });
+    }
+
+    function flushCartOperations() {
+        if (cartFlushTimer) {
+            clearTimeout(cartFlushTimer);
+            cartFlushTimer = null;
+        }
+        if (cartFlushRequest) {
+            return cartFlushRequest.then(() => flushCartOperations());
+        }
+        if (!pendingCartOperations.length) {
+            return Promise.resolve();
+        }
+
+        const operations = pendingCartOperations;
+        pendingCartOperations = [];
+        cartFlushRequest = post(cartBatchUrl, { operations: JSON.stringify(operations) })
+            .then((cart) => {
+                if (!pendingCartOperations.length) {
+                    renderCart(cart);
+                }
+            })
+            .catch((error) => {
+                showError(error.message);
+                return loadCartState();
+            })
+            .finally(() => {
+                cartFlushRequest = null;
+            });
+        return cartFlushRequest;
+    }
+
+    function queueCartOperation(operation) {
+        pendingCartOperations.push(operation);
+        applyLocalCartOperation(operation);
+        if (cartFlushTimer) {
+            clearTimeout(cartFlushTimer);
+        }
+        cartFlushTimer = setTimeout(flushCartOperations, CART_BATCH_DELAY_MS);
+    }
+
     function bindCartActions() {
         cartItems.querySelectorAll('.cart-item').forEach((row) => {
-            const id = row.dataset.id;
+            const productId = row.dataset.id;
             const variantId = row.dataset.variantId || '';
-            const updateUrl = cartUpdateTemplate.replace('/0/', `/${id}/`);
             row.querySelectorAll('button').forEach((button) => {
-                button.addEventListener('click', async () => {
-                    try {
-                        const action = button.dataset.action;
-                        const cart = await post(updateUrl, {
-                            action: action === 'remove' ? 'set' : action,
-                            quantity: action === 'remove' ? '0' : '1',
-                            variant_id: variantId,
-                        });
-                        renderCart(cart);
-                    } catch (error) {
-                        showError(error.message);
-                    }
+                button.addEventListener('click', () => {
+                    const action = button.dataset.action;
+                    queueCartOperation({
+                        action: action === 'remove' ? 'set' : action,
+                        quantity: action === 'remove' ? 0 : 1,
+                        product_id: productId,
+                        variant_id: variantId,
+                    });
                 });
             });
         });
     }
 
+    async function postCheckout(body) {
+        // Servidor lotado devolve 503 com Retry-After: espera e tenta de novo.
+        try {
+            while (true) {
+                try {
+                    return await post(checkoutFinalizeUrl, body);
+                } catch (error) {
+                    if (!error.payload || !error.payload.busy) {
+                        throw error;
+                    }
+                    const retryAfter = Math.max(1, Number(error.payload.retry_after) || 1);
+                    if (checkoutQueue) {
+                        checkoutQueue.textContent = `Loja cheia agora. Tentando de novo em ${retryAfter}s...`;
+                        checkoutQueue.hidden = false;
+                    }
+                    await new Promise((resolve) => window.setTimeout(resolve, retryAfter * 1000));
+                }
+            }
+        } finally {
+            if (checkoutQueue) {
+                checkoutQueue.hidden = true;
+            }
+        }
+    }
+
+    function newIdempotencyKey() {
+        if (window.crypto && window.crypto.randomUUID) {
+            return window.crypto.randomUUID();
+        }
+        return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+    }
+
     function bindCheckoutForm() {
+        // Uma chave por pedido: toque duplo ou reenvio apos falha de rede devolve
+        // o mesmo pedido. So muda depois de um pedido concluido.
+        let checkoutIdempotencyKey = newIdempotencyKey();
         checkoutForm.addEventListener('submit', async (event) => {
             event.preventDefault();
             const formData = new FormData(checkoutForm);
@@ -343,18 +563,26 @@
             }
 
             try {
-                const payload = await post(checkoutFinalizeUrl, {
+                await flushCartOperations();
+                const payload = await postCheckout({
                     first_name: formData.get('first_name') || '',
                     last_name: formData.get('last_name') || '',
                     whatsapp: formData.get('whatsapp') || '',
                     payment_method: formData.get('payment_method') || '',
+                    idempotency_key: checkoutIdempotencyKey,
                 });
+                checkoutIdempotencyKey = newIdempotencyKey();
 
                 renderCart(payload.cart);
                 paymentMessage.textContent = `${payload.message} Pedido #${payload.order_id}.`;
                 paymentStatusLabel.textContent = payload.status_label || 'Aguardando pagamento';
-                paymentQr.src = `data:image/png;base64,${payload.qr_code_base64}`;
-                currentPixCode = payload.pix_code;
+                waitingPixCode = payload.order_status === 'creating';
+                if (waitingPixCode) {
+                    currentPixCode = '';
+                    paymentQr.hidden = true;
+                } else {
+                    showPixCode(payload);
+                }
                 currentOrderSummary = payload.order_summary || null;
                 currentBluetoothTicketText = buildBluetoothTicketText(payload.order_id, currentOrderSummary || {});
                 currentPrintUrl = payload.print_url || '';
@@ -362,7 +590,7 @@
                     currentPrintUrl = `/orders/print/${payload.order_id}/`;
                 }
                 checkoutForm.reset();
-                startPaymentStatusPolling(payload.order_id);
+                watchPaymentStatus(payload.order_id);
                 openPaymentModal();
                 if (androidDevice) {
                     openRawBtIntent(currentBluetoothTicketText);
@@ -438,5 +666,10 @@
     bindAddToCartForms();
     bindCheckoutForm();
     bindLoginForm();
-    renderCart(initialCart);
+    renderCart(emptyCart);
+    if (getCookie(cartCookieName) || getCookie(staffCookieName)) {
+        loadCartState().catch(() => {
+            renderCart(emptyCart);
+        });
+    }
 })();
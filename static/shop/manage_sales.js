@@ -1,6 +1,7 @@
 (function () {
     const createSaleUrl = document.body.dataset.createSaleUrl;
-    const checkoutStatusTemplate = document.body.dataset.checkoutStatusTemplate;
+    const orderStatusStreamTemplate = document.body.dataset.orderStatusStreamTemplate;
+    const orderStatusWaitTemplate = document.body.dataset.orderStatusWaitTemplate;
     const printOrderTemplate = document.body.dataset.printOrderTemplate;
 
     const saleForm = document.getElementById('sale-form');
@@ -30,7 +31,7 @@
     let saleCart = [];
     let currentPixCode = '';
     let currentOrderId = null;
-    let statusPoller = null;
+    let stopOrderStatusSubscription = null;
     let pendingSale = null;
     let creatingSale = false;
     let currentBluetoothTicketText = '';
@@ -180,7 +181,7 @@
         stopSaleModalAutoClose();
         modalOverlay.hidden = true;
         modal.hidden = true;
-        stopPixStatusPolling();
+        stopPixStatusWatch();
     }
 
     function stopSaleModalAutoClose() {
@@ -424,38 +425,84 @@
         });
     }
 
-    function stopPixStatusPolling() {
-        if (statusPoller) {
-            window.clearInterval(statusPoller);
-            statusPoller = null;
+    function stopPixStatusWatch() {
+        if (stopOrderStatusSubscription) {
+            stopOrderStatusSubscription();
+            stopOrderStatusSubscription = null;
         }
     }
 
-    async function pollPixStatus() {
-        if (!currentOrderId) {
+    function orderStatusUrl(template, orderId, params) {
+        const query = new URLSearchParams(params).toString();
+        const url = template.replace('/0/', `/${orderId}/`);
+        return query ? `${url}?${query}` : url;
+    }
+
+    function subscribeOrderStatus(orderId, onPayload, onError) {
+        // SSE quando o navegador suporta; senao long-poll com ?since=<version>.
+        if (window.EventSource) {
+            const source = new EventSource(orderStatusUrl(orderStatusStreamTemplate, orderId, {}));
+            source.onmessage = (event) => onPayload(JSON.parse(event.data));
+            source.onerror = () => {
+                if (source.readyState === EventSource.CLOSED) {
+                    onError(new Error('Conexao de status encerrada.'));
+                }
+            };
+            return () => source.close();
+        }
+
+        let active = true;
+        let since = '';
+        const waitFor = (ms) => new Promise((resolve) => window.setTimeout(resolve, ms));
+        (async function longPoll() {
+            while (active) {
+                try {
+                    const query = since === '' ? {} : { since };
+                    const response = await fetch(orderStatusUrl(orderStatusWaitTemplate, orderId, query), { method: 'GET' });
+                    const payload = await parseResponse(response);
+                    if (!active) {
+                        return;
+                    }
+                    since = payload.version;
+                    onPayload(payload);
+                    if (payload.retry_ms) {
+                        await waitFor(payload.retry_ms);
+                    }
+                } catch (error) {
+                    if (active) {
+                        active = false;
+                        onError(error);
+                    }
+                }
+            }
+        })();
+        return () => {
+            active = false;
+        };
+    }
+
+    function handlePixStatus(payload) {
+        if (payload.order_id !== currentOrderId) {
             return;
         }
-        try {
-            const response = await fetch(checkoutStatusTemplate.replace('/0/', `/${currentOrderId}/`), {
-                method: 'GET',
-            });
-            const payload = await parseResponse(response);
-            modalStatus.textContent = payload.status_label || 'Aguardando pagamento';
-            if (payload.is_paid) {
-                modalMessage.textContent = `Pagamento aprovado para a venda #${payload.order_id}. Enviando impressao...`;
-                if (!pixApprovedPrinted) {
-                    pixApprovedPrinted = true;
-                    printTicketBtn.hidden = true;
-                    triggerApprovedPixPrint();
-                    scheduleSaleModalAutoClose();
-                }
-                stopPixStatusPolling();
+        modalStatus.textContent = payload.status_label || 'Aguardando pagamento';
+        if (payload.is_paid) {
+            modalMessage.textContent = `Pagamento aprovado para a venda #${payload.order_id}. Enviando impressao...`;
+            if (!pixApprovedPrinted) {
+                pixApprovedPrinted = true;
+                printTicketBtn.hidden = true;
+                triggerApprovedPixPrint();
+                scheduleSaleModalAutoClose();
             }
-        } catch (error) {
-            stopPixStatusPolling();
+            stopPixStatusWatch();
         }
     }
 
+    function watchPixStatus(orderId) {
+        stopPixStatusWatch();
+        stopOrderStatusSubscription = subscribeOrderStatus(orderId, handlePixStatus, stopPixStatusWatch);
+    }
+
     function collectSaleData() {
         const formData = new FormData(saleForm);
         const customerName = String(formData.get('customer_name') || '').trim();
@@ -463,11 +510,15 @@
         return { customerName, whatsapp };
     }
 
-    async function createSaleWithPayment(paymentMethod) {
+    async function createSaleWithPayment(paymentChoice) {
         if (creatingSale || !pendingSale) {
             return;
         }
 
+        // "pix_local": BR Code gerado no servidor pela chave Pix, sem Mercado Pago.
+        const pixLocal = paymentChoice === 'pix_local';
+        const paymentMethod = pixLocal ? 'pix' : paymentChoice;
+
         creatingSale = true;
         closePaymentChoiceModal();
 
@@ -477,6 +528,7 @@
                 customer_name: pendingSale.customerName,
                 whatsapp: pendingSale.whatsapp,
                 payment_method: paymentMethod,
+                pix_provider: pixLocal ? 'local' : '',
                 mark_paid_now: 'false',
                 items_json: JSON.stringify(
                     saleCart.map((item) => ({
@@ -497,17 +549,15 @@
             );
             printTicketBtn.hidden = isAndroidDevice() || !currentOrderId;
 
-            if (paymentMethod === 'pix' && payload.qr_code_base64) {
+            if (paymentMethod === 'pix' && payload.qr_code_url) {
                 modalTitle.textContent = 'Pagamento Pix';
                 modalMessage.textContent = payload.message || 'Venda criada. Gere o Pix.';
                 modalStatus.textContent = payload.status_label || 'Aguardando pagamento';
-                modalQr.src = `data:image/png;base64,${payload.qr_code_base64}`;
+                modalQr.src = payload.qr_code_url;
                 modalQr.hidden = false;
                 copyPixBtn.hidden = false;
                 printTicketBtn.hidden = true;
-                stopPixStatusPolling();
-                statusPoller = window.setInterval(pollPixStatus, 5000);
-                pollPixStatus();
+                watchPixStatus(payload.order_id);
             } else {
                 modalTitle.textContent = 'Venda criada';
                 modalMessage.textContent = payload.message || `Venda #${payload.order_id} criada.`;
@@ -516,7 +566,7 @@
                 modalQr.hidden = true;
                 copyPixBtn.hidden = true;
                 printTicketBtn.hidden = true;
-                stopPixStatusPolling();
+                stopPixStatusWatch();
             }
 
             saleCart = [];